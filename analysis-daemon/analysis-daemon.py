@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# A resident daemon that keeps a per-sequence feature table of a corpus of
+# recordings in memory and answers JSON queries over a Unix socket:
+#
+#       $ ./analysis-daemon.py serve recordings/
+#       $ ./analysis-daemon.py query '{"query": "percentiles", "column": "duration_ms",
+#                                      "filter": {"device": "Synaptics", "since": "7d"}}'
+#
+# The corpus directories are rescanned periodically, new and changed
+# recordings are parsed and removed ones are dropped. See README.md for the
+# query format.
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import fnmatch
+import json
+import math
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import DeviceError, load_recording
+from shared.parallel import imap_files
+
+# column name : (dtype, description)
+COLUMNS = {
+    "recorded": ("float64", "mtime of the recording in seconds since the epoch"),
+    "start_ms": ("float64", "start time of the sequence within the recording in ms"),
+    "duration_ms": ("float64", "time between first and last point in ms"),
+    "max_move_mm": ("float64", "maximum distance from the first point in mm"),
+    "distance_mm": ("float64", "total distance moved in mm"),
+    "x": ("float64", "x of the first point, 0 to 1 across the sensor"),
+    "y": ("float64", "y of the first point, 0 to 1 across the sensor"),
+    "x_mm": ("float64", "x of the first point in mm"),
+    "y_mm": ("float64", "y of the first point in mm"),
+    "max_pressure": ("float64", "maximum pressure or null"),
+    "points": ("int64", "number of points"),
+    "fingers": ("int64", "maximum number of fingers down"),
+    "single": ("bool", "true if this was the only finger down"),
+    "buttons": ("bool", "true if a button was down during the sequence"),
+}
+
+def default_socket_path():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "input-analysis.sock")
+    return "/tmp/input-analysis-{}.sock".format(os.getuid())
+
+def sequence_features(path):
+    """
+    Return the tuple (device name, columns) for the recording, columns is
+    a dict of numpy arrays with one element per touch sequence, see
+    COLUMNS
+    """
+    d, seqs = load_recording(path)
+    seqs = [ s for s in seqs if s.points ]
+    mtime = os.stat(path).st_mtime
+
+    rows = []
+    for s in seqs:
+        first = s.first
+        max_move = 0
+        distance = 0
+        max_pressure = first.pressure
+        prev = first
+        for p in s.points:
+            delta = p - first
+            max_move = max(max_move, math.hypot(delta.x, delta.y))
+            delta = p - prev
+            distance += math.hypot(delta.x, delta.y)
+            prev = p
+            if p.pressure is not None:
+                max_pressure = max(max_pressure, p.pressure)
+
+        rows.append((mtime,
+                     s.times[0] / 1000.0,
+                     (s.last.time - first.time) / 1000.0,
+                     max_move,
+                     distance,
+                     first.percent[0], first.percent[1],
+                     first.mm[0], first.mm[1],
+                     numpy.nan if max_pressure is None else max_pressure,
+                     len(s.points),
+                     s.max_fingers,
+                     s.is_single,
+                     s.buttons is not None))
+
+    names = [ "recorded", "start_ms", "duration_ms", "max_move_mm", "distance_mm",
+              "x", "y", "x_mm", "y_mm", "max_pressure", "points", "fingers",
+              "single", "buttons" ]
+    columns = {}
+    for i, name in enumerate(names):
+        columns[name] = numpy.array([ r[i] for r in rows ], dtype=COLUMNS[name][0])
+    return getattr(d, "name", ""), columns
+
+class QueryError(Exception):
+    pass
+
+def _parse_time(value):
+    """
+    Return the time in seconds since the epoch for a number, an ISO date
+    "2016-05-01" or "2016-05-01T12:00:00", or a relative time "7d", "12h"
+    or "30m" before now
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = { "d": 86400, "h": 3600, "m": 60, "s": 1 }
+    try:
+        if value[-1:] in units:
+            return time.time() - float(value[:-1]) * units[value[-1]]
+        for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+            try:
+                return time.mktime(datetime.datetime.strptime(value, fmt).timetuple())
+            except ValueError:
+                pass
+    except (TypeError, ValueError):
+        pass
+    raise QueryError("Invalid time '{}'".format(value))
+
+def _json_array(a):
+    """Return a list for the numpy array, with NaN as None"""
+    if a.dtype.kind == "f":
+        return [ None if math.isnan(v) else v for v in a.tolist() ]
+    return a.tolist()
+
+class Corpus(object):
+    """
+    The feature tables of all recordings in the corpus directories.
+
+    Members
+    -------
+        directories : [ str ]
+            The directories searched recursively for recordings
+        pattern : str
+            The fnmatch pattern of the recordings' file names
+        files : { path : (stamp, device, columns) }
+            The parsed recordings, stamp is the tuple (mtime, size)
+        errors : { path : (stamp, str) }
+            The recordings that could not be parsed
+    """
+    def __init__(self, directories, pattern = "*.evemu", jobs = 1):
+        self.directories = directories
+        self.pattern = pattern
+        self.jobs = jobs
+        self.files = {}
+        self.errors = {}
+        self.last_scan = None
+        self.scan_time = 0
+        self._lock = threading.Lock()
+        self._table = None
+
+    def _find(self):
+        found = {}
+        for directory in self.directories:
+            for root, dirs, names in os.walk(directory):
+                for name in fnmatch.filter(names, self.pattern):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (st.st_mtime, st.st_size)
+        return found
+
+    def scan(self):
+        """
+        Parse new and changed recordings and drop removed ones. Returns
+        the number of recordings parsed.
+        """
+        start = time.time()
+        found = self._find()
+        changed = [ p for p, stamp in sorted(found.items())
+                    if (self.files.get(p) or self.errors.get(p) or (None,))[0] != stamp ]
+
+        parsed = {}
+        errors = {}
+        for path, result, error in imap_files(sequence_features, changed, jobs=self.jobs,
+                                              catch=(DeviceError, EnvironmentError, ValueError)):
+            if error is not None:
+                errors[path] = (found[path], str(error))
+            else:
+                parsed[path] = (found[path],) + result
+
+        with self._lock:
+            removed = [ p for p in self.files if p not in found ]
+            for p in removed + list(errors.keys()):
+                self.files.pop(p, None)
+            for p in [ p for p in self.errors if p not in found or p in parsed ]:
+                del self.errors[p]
+            self.files.update(parsed)
+            self.errors.update(errors)
+            if parsed or removed or errors:
+                self._table = None
+            self.last_scan = time.time()
+            self.scan_time = self.last_scan - start
+        return len(changed)
+
+    def table(self):
+        """
+        Return the tuple (paths, devices, columns) of all sequences in the
+        corpus, columns has the additional "file" column with the index
+        into paths and devices
+        """
+        with self._lock:
+            if self._table is None:
+                paths = sorted(self.files.keys())
+                devices = [ self.files[p][1] for p in paths ]
+                tables = [ self.files[p][2] for p in paths ]
+                columns = {}
+                for name, (dtype, _) in COLUMNS.items():
+                    columns[name] = numpy.concatenate([ numpy.zeros(0, dtype=dtype) ] +
+                                                      [ t[name] for t in tables ])
+                columns["file"] = numpy.repeat(numpy.arange(len(paths)),
+                                               [ len(t["points"]) for t in tables ])
+                self._table = (paths, devices, columns)
+            return self._table
+
+    def select(self, filters):
+        """
+        Return the tuple (paths, devices, columns, mask) with the boolean
+        mask of the sequences matching the filter dict
+        """
+        if filters is not None and not isinstance(filters, dict):
+            raise QueryError("The filter must be a JSON object")
+        paths, devices, columns = self.table()
+        mask = numpy.ones(len(columns["file"]), dtype=bool)
+
+        for key, value in (filters or {}).items():
+            if key in ("device", "path"):
+                names = devices if key == "device" else paths
+                files = [ i for i, n in enumerate(names) if value in n ]
+                mask &= numpy.isin(columns["file"], files)
+            elif key == "since":
+                mask &= columns["recorded"] >= _parse_time(value)
+            elif key == "until":
+                mask &= columns["recorded"] < _parse_time(value)
+            elif key in COLUMNS:
+                c = columns[key]
+                if isinstance(value, list):
+                    if len(value) != 2:
+                        raise QueryError("Range for '{}' must be [min, max]".format(key))
+                    if value[0] is not None:
+                        mask &= c >= value[0]
+                    if value[1] is not None:
+                        mask &= c <= value[1]
+                else:
+                    mask &= c == value
+            else:
+                raise QueryError("Unknown filter '{}'".format(key))
+
+        return paths, devices, columns, mask
+
+    def _column(self, request, columns, mask):
+        name = request.get("column")
+        if name not in COLUMNS:
+            raise QueryError("Unknown column '{}'".format(name))
+        values = columns[name][mask].astype(numpy.float64)
+        return values[~numpy.isnan(values)]
+
+    def query(self, request):
+        """
+        Answer the query dict, returns a dict that can be serialized to
+        JSON. Raises QueryError for invalid queries.
+        """
+        q = request.get("query")
+        if q == "status":
+            with self._lock:
+                return { "files": len(self.files),
+                         "errors": len(self.errors),
+                         "sequences": sum(len(f[2]["points"]) for f in self.files.values()),
+                         "last_scan": self.last_scan,
+                         "scan_time": self.scan_time }
+        if q == "columns":
+            return { "columns": dict((k, v[1]) for k, v in COLUMNS.items()) }
+        if q == "files":
+            paths, devices, columns, mask = self.select(request.get("filter"))
+            counts = numpy.bincount(columns["file"][mask], minlength=len(paths))
+            with self._lock:
+                errors = dict((p, e[1]) for p, e in self.errors.items())
+            return { "files": [ { "path": p, "device": d, "sequences": int(c) }
+                                for p, d, c in zip(paths, devices, counts) if c ],
+                     "errors": errors }
+
+        paths, devices, columns, mask = self.select(request.get("filter"))
+        if q == "histogram":
+            values = self._column(request, columns, mask)
+            bins = request.get("bins", 20)
+            counts, edges = numpy.histogram(values, bins=bins, range=request.get("range"))
+            return { "count": len(values), "counts": counts.tolist(), "edges": edges.tolist() }
+        if q == "percentiles":
+            values = self._column(request, columns, mask)
+            pcs = request.get("percentiles", [ 50, 90, 95, 99 ])
+            result = numpy.percentile(values, pcs) if len(values) else numpy.full(len(pcs), numpy.nan)
+            return { "count": len(values), "percentiles": pcs, "values": _json_array(result) }
+        if q == "sequences":
+            names = request.get("columns", sorted(COLUMNS.keys()))
+            for n in names:
+                if n not in COLUMNS:
+                    raise QueryError("Unknown column '{}'".format(n))
+            indices = numpy.flatnonzero(mask)
+            limit = request.get("limit")
+            if limit is not None:
+                indices = indices[:limit]
+            result = { "count": int(mask.sum()),
+                       "path": [ paths[i] for i in columns["file"][indices] ],
+                       "device": [ devices[i] for i in columns["file"][indices] ] }
+            for n in names:
+                result[n] = _json_array(columns[n][indices])
+            return result
+
+        raise QueryError("Unknown query '{}'".format(q))
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One JSON query per line, one JSON response per line"""
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            start = time.time()
+            try:
+                request = json.loads(line.decode("utf-8"))
+                if not isinstance(request, dict):
+                    raise QueryError("The query must be a JSON object")
+                response = self.server.corpus.query(request)
+                response["ok"] = True
+            except (QueryError, ValueError, TypeError) as e:
+                response = { "ok": False, "error": str(e) }
+            except Exception as e:
+                # a bug, but the client still gets its answer
+                traceback.print_exc()
+                response = { "ok": False, "error": "Internal error: {}".format(e) }
+            response["time_ms"] = (time.time() - start) * 1000
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def _watch(corpus, interval, stop):
+    while not stop.wait(interval):
+        n = corpus.scan()
+        if n:
+            print("Parsed {} recordings".format(n), file=sys.stderr)
+
+def serve(args):
+    corpus = Corpus(args.directory, pattern=args.pattern, jobs=args.jobs)
+    n = corpus.scan()
+    print("Parsed {} recordings in {:.1f}s".format(n, corpus.scan_time), file=sys.stderr)
+
+    if os.path.exists(args.socket):
+        # a stale socket from a previous run, unless a daemon still runs
+        try:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.connect(args.socket)
+            s.close()
+            print("A daemon is already listening on {}".format(args.socket), file=sys.stderr)
+            return 1
+        except socket.error:
+            os.unlink(args.socket)
+
+    server = _Server(args.socket, _Handler)
+    server.corpus = corpus
+    stop = threading.Event()
+    watcher = threading.Thread(target=_watch, args=(corpus, args.interval, stop))
+    watcher.daemon = True
+    watcher.start()
+    # SystemExit to get through the cleanup below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("Listening on {}".format(args.socket), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        os.unlink(args.socket)
+    return 0
+
+def query(args):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(args.socket)
+    except socket.error as e:
+        print("Can't connect to {}: {}".format(args.socket, e), file=sys.stderr)
+        return 1
+    f = s.makefile("rwb")
+    f.write((args.query.strip() + "\n").encode("utf-8"))
+    f.flush()
+    response = f.readline().decode("utf-8")
+    s.close()
+    if not response:
+        print("The daemon closed the connection without response", file=sys.stderr)
+        return 1
+    print(json.dumps(json.loads(response), indent=2, sort_keys=True))
+    return 0 if json.loads(response).get("ok") else 1
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Keep a corpus of recordings in memory and "
+                                                 "answer queries about its touch sequences")
+    parser.add_argument("--socket", action="store", default=default_socket_path(),
+                        help="Path to the Unix socket (default: {})".format(default_socket_path()))
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    p = subparsers.add_parser("serve", help="Run the daemon")
+    p.add_argument("directory", nargs="+", help="Directory with evemu recordings")
+    p.add_argument("--pattern", action="store", default="*.evemu",
+                   help="File name pattern of the recordings (default: *.evemu)")
+    p.add_argument("--interval", action="store", type=float, default=10,
+                   help="Seconds between rescans of the directories (default 10)")
+    p.add_argument("--jobs", "-j", action="store", type=int, default=1,
+                   help="Number of recordings to parse in parallel (default 1)")
+    p.set_defaults(func=serve)
+
+    p = subparsers.add_parser("query", help="Send a JSON query to the daemon")
+    p.add_argument("query", help="The query as JSON object")
+    p.set_defaults(func=query)
+
+    args = parser.parse_args(argv[1:])
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
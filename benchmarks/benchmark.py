@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Runs TouchSequence.create_from_recording and the tools against synthetic
+# recordings of several sizes and the sample recordings, and reports the
+# throughput, wall time and peak memory of each run:
+#
+#       $ ./benchmark.py --output results.json
+#       $ ./benchmark.py --baseline results.json --threshold 0.1
+#
+# Each run is a separate process, the peak RSS is that process' maximum
+# resident set size. Synthetic recordings are generated once with a fixed
+# seed and kept in the data directory.
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR = os.path.join(ROOT, "synthetic-recordings", "generate-recording.py")
+SAMPLES = [ os.path.join(ROOT, "touchpad-max-delta", "t440s.evemu"),
+            os.path.join(ROOT, "touchpad-max-delta", "x220.evemu") ]
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+CREATE_FROM_RECORDING = """
+import sys, evemu
+from shared import TouchSequence
+d = evemu.Device(sys.argv[1], create=False)
+TouchSequence.create_from_recording(d)
+"""
+
+class Benchmark(object):
+    """
+    One command to run on each recording.
+
+    Members
+    -------
+        name : str
+        script : str
+            The tool's path relative to the repository, None to run code
+        args : [ str ]
+            Arguments before the recording
+        code : str
+            Python code to run instead of a script, the recording is
+            sys.argv[1]
+        returncodes : (int, ...)
+            The exit codes of a successful run
+        profile : bool
+            True if the tool is an EventProcessor that supports
+            --profile-output
+    """
+    def __init__(self, name, script = None, args = None, code = None, returncodes = (0,),
+                 profile = False):
+        self.name = name
+        self.script = script
+        self.args = args or []
+        self.code = code
+        self.returncodes = returncodes
+        self.profile = profile
+
+    def command(self, recording, profile_output = None):
+        if self.code is not None:
+            return [ sys.executable, "-c", self.code, recording ]
+        args = list(self.args)
+        if profile_output is not None and self.profile:
+            args += [ "--profile-output", profile_output ]
+        return [ sys.executable, os.path.join(ROOT, self.script) ] + args + [ recording ]
+
+# keyboard-state needs keyboard recordings and is not included
+BENCHMARKS = [
+    Benchmark("create_from_recording", code=CREATE_FROM_RECORDING),
+    Benchmark("event-time-delta", "event-time-delta/event-time-delta.py", ["--summary"]),
+    Benchmark("palm-locations", "palmdetect/palm-locations.py"),
+    Benchmark("per-slot-deltas", "per-slot-deltas/per-slot-deltas.py"),
+    Benchmark("pressure-over-time", "pressure-over-time/pressure-over-time.py"),
+    # exits with 1 if it found protocol bugs
+    Benchmark("protocol-bug-finder", "protocol-bug-finder/protocol-bug-finder.py",
+              returncodes=(0, 1)),
+    Benchmark("touch-pressure", "touch-pressure/touch-pressure.py",
+              profile=True),
+    Benchmark("touch-pressure-deltas", "touch-pressure/touch-pressure-deltas.py"),
+    Benchmark("touch-pressure-statistics", "touch-pressure/touch-pressure-statistics.py",
+              profile=True),
+    Benchmark("touch-width", "touch-width/touch-width.py"),
+    Benchmark("touchpad-detect-slot-jumps", "touchpad-detect-slot-change/touchpad-detect-slot-jumps.py",
+              profile=True),
+    Benchmark("touchpad-finger-spread", "touchpad-finger-spread/touchpad-finger-spread.py",
+              profile=True),
+    Benchmark("touchpad-initial-finger-spread", "touchpad-finger-spread/touchpad-initial-finger-spread.py",
+              profile=True),
+    Benchmark("touchpad-finger-start-points", "touchpad-finger-start-points/touchpad-finger-start-points.py",
+              profile=True),
+    Benchmark("synaptics-movement-delta", "touchpad-max-delta/synaptics-movement-delta.py",
+              profile=True),
+    Benchmark("touchpad-motion-speed", "touchpad-motion-speed/touchpad-motion-speed.py"),
+    Benchmark("touchpad-motion-speed-v3", "touchpad-motion-speed/touchpad-motion-speed-v3.py",
+              profile=True),
+    Benchmark("touchpad-movement-distance", "touchpad-movement-distance/touchpad-movement-distance.py",
+              profile=True),
+    Benchmark("touchpad-sensor-heatmap", "touchpad-sensor-heatmap/touchpad-sensor-heatmap.py"),
+    Benchmark("touchpad-sensor-heatmap-density", "touchpad-sensor-heatmap/touchpad-sensor-heatmap.py",
+              ["--density", "frames"]),
+    Benchmark("touchpad-tap-speed", "touchpad-tap-speed/touchpad-tap-speed.py",
+              profile=True),
+]
+
+def parse_size(size):
+    """Return the number of events for a size like 10k or 1m"""
+    size = size.strip().lower()
+    factor = { "k": 1000, "m": 1000000, "g": 1000000000 }.get(size[-1:], 1)
+    if factor > 1:
+        size = size[:-1]
+    return int(float(size) * factor)
+
+def count_events(path):
+    """Return the number of events in an evemu recording"""
+    count = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(1 << 24)
+            if not block:
+                break
+            # a line split across two blocks is counted in the second
+            count += (last + block).count(b"\nE: ")
+            last = block[-3:]
+    return count
+
+def synthetic_recording(data_dir, size, seed):
+    """
+    Return the path to the synthetic recording of size events, generating
+    it if it doesn't exist yet. The name includes a hash of the generator,
+    so a changed generator creates new recordings.
+    """
+    with open(GENERATOR, "rb") as f:
+        version = hashlib.sha1(f.read()).hexdigest()[:8]
+    path = os.path.join(data_dir, "synthetic-{}-seed{}-{}.evemu".format(size, seed, version))
+    if not os.path.exists(path):
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        print("Generating {}".format(path), file=sys.stderr)
+        tmp = path + ".tmp"
+        subprocess.check_call([ sys.executable, GENERATOR, "--seed", str(seed),
+                                "--events", str(parse_size(size)), "--output", tmp ])
+        os.rename(tmp, path)
+    return path
+
+def run_once(command, cwd, env):
+    """
+    Run command and return the tuple (returncode, wall time in s, peak RSS
+    in MB)
+    """
+    with open(os.devnull, "w") as devnull:
+        start = time.time()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=devnull, stderr=devnull)
+        pid, status, rusage = os.wait4(process.pid, 0)
+        wall = time.time() - start
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    # ru_maxrss is in KB on Linux
+    return returncode, wall, rusage.ru_maxrss / 1024.0
+
+def run_benchmark(benchmark, label, recording, events, repeat, profile = False):
+    """
+    Run benchmark on the recording repeat times and return the result
+    dict, with the fastest wall time and the highest peak RSS. With
+    profile, the stage times and counters of the tool's --profile-output
+    of the last run are added as "stages" and "counters".
+    """
+    # the tools import shared relative to their own directory or via
+    # PYTHONPATH, output files go into a scratch directory
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ ROOT ] + [ p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p ])
+    scratch = tempfile.mkdtemp(prefix="benchmark-")
+    profile_output = os.path.join(scratch, "profile.json") if profile else None
+    try:
+        runs = [ run_once(benchmark.command(recording, profile_output), scratch, env)
+                 for _ in range(repeat) ]
+        stages = None
+        if profile_output is not None and os.path.exists(profile_output):
+            with open(profile_output) as f:
+                stages = json.load(f)["total"]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    failed = [ r[0] for r in runs if r[0] not in benchmark.returncodes ]
+    wall = min(r[1] for r in runs)
+    result = {
+        "benchmark": benchmark.name,
+        "recording": label,
+        "events": events,
+        "status": "failed ({})".format(failed[0]) if failed else "ok",
+        "wall": wall,
+        "events_per_s": events / wall if wall > 0 else 0.0,
+        "peak_rss_mb": max(r[2] for r in runs),
+    }
+    if stages is not None:
+        result["stages"] = dict(stages["stages"], other=stages["other"])
+        result["counters"] = stages["counters"]
+    return result
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count() if hasattr(os, "cpu_count") else None,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Return the list of regressions as tuples (result, metric, baseline
+    value, value), a regression is a wall time or peak RSS more than
+    threshold (a fraction) above the baseline
+    """
+    previous = { (r["benchmark"], r["recording"]): r for r in baseline["results"] }
+    regressions = []
+    for r in results:
+        base = previous.get((r["benchmark"], r["recording"]))
+        if base is None or base["status"] != "ok" or r["status"] != "ok":
+            continue
+        for metric in ("wall", "peak_rss_mb"):
+            if r[metric] > base[metric] * (1 + threshold):
+                regressions.append((r, metric, base[metric], r[metric]))
+    return regressions
+
+def print_result(r, baseline = None):
+    line = "{:32s} {:22s} {:>10d} {:>10.3f} {:>12.0f} {:>9.1f}".format(
+           r["benchmark"], r["recording"], r["events"], r["wall"],
+           r["events_per_s"], r["peak_rss_mb"])
+    if baseline is not None and baseline["status"] == "ok" and r["status"] == "ok":
+        line += " {:>+7.1f}% {:>+7.1f}%".format(100.0 * (r["wall"] / baseline["wall"] - 1),
+                                                 100.0 * (r["peak_rss_mb"] / baseline["peak_rss_mb"] - 1))
+    if r["status"] != "ok":
+        line += " " + r["status"]
+    print(line)
+    sys.stdout.flush()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the tools on synthetic and sample recordings")
+    parser.add_argument("--sizes", action="store", default="10k,1m,10m",
+                        help="Comma-separated sizes of the synthetic recordings in events (default 10k,1m,10m)")
+    parser.add_argument("--seed", action="store", type=int, default=0,
+                        help="Seed of the synthetic recordings (default 0)")
+    parser.add_argument("--no-samples", action="store_true",
+                        help="Don't run on the sample recordings in the repository")
+    parser.add_argument("--filter", action="append", default=[],
+                        help="Only run benchmarks whose name contains this string, may be repeated")
+    parser.add_argument("--repeat", action="store", type=int, default=1,
+                        help="Run each benchmark this many times and keep the fastest (default 1)")
+    parser.add_argument("--data-dir", action="store", default=DATA_DIR,
+                        help="Directory for the synthetic recordings (default benchmarks/recordings)")
+    parser.add_argument("--output", "-o", action="store", default=None,
+                        help="Save the results as JSON to this file")
+    parser.add_argument("--baseline", action="store", default=None,
+                        help="JSON results to compare against")
+    parser.add_argument("--threshold", action="store", type=float, default=0.1,
+                        help="Flag wall time or peak RSS this fraction above the baseline "
+                             "as regression (default 0.1)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record the stage times and counters of the tools that "
+                             "support --profile-output in the results")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    args = parser.parse_args(argv[1:])
+
+    benchmarks = [ b for b in BENCHMARKS
+                   if not args.filter or any(f in b.name for f in args.filter) ]
+    if args.list:
+        for b in benchmarks:
+            print(b.name)
+        return 0
+
+    recordings = []
+    for size in [ s for s in args.sizes.split(",") if s.strip() ]:
+        recordings.append(("synthetic-{}".format(size.strip()),
+                           synthetic_recording(args.data_dir, size.strip(), args.seed)))
+    if not args.no_samples:
+        recordings += [ (os.path.splitext(os.path.basename(p))[0], p) for p in SAMPLES ]
+    recordings = [ (label, path, count_events(path)) for label, path in recordings ]
+
+    baseline = None
+    previous = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        previous = { (r["benchmark"], r["recording"]): r for r in baseline["results"] }
+
+    header = "{:32s} {:22s} {:>10s} {:>10s} {:>12s} {:>9s}".format(
+             "benchmark", "recording", "events", "wall s", "events/s", "RSS MB")
+    if baseline is not None:
+        header += " {:>8s} {:>8s}".format("wall", "RSS")
+    print(header)
+
+    results = []
+    for label, path, events in recordings:
+        for b in benchmarks:
+            r = run_benchmark(b, label, path, events, args.repeat, args.profile)
+            results.append(r)
+            print_result(r, previous.get((r["benchmark"], r["recording"])))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({ "environment": environment(), "results": results }, f,
+                      indent=2, sort_keys=True)
+
+    if baseline is None:
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print("No regressions above {:.0f}%".format(100 * args.threshold))
+        return 0
+
+    print("{} regressions above {:.0f}%:".format(len(regressions), 100 * args.threshold))
+    for r, metric, before, after in regressions:
+        print("  {} on {}: {} {:.3f} -> {:.3f}".format(r["benchmark"], r["recording"],
+                                                      metric, before, after))
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
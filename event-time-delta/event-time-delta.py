@@ -1,22 +1,194 @@
 #!/usr/bin/python
 #
 # Measures time delta between SYN_REPORT events on an evemu recording
+#
+# With --summary, prints the report rate, interval percentiles and jitter,
+# gaps and the effective report rate per slot for each device in the
+# recordings instead of every event.
 
 from __future__ import print_function
 
+import argparse
 import evemu
 import sys
 import os
+import numpy
+
+sys.path.append("..")
+from shared.accumulators import Accumulator, Counter, Histogram, MeanVariance, merge
+from shared.extract import FrameData
+from shared.parallel import imap_files
 
 def usec(sec, usec):
     return sec * 1000000 + usec
 
-def main(argv):
+class ReportStats(Accumulator):
+    """
+    The frame timing of one or more recordings of the same device.
+
+    Members
+    -------
+        recordings : int
+        frames : int
+        duration : double
+            The total time in µs between the first and the last frame of
+            each recording
+        intervals : Histogram
+            The time between two frames in µs
+        jitter : MeanVariance
+            The time between two frames in µs
+        gaps : int
+            The number of intervals with a finger down above gap_factor
+            times the median of those intervals in the recording
+        missing : int
+            The estimated number of frames missing in those gaps
+        slot_updates : Counter
+            The number of frames with a position update, per slot
+        slot_active : Counter
+            The time in µs each slot had a touch, per slot
+    """
+    def __init__(self, binsize = 50):
+        self.recordings = 0
+        self.frames = 0
+        self.duration = 0.0
+        self.intervals = Histogram(binsize)
+        self.jitter = MeanVariance()
+        self.gaps = 0
+        self.missing = 0
+        self.slot_updates = Counter()
+        self.slot_active = Counter()
+
+    def add_recording(self, frames, axes, gap_factor):
+        """
+        Add the frames of a recording, see FrameData. axes are the x/y
+        position axes used for the slot updates.
+        """
+        time = frames.time
+        dt = numpy.diff(time)
+
+        self.recordings += 1
+        self.frames += len(time)
+        if len(time) > 1:
+            self.duration += time[-1] - time[0]
+        self.intervals.add(dt)
+        self.jitter.add(dt)
+
+        # a device doesn't send frames while idle, only intervals with a
+        # finger down in both frames can have gaps
+        touching = dt[frames.touching[1:] & frames.touching[:-1]]
+        if len(touching) > 0:
+            median = numpy.median(touching)
+            if median > 0:
+                gaps = touching[touching > gap_factor * median]
+                self.gaps += len(gaps)
+                self.missing += int(numpy.sum(numpy.round(gaps / median) - 1))
+
+        # a slot's interval counts as active if the slot had a touch in
+        # both frames, an update is a position change in a frame
+        active = frames.tracking_id != -1
+        both = active[1:] & active[:-1]
+        moved = frames.changed[axes[0]] | frames.changed[axes[1]]
+        if moved.ndim == 1:
+            moved = moved[:, numpy.newaxis]
+        updates = (moved[1:] & both).sum(axis=0)
+        active_time = (both * dt[:, numpy.newaxis]).sum(axis=0)
+        for slot in numpy.flatnonzero(active_time > 0).tolist():
+            self.slot_updates.add(slot, int(updates[slot]))
+            self.slot_active.add(slot, float(active_time[slot]))
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        self.recordings += other.recordings
+        self.frames += other.frames
+        self.duration += other.duration
+        self.intervals.merge(other.intervals)
+        self.jitter.merge(other.jitter)
+        self.gaps += other.gaps
+        self.missing += other.missing
+        self.slot_updates.merge(other.slot_updates)
+        self.slot_active.merge(other.slot_active)
+        return self
+
+    def _state(self):
+        meta = { "recordings": self.recordings, "frames": self.frames,
+                 "duration": self.duration, "gaps": self.gaps,
+                 "missing": self.missing }
+        arrays = {}
+        for name in ("intervals", "jitter", "slot_updates", "slot_active"):
+            arrays[name] = numpy.frombuffer(getattr(self, name).to_bytes(), dtype=numpy.uint8)
+        return meta, arrays
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        s = ReportStats()
+        for name in ("recordings", "frames", "duration", "gaps", "missing"):
+            setattr(s, name, meta[name])
+        for name in ("intervals", "jitter", "slot_updates", "slot_active"):
+            setattr(s, name, Accumulator.from_bytes(arrays[name].tobytes()))
+        return s
+
+class _Summarize(object):
+    """
+    Picklable per-file function for the worker processes, returns the
+    dict of device name : ReportStats for one recording
+    """
+    def __init__(self, gap_factor):
+        self.gap_factor = gap_factor
+
+    def __call__(self, path):
+        d = evemu.Device(path, create=False)
+        if d.has_event("EV_ABS", "ABS_MT_POSITION_X"):
+            axes = [ "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y" ]
+        else:
+            axes = [ "ABS_X", "ABS_Y" ]
+
+        frames = FrameData.from_recording(d, axes)
+        stats = ReportStats()
+        stats.add_recording(frames, axes, self.gap_factor)
+        return { d.name: stats }
+
+def print_summary(name, stats, gap_factor):
+    print("{} ({} recordings)".format(name, stats.recordings))
+    if stats.frames < 2:
+        print("  no frames")
+        return
+
+    seconds = stats.duration / 1e6
+    rate = (stats.frames - stats.recordings) / seconds if seconds > 0 else 0
+    print("  {} frames in {:.1f}s, {:.1f}Hz".format(stats.frames, seconds, rate))
+
+    pcs = [0, 5, 50, 95, 99, 100]
+    values = stats.intervals.percentiles(pcs) / 1000.0
+    print("  interval ms: {}".format(", ".join("{}%: {:.2f}".format(p, v)
+                                               for p, v in zip(pcs, values))))
+    print("  jitter: {:.2f}ms stddev, mean interval {:.2f}ms".format(
+          stats.jitter.stddev() / 1000.0, stats.jitter.mean / 1000.0))
+    print("  gaps > {}x median: {}, about {} frames missing".format(
+          gap_factor, stats.gaps, stats.missing))
+
+    for slot in sorted(stats.slot_active.counts.keys()):
+        active = stats.slot_active[slot] / 1e6
+        print("  slot {}: {:.1f}Hz effective over {:.1f}s".format(
+              slot, stats.slot_updates[slot] / active, active))
+
+def summary(args):
+    devices = {}
+    for path, result, error in imap_files(_Summarize(args.gap_factor), args.path,
+                                          jobs=args.jobs, catch=(IOError,)):
+        if error is not None:
+            print("Skipping {} with error: {}".format(path, error))
+            continue
+        devices = merge(devices, result)
+
+    for name in sorted(devices.keys()):
+        print_summary(name, devices[name], args.gap_factor)
+
+def print_events(path):
     last_time = 0
 
     deltas = {}
 
-    d = evemu.Device(argv[1], create=False)
+    d = evemu.Device(path, create=False)
     for e in d.events():
 
         if not e.matches("EV_SYN", "SYN_REPORT"):
@@ -26,17 +198,34 @@ def main(argv):
             continue
 
         time = usec(e.sec, e.usec)
-        dt = (time - last_time)/1000
+        dt = (time - last_time)//1000
         last_time = time
         print("%4dms  ---- %s %s ----" % (dt, evemu.event_get_name(e.type), \
                                           evemu.event_get_name(e.type, e.code)))
-                
+
         deltas[dt] = dict.get(deltas, dt, 0) + 1
 
     print("\nDistribution of deltas in ms:")
-    for key, value in dict.iteritems(deltas):
+    for key, value in sorted(deltas.items()):
         print("  %dms: %d" % (key, value))
 
+def main(argv):
+    parser = argparse.ArgumentParser(description="Measure the time between SYN_REPORT events")
+    parser.add_argument("path", metavar="recording", nargs="+", help="Path to evemu recording")
+    parser.add_argument("--summary", action="store_true",
+                        help="Print a summary per device instead of every event")
+    parser.add_argument("--gap-factor", action="store", type=float, default=2.0,
+                        help="Intervals above this times the median interval are gaps (default 2.0)")
+    parser.add_argument("--jobs", "-j", action="store", type=int, default=1,
+                        help="Number of recordings to process in parallel with --summary (default 1)")
+    args = parser.parse_args(argv[1:])
+
+    if args.summary:
+        summary(args)
+    else:
+        for path in args.path:
+            print_events(path)
+
 if __name__ == "__main__":
     if len(sys.argv) == 1:
         print("Usage: %s events.evemu" % os.path.basename(sys.argv[0]))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Runs several analyses on the same recordings, parsing each recording only
+# once. Each analysis writes its normal output, as if the tool was run on
+# its own:
+#
+#       $ ./fused-analysis.py recordings/*.evemu
+#       $ ./fused-analysis.py -j 4 --analysis "tap-speed --max-time 300" \
+#                                  --analysis movement-distance recordings/*.evemu
+#
+# An analysis is a subcommand name of input-analysis (see input_analysis)
+# followed by the tool's own arguments.
+
+from __future__ import print_function
+
+import argparse
+import os
+import shlex
+import sys
+import types
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import EventProcessor
+from shared.fused import run_fused
+from input_analysis import ROOT, TOOLS
+
+DEFAULT_ANALYSES = [ "tap-speed", "motion-speed-v3", "movement-distance",
+                     "finger-start-points", "touch-pressure-statistics" ]
+
+def load_processor_class(name):
+    """
+    Load the tool's script as module and return its EventProcessor
+    subclass, None if it has none
+    """
+    script = os.path.join(ROOT, TOOLS[name][0])
+    modname = "fused_" + name.replace("-", "_")
+    module = types.ModuleType(modname)
+    module.__file__ = script
+    # registered so the classes can be pickled for worker processes
+    sys.modules[modname] = module
+    with open(script) as f:
+        exec(compile(f.read(), script, "exec"), module.__dict__)
+
+    for obj in module.__dict__.values():
+        if isinstance(obj, type) and issubclass(obj, EventProcessor) and \
+           obj.__module__ == modname:
+            return obj
+    return None
+
+def create_processor(analysis, paths):
+    """
+    Return the EventProcessor for the analysis string, the tool name
+    followed by its arguments
+    """
+    words = shlex.split(analysis)
+    name, args = words[0], words[1:]
+    if name not in TOOLS:
+        raise ValueError("Unknown analysis '{}'".format(name))
+    cls = load_processor_class(name)
+    if cls is None:
+        raise ValueError("'{}' is not an EventProcessor tool and can't be fused".format(name))
+
+    # EventProcessor parses its arguments from sys.argv
+    argv = sys.argv
+    sys.argv = [ "{} {}".format(os.path.basename(argv[0]), name) ] + args + list(paths)
+    try:
+        return cls()
+    finally:
+        sys.argv = argv
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run several analyses with one parse per recording")
+    parser.add_argument("path", metavar="recording", nargs="+", help="Path to evemu recording")
+    parser.add_argument("--analysis", "-a", action="append", default=[],
+                        help="An analysis and its arguments, e.g. \"tap-speed --max-time 300\", "
+                             "may be repeated (default: {})".format(", ".join(DEFAULT_ANALYSES)))
+    parser.add_argument("--jobs", "-j", action="store", type=int, default=1,
+                        help="Number of recordings to process in parallel (default 1)")
+    args = parser.parse_args(argv[1:])
+
+    try:
+        processors = [ create_processor(a, args.path) for a in args.analysis or DEFAULT_ANALYSES ]
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    run_fused(processors, args.path, args.jobs)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
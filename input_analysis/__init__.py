@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# One command for all tools, each tool is a subcommand:
+#
+#       $ input-analysis tap-speed recording.evemu
+#       $ input-analysis heatmap --density frames recordings/*.evemu
+#
+# The registry below is only names and paths, a tool's script and
+# everything it imports (evemu, numpy, PIL, ...) is only loaded when its
+# subcommand runs. The tools can be run from any directory.
+
+from __future__ import print_function
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# subcommand : (script relative to ROOT, description)
+TOOLS = {
+    "benchmark": ("benchmarks/benchmark.py",
+                  "Benchmark the tools on synthetic and sample recordings"),
+    "bug-finder": ("protocol-bug-finder/protocol-bug-finder.py",
+                   "Check a recording for kernel protocol bugs"),
+    "daemon": ("analysis-daemon/analysis-daemon.py",
+               "Keep recordings in memory and answer queries over a socket"),
+    "event-time-delta": ("event-time-delta/event-time-delta.py",
+                         "Measure the time between SYN_REPORT events"),
+    "finger-spread": ("touchpad-finger-spread/touchpad-finger-spread.py",
+                      "Distance between fingers on a touchpad"),
+    "finger-start-points": ("touchpad-finger-start-points/touchpad-finger-start-points.py",
+                            "Plot where touches start or end"),
+    "fused": ("fused-analysis/fused-analysis.py",
+              "Run several analyses with one parse per recording"),
+    "generate-recording": ("synthetic-recordings/generate-recording.py",
+                           "Generate a synthetic touchpad recording"),
+    "heatmap": ("touchpad-sensor-heatmap/touchpad-sensor-heatmap.py",
+                "Draw the sensor coverage or touch density of the recordings"),
+    "initial-finger-spread": ("touchpad-finger-spread/touchpad-initial-finger-spread.py",
+                              "Distance between fingers when a finger lands"),
+    "keyboard-state": ("keyboard-state/keyboard-state.py",
+                       "Show the key state of a keyboard recording"),
+    "max-delta": ("touchpad-max-delta/synaptics-movement-delta.py",
+                  "Maximum movement delta per touch"),
+    "motion-speed": ("touchpad-motion-speed/touchpad-motion-speed.py",
+                     "Motion speed in mm/s of the touches"),
+    "motion-speed-v3": ("touchpad-motion-speed/touchpad-motion-speed-v3.py",
+                        "Plot the motion speed in mm/s of the touches"),
+    "movement-distance": ("touchpad-movement-distance/touchpad-movement-distance.py",
+                          "Total distance moved per touch"),
+    "palm-locations": ("palmdetect/palm-locations.py",
+                       "Print all touch locations as gnuplot script"),
+    "per-slot-deltas": ("per-slot-deltas/per-slot-deltas.py",
+                        "Measure delta between event frames for each slot"),
+    "pressure-over-time": ("pressure-over-time/pressure-over-time.py",
+                           "Print the pressure over time as gnuplot script"),
+    "slot-jumps": ("touchpad-detect-slot-change/touchpad-detect-slot-jumps.py",
+                   "Detect touches that jump to another slot"),
+    "tap-speed": ("touchpad-tap-speed/touchpad-tap-speed.py",
+                  "Time between finger down and finger up of taps"),
+    "touch-pressure": ("touch-pressure/touch-pressure.py",
+                       "Plot the pressure distribution per touch"),
+    "touch-pressure-deltas": ("touch-pressure/touch-pressure-deltas.py",
+                              "Pressure changes within each touch"),
+    "touch-pressure-statistics": ("touch-pressure/touch-pressure-statistics.py",
+                                  "Pressure statistics of all touches"),
+    "touch-width": ("touch-width/touch-width.py",
+                    "Touch width and height per slot"),
+}
+
+PROG = "input-analysis"
+
+# imported on first use by a tool's --help, see run_tool()
+LAZY_MODULES = [ "numpy" ]
+
+def usage(file = sys.stdout):
+    print("usage: {} <command> [arguments]\n".format(PROG), file=file)
+    print("Analysis tools for evemu recordings. Commands:\n", file=file)
+    width = max(len(name) for name in TOOLS)
+    for name in sorted(TOOLS.keys()):
+        print("  {}  {}".format(name.ljust(width), TOOLS[name][1]), file=file)
+    print("\nSee '{} <command> --help' for the arguments of a command.".format(PROG), file=file)
+
+def lazy_import(name):
+    """
+    Put a placeholder for the module into sys.modules that imports the
+    module on the first access to one of its attributes. Does nothing if
+    the module is already imported or can't be found.
+    """
+    import importlib
+    import importlib.util
+    import types
+
+    if name in sys.modules or importlib.util.find_spec(name) is None:
+        return
+    placeholder = types.ModuleType(name)
+
+    def load(attr):
+        if sys.modules.get(name) is placeholder:
+            del sys.modules[name]
+        module = importlib.import_module(name)
+        # the modules that imported the placeholder use the module's
+        # attributes directly from now on
+        placeholder.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    placeholder.__getattr__ = load
+    sys.modules[name] = placeholder
+
+def run_tool(name, argv):
+    """
+    Run the tool's script as __main__ with argv as its arguments, as if it
+    was run from its own directory
+    """
+    import types
+
+    # the tools import numpy at the top but argparse exits before it is
+    # used, so --help doesn't wait for it
+    if "-h" in argv or "--help" in argv:
+        for m in LAZY_MODULES:
+            lazy_import(m)
+
+    script = os.path.join(ROOT, TOOLS[name][0])
+    with open(script) as f:
+        code = compile(f.read(), script, "exec")
+
+    sys.argv = [ "{} {}".format(PROG, name) ] + list(argv)
+    # the script's directory first like for a script run directly, and
+    # the root for the tools' "from shared import ..."
+    sys.path[0:0] = [ os.path.dirname(script), ROOT ]
+
+    # like runpy, but keeping sys.argv[0] for the usage messages. The
+    # module must be __main__ in sys.modules so the tool's classes can be
+    # pickled for worker processes.
+    module = types.ModuleType("__main__")
+    module.__file__ = script
+    previous = sys.modules.get("__main__")
+    sys.modules["__main__"] = module
+    try:
+        exec(code, module.__dict__)
+    finally:
+        sys.modules["__main__"] = previous
+
+def main(argv = None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if not argv or argv[0] in ("-h", "--help", "help"):
+        usage()
+        return 0 if argv else 1
+
+    name = argv[0]
+    if name not in TOOLS:
+        import difflib
+        print("{}: unknown command '{}'".format(PROG, name), file=sys.stderr)
+        close = difflib.get_close_matches(name, TOOLS.keys())
+        if close:
+            print("Did you mean: {}".format(", ".join(close)), file=sys.stderr)
+        return 2
+
+    run_tool(name, argv[1:])
+    return 0
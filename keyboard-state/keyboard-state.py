@@ -1,107 +1,294 @@
 #!/usr/bin/python
+#
+# Shows the key state of a keyboard recording, either as one line per frame
+# or, with --summary, as key bounce statistics and per-key dwell and flight
+# time histograms:
+#
+#       $ ./keyboard-state.py keyboard.evemu
+#       $ ./keyboard-state.py --summary keyboard-*.evemu
+#
+# The dwell time is the time a key is held down, the flight time the time
+# from the release of the previous key to the press of this key (negative
+# if the keys overlap). A bounce is a press within 70ms of the previous
+# press of the same key.
 
 from __future__ import print_function
 
+import argparse
 import evemu
 import os
 import sys
+import numpy
+
+sys.path.append("..")
+from shared.accumulators import Counter, Histogram, merge
+from shared.arrays import segment_diff
 
 UP = 0
 DOWN = 1
 IS_DOWN = 2
 NONE = 3
 
-def main(argv):
-    d = evemu.Device(argv[1], create=False)
-    offsets = {}
-    offset = 2
+BOUNCE_TIME = 70000 # µs
+
+class KeyTimeline(object):
+    """
+    The key presses of a recording as interval arrays, one element per
+    press, sorted by key and press time.
+
+    Members
+    -------
+        names : { code : str }
+            The key name for each code, without KEY_ prefix, lowercase
+        frame_times : numpy array of double
+            The time of each frame in µs
+        key : numpy array of int
+            The key code of each press
+        press, release : numpy array of double
+            The press/release time in µs. A key still down at the end of
+            the recording is released at the time of the last frame.
+        press_frame, release_frame : numpy array of int
+            The frame the press/release is part of, the release frame of
+            a key still down at the end is the number of frames
+    """
+    def __init__(self, names, frame_times, key, press, release, press_frame, release_frame):
+        self.names = names
+        self.frame_times = frame_times
+        self.key = key
+        self.press = press
+        self.release = release
+        self.press_frame = press_frame
+        self.release_frame = release_frame
+
+    @classmethod
+    def from_recording(self, evemu_device):
+        frame_times = []
+        events = [] # (frame, time, code, value)
+        key_type = None
+
+        for e in evemu_device.events():
+            if e.matches('EV_SYN', 'SYN_REPORT'):
+                frame_times.append(e.sec * 1000000 + e.usec)
+            elif e.matches('EV_KEY'):
+                key_type = e.type
+                events.append((len(frame_times), e.sec * 1000000 + e.usec, e.code, e.value))
+
+        nframes = len(frame_times)
+        frame_times = numpy.array(frame_times, dtype=numpy.float64)
+        ev = numpy.array([ (f, c, v) for f, t, c, v in events ], dtype=numpy.int64).reshape(-1, 3)
+        ev_time = numpy.array([ t for f, t, c, v in events ], dtype=numpy.float64)
+        ev_frame, ev_code, ev_value = ev.T
+
+        # key repeats don't change the state
+        keep = (ev_value != 2) & (ev_frame < nframes)
+        ev_frame, ev_code, ev_value, ev_time = ev_frame[keep], ev_code[keep], ev_value[keep], ev_time[keep]
+
+        names = {}
+        for c in numpy.unique(ev_code).tolist():
+            names[c] = evemu.event_get_name(key_type, c)[4:].lower()  # remove KEY_ prefix
+
+        # pair each press with the next event of the same key if that is
+        # a release
+        order = numpy.lexsort((ev_time, ev_code))
+        ev_frame, ev_code, ev_value, ev_time = ev_frame[order], ev_code[order], ev_value[order], ev_time[order]
+        presses = numpy.flatnonzero(ev_value == 1)
+        following = numpy.minimum(presses + 1, max(len(ev_code) - 1, 0))
+        released = (presses + 1 < len(ev_code)) & \
+                   (ev_code[following] == ev_code[presses]) & \
+                   (ev_value[following] == 0)
+
+        last_time = frame_times[-1] if nframes else 0
+        release = numpy.where(released, ev_time[following], last_time)
+        release_frame = numpy.where(released, ev_frame[following], nframes)
+
+        return KeyTimeline(names, frame_times, ev_code[presses], ev_time[presses],
+                           release, ev_frame[presses], release_frame)
+
+    def key_offsets(self):
+        """
+        Return the tuple (codes, offsets) with the codes of all keys
+        pressed and the start index of each key's presses, with one extra
+        element for the end of the last key
+        """
+        codes, starts = numpy.unique(self.key, return_index=True)
+        return codes, numpy.append(starts, len(self.key))
+
+    def bounces(self):
+        """
+        Return a boolean array, True for each press within BOUNCE_TIME of
+        the previous press of the same key
+        """
+        codes, offsets = self.key_offsets()
+        deltas, doffsets = segment_diff(self.press, offsets)
+        # the first press of each key is never a bounce
+        is_bounce = numpy.zeros(len(self.press), dtype=bool)
+        not_first = numpy.ones(len(self.press), dtype=bool)
+        not_first[offsets[:-1]] = False
+        is_bounce[not_first] = deltas < BOUNCE_TIME
+        return is_bounce
+
+    def dwell(self):
+        """Return the dwell time of each press in µs"""
+        return self.release - self.press
+
+    def flight(self):
+        """
+        Return the flight time of each press in µs, the time since the
+        release of the key pressed before, numpy.nan for the first press
+        """
+        order = numpy.argsort(self.press, kind="stable")
+        flight = numpy.full(len(self.press), numpy.nan)
+        flight[order[1:]] = self.press[order[1:]] - self.release[order[:-1]]
+        return flight
+
+    def frame_states(self, codes):
+        """
+        Return an array of shape (frames, len(codes)) with the state UP,
+        DOWN, IS_DOWN or NONE of each of the given keys in each frame
+        """
+        nframes = len(self.frame_times)
+        column = { c: i for i, c in enumerate(codes) }
+        shown = numpy.array([ k in column for k in self.key.tolist() ], dtype=bool)
+        cols = numpy.array([ column.get(k, 0) for k in self.key.tolist() ], dtype=numpy.int64)
+        pf, rf, cols = self.press_frame[shown], self.release_frame[shown], cols[shown]
+
+        # +1 from the frame after the press to the release
+        change = numpy.zeros((nframes + 2, len(codes)), dtype=numpy.int64)
+        numpy.add.at(change, (pf + 1, cols), 1)
+        numpy.add.at(change, (rf, cols), -1)
+        is_down = numpy.cumsum(change, axis=0)[:nframes] > 0
 
+        states = numpy.where(is_down, IS_DOWN, NONE).astype(numpy.int8)
+        released = rf < nframes
+        states[rf[released], cols[released]] = UP
+        states[pf, cols] = DOWN
+        return states
+
+    def keys_down(self):
+        """
+        Return the number of keys pressed, down or released in each frame
+        """
+        nframes = len(self.frame_times)
+        change = numpy.zeros(nframes + 2, dtype=numpy.int64)
+        numpy.add.at(change, self.press_frame, 1)
+        numpy.add.at(change, self.release_frame + 1, -1)
+        return numpy.cumsum(change)[:nframes]
+
+def legend():
+    """
+    Return the tuple (header, columns) with the header line and a list of
+    the key name shown in each column, None for spacing columns
+    """
+    columns = [ chr(c) for c in range(ord('a'), ord('z') + 1) ]
+    columns += [ chr(c) for c in range(ord('0'), ord('9') + 1) ]
+    header = ''.join(columns)
+
+    columns.append(None)
+    header += ' Spc Bksp Del Ret LShf RShf'
+    for name, width, pos in (('space', 4, 2), ('backspace', 5, 2), ('delete', 4, 1),
+                             ('enter', 4, 1), ('leftshift', 5, 2), ('rightshift', 5, 2)):
+        columns += [ name if i == pos else None for i in range(width) ]
+    return header, columns
+
+def print_frames(timeline):
     #     timestamp  count  star   separator
     print('Legend:')
     print('  time, count of keys down, * to mark <3ms timestamp')
     print('  + .... key down, | .... key is down, ^ .... key up')
-    print(' ' * 12 + '   ' + ' ' +  ' |', end='')
-    for c in range(ord('a'), ord('z') + 1):
-        print('{}'.format(chr(c)), end='')
-        offsets[offset] = chr(c)
-        offset += 1
-
-    for c in range(ord('0'), ord('9') + 1):
-        print('{}'.format(chr(c)), end='')
-        offsets[offset] = chr(c)
-        offset += 1
-
-    offset += 1
-    print(' Spc Bksp Del Ret LShf RShf', end='')
-    offsets[offset + 2] = 'space'
-    offset += 4
-    offsets[offset + 2] = 'backspace'
-    offset += 5
-    offsets[offset + 1] = 'delete'
-    offset += 4
-    offsets[offset + 1] = 'enter'
-    offset += 4
-    offsets[offset + 2] = 'leftshift'
-    offset += 5
-    offsets[offset + 2] = 'rightshift'
-    offset += 5
-    print('')
-
-    max_offset = offset
-
-    char = ['^', '+', '|', ' ']
-
-    down = {}
-    last_down = {}
-    bounce = False
-    for e in d.events():
-        if e.matches('EV_SYN', 'SYN_REPORT'):
-            line = []
-            line.append('{:06d}.{:06d}'.format(e.sec, e.usec))
-            line.append(' {} '.format(len(down)))
-
-            time = e.sec * 1000000 + e.usec
-            if bounce:
-                line.append('*')
-                bounce = False
-            else:
-                line.append(' ')
-
-            line.append('|')
-            for i in range(2, max_offset):
-                try:
-                    line.append(char[down[offsets[i]]])
-                except KeyError:
-                    line.append(' ')
-            print(''.join(line))
-
-            for key in down:
-                if down[key] == DOWN:
-                    down[key] = IS_DOWN
-                elif down[key] == UP:
-                    down[key] = NONE
-
-            d2 = {}
-            for key in down.keys():
-                value = down[key]
-                if value != NONE:
-                    d2[key] = value
-            down = d2
-
-        if not e.matches('EV_KEY'):
-            continue
-
-        key = evemu.event_get_name(e.type, e.code)
-        key = key[4:].lower()  # remove KEY_ prefix
-        down[key] = e.value
-        
-        if e.value:
-            time = e.sec * 1000000 + e.usec
-            if (key in last_down) and (time - last_down[key] < 70000):  # 70 ms
-                bounce = True
-            else:
-                last_down[key] = time
+    header, columns = legend()
+    print(' ' * 12 + '   ' + ' ' +  ' |' + header)
+
+    codes = { name: code for code, name in timeline.names.items() }
+    shown = [ codes.get(name, -1) for name in columns ]
+    states = timeline.frame_states(shown)
+    chars = numpy.array(['^', '+', '|', ' '])[states]
+    chars[:, [ i for i, code in enumerate(shown) if code == -1 ]] = ' '
+
+    bounce_frames = numpy.zeros(len(timeline.frame_times), dtype=bool)
+    bounce_frames[timeline.press_frame[timeline.bounces()]] = True
+    count = timeline.keys_down()
+
+    for i, time in enumerate(timeline.frame_times.astype(numpy.int64).tolist()):
+        print('{:06d}.{:06d} {} {}|{}'.format(time // 1000000, time % 1000000, count[i],
+                                              '*' if bounce_frames[i] else ' ',
+                                              ''.join(chars[i])))
+
+def summarize(timeline, binsize):
+    """
+    Return the tuple (bounces, times) where bounces is a Counter of the
+    bounces per key name and times a dict of key name : (dwell, flight)
+    with the dwell and flight time Histograms in ms for that key
+    """
+    is_bounce = timeline.bounces()
+    dwell = timeline.dwell() / 1000.0
+    flight = timeline.flight() / 1000.0
+    codes, offsets = timeline.key_offsets()
+
+    bounces = Counter()
+    times = {}
+    for code, start, end in zip(codes.tolist(), offsets[:-1], offsets[1:]):
+        name = timeline.names[code]
+        bounces.add(name, int(is_bounce[start:end].sum()))
+        d = Histogram(binsize)
+        d.add(dwell[start:end])
+        f = Histogram(binsize)
+        fl = flight[start:end]
+        f.add(fl[~numpy.isnan(fl)])
+        times[name] = (d, f)
+    return bounces, times
+
+def print_histogram(title, histograms):
+    if not histograms:
+        return
+    total = Histogram(histograms[0].binsize)
+    for h in histograms:
+        total.merge(h)
+
+    print("{} time histogram (ms):".format(title))
+    values, counts = total.values()
+    for v, c in zip(values.tolist(), counts.tolist()):
+        if c > 0:
+            print("{:8.0f} {}".format(v, c))
+
+def print_summary(summary):
+    bounces, times = summary
+    presses = sum(d.count for d, f in times.values())
+    print("Key presses: {}, bounces: {} ({:.2f}%)".format(
+          presses, bounces.total, 100.0 * bounces.total / max(presses, 1)))
+
+    print("{:12s} {:>7s} {:>7s} {:>17s} {:>17s}".format(
+          "key", "presses", "bounces", "dwell ms 50%/95%", "flight ms 50%/95%"))
+    for name in sorted(times.keys()):
+        dwell, flight = times[name]
+        d50, d95 = dwell.percentiles([50, 95])
+        f50, f95 = flight.percentiles([50, 95])
+        print("{:12s} {:7d} {:7d} {:8.0f} {:8.0f} {:8.0f} {:8.0f}".format(
+              name, dwell.count, bounces[name], d50, d95, f50, f95))
+
+    print_histogram("Dwell", [ d for d, f in times.values() ])
+    print_histogram("Flight", [ f for d, f in times.values() ])
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Show the key state of a keyboard recording")
+    parser.add_argument("path", metavar="recording", nargs="+", help="Path to evemu recording")
+    parser.add_argument("--summary", action="store_true",
+                        help="Print bounce statistics and dwell/flight time histograms "
+                             "instead of the key state per frame, all recordings are merged")
+    parser.add_argument("--binsize", action="store", type=float, default=10,
+                        help="Histogram bin size in ms for --summary (default 10)")
+    args = parser.parse_args(argv[1:])
+
+    summary = None
+    for path in args.path:
+        d = evemu.Device(path, create=False)
+        timeline = KeyTimeline.from_recording(d)
+        if args.summary:
+            summary = merge(summary, summarize(timeline, args.binsize))
+        else:
+            print_frames(timeline)
 
+    if summary is not None:
+        print_summary(summary)
 
 if __name__ == "__main__":
     if len(sys.argv) == 1:
@@ -1,10 +1,15 @@
 #!/usr/bin/python
 
 from __future__ import print_function
+import argparse
 import sys
 import os
 
 import evemu
+import numpy
+
+sys.path.append("..")
+from shared.decimate import add_decimation_args, new_point_decimator, decimated_data
 
 EV_SYN = 0x00
 EV_ABS = 0x03
@@ -61,10 +66,13 @@ def print_gnuplot_header():
 def print_gnuplot_footer():
     print("pause -1")
 
-def main(args):
-    path = args[1]
+def main(argv):
+    parser = argparse.ArgumentParser(description="Print all touch locations as gnuplot script")
+    parser.add_argument("path", metavar="recording", help="Path to evemu recording")
+    add_decimation_args(parser)
+    args = parser.parse_args(argv[1:])
 
-    device = evemu.Device(path, create=False)
+    device = evemu.Device(args.path, create=False)
     if not device.has_event(EV_ABS, ABS_X) or not device.has_event(EV_ABS, ABS_Y):
         error("Invalid device, missing X/Y")
 
@@ -73,12 +81,18 @@ def main(args):
 
     print_gnuplot_header()
 
-    xy = get_xy(device)
+    xy = numpy.array(get_xy(device), dtype=numpy.float64).reshape(-1, 2)
+
+    using = "using 1:2 title 'touches'"
+    if args.decimate != "none":
+        decimator = new_point_decimator(args, (0.0, 1.0), (0.0, 1.0))
+        decimator.add(xy[:, 0], xy[:, 1])
+        xy, comment, using = decimated_data(decimator, "title 'touches'")
+        print("# {}".format(comment))
 
-    print("plot \"-\" using 1:2 title 'touches'")
+    print("plot \"-\" {}".format(using))
 
-    for (x, y) in xy:
-        print("\t%f\t%f" % (x, y))
+    numpy.savetxt(sys.stdout, xy, fmt="%f", delimiter="\t")
     print("\te")
     print_gnuplot_footer()
 
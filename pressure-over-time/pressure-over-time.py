@@ -1,45 +1,68 @@
 #!/usr/bin/python
 #
-# Input is an evemu, this script does not handle slots and
-# only looks at ABS_PRESSURE.
-# 
+# Input is an evemu recording, this script looks at ABS_PRESSURE or, with
+# --mt, at ABS_MT_PRESSURE with one line per slot.
+#
 
 from __future__ import print_function
 
+import argparse
 import evemu
 import sys
 import os
-import math
+import numpy
 
-def time_to_us(sec, usec):
-    return sec + usec/1000000.0
+sys.path.append("..")
+from shared.decimate import downsample
+from shared.extract import FrameData
 
 def main(argv):
-    d = evemu.Device(argv[1], create=False)
+    parser = argparse.ArgumentParser(description="Print the pressure over time as gnuplot script")
+    parser.add_argument("path", metavar="recording", help="Path to evemu recording")
+    parser.add_argument("--max-points", action="store", type=int, default=0,
+                        help="Downsample to about this many points (default: all points)")
+    parser.add_argument("--downsample", choices=["lttb", "minmax"], default="lttb",
+                        help="Downsampling method for --max-points (default lttb)")
+    parser.add_argument("--mt", action="store_true",
+                        help="Use ABS_MT_PRESSURE with one line per slot instead of ABS_PRESSURE")
+    args = parser.parse_args(argv[1:])
+
+    d = evemu.Device(args.path, create=False)
 
-    pmax = d.get_abs_maximum("ABS_PRESSURE")
-    pmin = d.get_abs_minimum("ABS_PRESSURE")
+    axis = "ABS_MT_PRESSURE" if args.mt else "ABS_PRESSURE"
+    frames = FrameData.from_recording(d, [axis])
+    values = frames.values[axis].reshape(frames.nframes, -1)
+    changed = frames.changed[axis].reshape(frames.nframes, -1)
 
-    pressure = pmin
-    time_offset = -1
+    # one series per slot with a pressure update in each frame it changed
+    series = []
+    for slot in range(values.shape[1]):
+        have = changed[:, slot] & ~numpy.isnan(values[:, slot])
+        if not numpy.any(have):
+            continue
+        data = numpy.column_stack((frames.time[have] / 1e6, values[have, slot]))
+        series.append((slot, data))
 
     print("#!/usr/bin/gnuplot")
     print("# This is a self-executing gnuplot file")
     print("#")
+    if args.max_points > 0:
+        for i, (slot, data) in enumerate(series):
+            keep = downsample(data[:, 0], data[:, 1], args.max_points, args.downsample)
+            print("# {} downsampled to {} of {} points".format(args.downsample, len(keep), len(data)))
+            series[i] = (slot, data[keep])
     print("set xlabel \"time\"")
     print("set ylabel \"pressure\"")
     print("set style data lines")
-    print("plot '-' using 1:2 title 'pressure'")
-
-    for e in d.events():
-        if time_offset < 0:
-            time_offset = time_to_us(e.sec, e.usec)
-
-        if e.matches("EV_ABS", "ABS_PRESSURE"):
-            t = time_to_us(e.sec, e.usec) - time_offset
-            print("%f %d" % (t, e.value))
+    if args.mt:
+        titles = [ "slot {}".format(slot) for slot, data in series ]
+    else:
+        titles = [ "pressure" for slot, data in series ]
+    print("plot " + ", ".join("'-' using 1:2 title '{}'".format(t) for t in titles))
 
-    print("e")
+    for slot, data in series:
+        numpy.savetxt(sys.stdout, data, fmt=("%f", "%d"))
+        print("e")
     print("pause -1")
 
 if __name__ == "__main__":
@@ -413,9 +413,9 @@ class TestButtonDevice(TestEvdevDevice):
                     self.assertLessEqual(e.value, 1)
 
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        print("Usage: %s events.evemu" % os.path.basename(sys.argv[0]))
-        sys.exit(1)
+    if len(sys.argv) == 1 or sys.argv[1] in ("-h", "--help"):
+        print("Usage: %s events.evemu [unittest arguments]" % os.path.basename(sys.argv[0]))
+        sys.exit(1 if len(sys.argv) == 1 else 0)
 
     evemu_path = sys.argv[1]
     del sys.argv[1]
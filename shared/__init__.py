@@ -8,6 +8,8 @@ import itertools
 import sys
 import argparse
 
+from . import profiling
+
 def _tv2us(sec, usec):
     return sec * 1e6 + usec
 
@@ -305,83 +307,86 @@ class TouchSequence:
         sequences = []
         slot = 0
         current_seqs = [None] * nslots
-        current_points = [ _TouchPointRecording() ] * nslots
+        current_points = [ _TouchPointRecording() for _ in range(nslots) ]
         cp = current_points[slot]
         max_fingers_this_frame = 0
+        nframes = 0
 
         try:
-            for e in evemu_device.events():
-                if e.matches("EV_ABS", "ABS_MT_SLOT"):
-                    if cp.dirty:
-                        current_seqs[slot]._append(cp.clean_copy())
-                    slot = e.value
-                    cp = current_points[slot]
-                elif e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
-                    if e.value > -1:
-                        current_seqs[slot] = self.new_seq_from_event(slot, e)
-                        sequences.append(current_seqs[slot])
-                    else:
-                        current_seqs[slot]._finalize(_tv2us(e.sec, e.usec))
-                        current_seqs[slot] = None
-                elif e.matches("EV_ABS", xaxis):
-                    if is_st and current_seqs[slot] is None:
-                        current_seqs[slot] = self._new_fake_seq_from_event(slot, e)
-                        sequences.append(current_seqs[slot])
-
-                    cp.x = self._mm_from_event(e, evemu_device)
-                    cp.x_percent = self._percent_from_event(e, evemu_device)
-                    toffset = current_seqs[slot].times[0]
-                    cp.time = _tv2us(e.sec, e.usec) - toffset
-                elif e.matches("EV_ABS", yaxis):
-                    if is_st and current_seqs[slot] is None:
-                        current_seqs[slot] = self._new_fake_seq_from_event(slot, e)
-                        sequences.append(current_seqs[slot])
-
-                    cp.y = self._mm_from_event(e, evemu_device)
-                    cp.y_percent = self._percent_from_event(e, evemu_device)
-                    toffset = current_seqs[slot].times[0]
-                    cp.time = _tv2us(e.sec, e.usec) - toffset
-                elif e.matches("EV_ABS", "ABS_MT_PRESSURE"):
-                    cp.press = e.value
-                    toffset = current_seqs[slot].times[0]
-                    cp.time = _tv2us(e.sec, e.usec) - toffset
-                elif is_st and e.matches("EV_KEY", "BTN_TOUCH"):
-                    if e.value == 0:
-                        current_seqs[slot]._finalize(_tv2us(e.sec, e.usec))
-                        current_seqs[slot] = None
-                elif e.matches("EV_KEY", "BTN_TOOL_DOUBLETAP"):
-                    if e.value > 0:
-                        max_fingers_this_frame = 2
-                elif e.matches("EV_KEY", "BTN_TOOL_TRIPLETAP"):
-                    if e.value > 0:
-                        max_fingers_this_frame = 3
-                elif e.matches("EV_KEY", "BTN_TOOL_QUADTAP"):
-                    if e.value > 0:
-                        max_fingers_this_frame = 4
-                elif e.matches("EV_KEY", "BTN_TOOL_QUINTTAP"):
-                    if e.value > 0:
-                        max_fingers_this_frame = 5
-                elif e.matches("EV_KEY", "BTN_LEFT") or \
-                     e.matches("EV_KEY", "BTN_MIDDLE") or \
-                     e.matches("EV_KEY", "BTN_RIGHT"):
-                    seq = current_seqs[slot]
-                    if seq is not None:
-                        if seq.buttons is None:
-                            current_seqs[slot]
-                            seq.buttons = [ e.code ]
-                        elif not e.code in seq.buttons:
-                            seq.buttons.append(e.code)
-                elif e.matches("EV_SYN", "SYN_REPORT"):
-                    if cp.dirty:
-                        current_seqs[slot]._append(cp.clean_copy())
-
-                    active = [ s for s in current_seqs if s is not None ]
-                    if len(active) > 1 or max_fingers_this_frame > 1:
-                        for s in active:
-                            s.is_single = False
-                            s._link(active)
-                            s.max_fingers = max(s.max_fingers, max_fingers_this_frame)
-                    max_fingers_this_frame = 0
+            with profiling.stage("sequences"):
+                for e in profiling.timed(evemu_device.events(), "parse", "events"):
+                    if e.matches("EV_ABS", "ABS_MT_SLOT"):
+                        if cp.dirty:
+                            current_seqs[slot]._append(cp.clean_copy())
+                        slot = e.value
+                        cp = current_points[slot]
+                    elif e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
+                        if e.value > -1:
+                            current_seqs[slot] = self.new_seq_from_event(slot, e)
+                            sequences.append(current_seqs[slot])
+                        else:
+                            current_seqs[slot]._finalize(_tv2us(e.sec, e.usec))
+                            current_seqs[slot] = None
+                    elif e.matches("EV_ABS", xaxis):
+                        if is_st and current_seqs[slot] is None:
+                            current_seqs[slot] = self._new_fake_seq_from_event(slot, e)
+                            sequences.append(current_seqs[slot])
+
+                        cp.x = self._mm_from_event(e, evemu_device)
+                        cp.x_percent = self._percent_from_event(e, evemu_device)
+                        toffset = current_seqs[slot].times[0]
+                        cp.time = _tv2us(e.sec, e.usec) - toffset
+                    elif e.matches("EV_ABS", yaxis):
+                        if is_st and current_seqs[slot] is None:
+                            current_seqs[slot] = self._new_fake_seq_from_event(slot, e)
+                            sequences.append(current_seqs[slot])
+
+                        cp.y = self._mm_from_event(e, evemu_device)
+                        cp.y_percent = self._percent_from_event(e, evemu_device)
+                        toffset = current_seqs[slot].times[0]
+                        cp.time = _tv2us(e.sec, e.usec) - toffset
+                    elif e.matches("EV_ABS", "ABS_MT_PRESSURE"):
+                        cp.press = e.value
+                        toffset = current_seqs[slot].times[0]
+                        cp.time = _tv2us(e.sec, e.usec) - toffset
+                    elif is_st and e.matches("EV_KEY", "BTN_TOUCH"):
+                        if e.value == 0:
+                            current_seqs[slot]._finalize(_tv2us(e.sec, e.usec))
+                            current_seqs[slot] = None
+                    elif e.matches("EV_KEY", "BTN_TOOL_DOUBLETAP"):
+                        if e.value > 0:
+                            max_fingers_this_frame = 2
+                    elif e.matches("EV_KEY", "BTN_TOOL_TRIPLETAP"):
+                        if e.value > 0:
+                            max_fingers_this_frame = 3
+                    elif e.matches("EV_KEY", "BTN_TOOL_QUADTAP"):
+                        if e.value > 0:
+                            max_fingers_this_frame = 4
+                    elif e.matches("EV_KEY", "BTN_TOOL_QUINTTAP"):
+                        if e.value > 0:
+                            max_fingers_this_frame = 5
+                    elif e.matches("EV_KEY", "BTN_LEFT") or \
+                         e.matches("EV_KEY", "BTN_MIDDLE") or \
+                         e.matches("EV_KEY", "BTN_RIGHT"):
+                        seq = current_seqs[slot]
+                        if seq is not None:
+                            if seq.buttons is None:
+                                current_seqs[slot]
+                                seq.buttons = [ e.code ]
+                            elif not e.code in seq.buttons:
+                                seq.buttons.append(e.code)
+                    elif e.matches("EV_SYN", "SYN_REPORT"):
+                        nframes += 1
+                        if cp.dirty:
+                            current_seqs[slot]._append(cp.clean_copy())
+
+                        active = [ s for s in current_seqs if s is not None ]
+                        if len(active) > 1 or max_fingers_this_frame > 1:
+                            for s in active:
+                                s.is_single = False
+                                s._link(active)
+                                s.max_fingers = max(s.max_fingers, max_fingers_this_frame)
+                        max_fingers_this_frame = 0
         except Exception as error:
             print("ERROR: in line {}".format(e))
             import traceback
@@ -389,31 +394,298 @@ class TouchSequence:
             print("-----")
             raise error
 
+        if profiling.current() is not None:
+            profiling.count("frames", nframes)
+            profiling.count("sequences", len(sequences))
+            profiling.count("points", sum(len(s.points) for s in sequences))
+
         return sequences
 
+_shared_recordings = None
+_recording_cache = None # see shared.cache.enable()
+
+def load_recording(path):
+    """
+    Return the tuple (device, sequences) with the evemu device of the
+    recording at path and its sequences from
+    TouchSequence.create_from_recording().
+
+    Inside a with shared_recordings() block, each recording is only
+    parsed once and all callers get the same device and sequences, which
+    they must not modify. The same applies to the sequences when a
+    shared.cache.RecordingCache is enabled.
+    """
+    if _shared_recordings is not None and path in _shared_recordings:
+        return _shared_recordings[path]
+
+    d = evemu.Device(path, create=False)
+    if _recording_cache is not None:
+        seqs = _recording_cache.sequences(path)
+    else:
+        seqs = TouchSequence.create_from_recording(d)
+    if _shared_recordings is not None:
+        _shared_recordings[path] = (d, seqs)
+    return d, seqs
+
+class shared_recordings(object):
+    """
+    Context manager, within it load_recording() parses each recording
+    only once, see shared.fused
+    """
+    def __enter__(self):
+        global _shared_recordings
+        self.previous = _shared_recordings
+        _shared_recordings = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _shared_recordings
+        _shared_recordings = self.previous
+        return False
+
+class _ProcessOneFile(object):
+    """
+    Picklable callable for EventProcessor.process_one_file(). With
+    --profile, returns the tuple (result, FileProfile).
+    """
+    def __init__(self, processor, args):
+        self.processor = processor
+        self.args = args
+
+    def _analysis(self, f):
+        # the time not in any stage of the shared code is the tool's own
+        with profiling.stage("analysis"):
+            return self.processor.process_one_file(f, self.args)
+
+    def __call__(self, f):
+        args = self.args
+        if not args.profile:
+            return self.processor.process_one_file(f, args)
+        return profiling.profile_call(f, self._analysis, (f,),
+                                      cprofile=args.profile_cprofile is not None,
+                                      memory=args.profile_memory)
+
 class EventProcessor:
     """
     Members
     -------
         sourcefiles : [ str ]
             All source files given on the command line
+        profiles : [ profiling.FileProfile ]
+            With --profile, the profile of each processed source file
+        run_profile : profiling.FileProfile
+            With --profile, the profile of the whole run once run()
+            finished. The time spent waiting for the results of
+            process_one_file() is in its "files" stage, with or without
+            --jobs and --prefetch.
+        precomputed : [ (filename, result, error) ]
+            The results of process_one_file() for all source files if
+            they were already computed (see shared.fused), None otherwise
+        cache_args : [ str ] or None
+            The names of the arguments that affect the result of
+            process_one_file(), for the --cache key. If None, all but the
+            ones common to all tools are used.
+        cache_version : int
+            Increase to invalidate the --cache entries of the tool when
+            its results change without a change to its code
     """
+    cache_args = None
+    cache_version = 0
+
     def __init__(self):
         parser = argparse.ArgumentParser(description="")
         parser.add_argument("path", metavar="recording", nargs="*", help="Path to evemu recording")
+        parser.add_argument("--jobs", "-j", action="store", type=int, default=1,
+                            help="Number of recordings to process in parallel (default 1)")
+        parser.add_argument("--prefetch", action="store", type=int, default=0, metavar="N",
+                            help="Read up to N recordings ahead of the processing, for "
+                                 "recordings on slow or network storage (default 0, off)")
+        parser.add_argument("--cache", action="store", metavar="DIR", default=None,
+                            help="Keep the result of each recording in DIR and only process "
+                                 "the recordings that are new or changed since the last run "
+                                 "with the same arguments")
+        parser.add_argument("--profile", action="store_true",
+                            help="Time the processing stages and count events, frames, "
+                                 "sequences and points per recording, print a table to "
+                                 "stderr at exit")
+        parser.add_argument("--profile-cprofile", action="store", metavar="PATH", default=None,
+                            help="Run cProfile around each recording and save the combined "
+                                 "statistics to PATH (implies --profile)")
+        parser.add_argument("--profile-memory", action="store_true",
+                            help="Track the peak memory of each recording with tracemalloc "
+                                 "(implies --profile)")
+        parser.add_argument("--profile-output", action="store", metavar="PATH", default=None,
+                            help="Save the profile as JSON to PATH (implies --profile)")
         self.add_args(parser)
         self.args = parser.parse_args()
+        self.args.profile = self.args.profile or self.args.profile_memory or \
+                            self.args.profile_cprofile is not None or \
+                            self.args.profile_output is not None
 
         self.sourcefiles = self.args.path
+        self.profiles = []
+        self.run_profile = None
+        self.precomputed = None
+        self._result_cache = None
+
+    def __getstate__(self):
+        # Pickled when sent to worker processes, the output stays with
+        # the parent
+        state = self.__dict__.copy()
+        state.pop("gnuplot", None)
+        state["profiles"] = []
+        state["_result_cache"] = None
+        return state
 
     def add_args(self, arg_parser):
         pass
 
+    def process_one_file(self, f, parsed_cmdline_args):
+        pass
+
+    def _unpack(self, result, parsed_cmdline_args):
+        if not parsed_cmdline_args.profile:
+            return result
+        result, profile = result
+        self.profiles.append(profile)
+        return result
+
+    def cacheable(self, parsed_cmdline_args):
+        """
+        Return False if the results of process_one_file() can't be taken
+        from the --cache with these arguments. A cache hit skips
+        process_one_file(), so it must not write any output.
+        """
+        return True
+
+    def result_cache(self, parsed_cmdline_args):
+        """
+        Return the shared.resultcache.ResultCache for --cache, None
+        without --cache or if the tool isn't cacheable()
+        """
+        if parsed_cmdline_args.cache is None:
+            return None
+        if not self.cacheable(parsed_cmdline_args):
+            if self._result_cache is None:
+                print("Not using --cache with these arguments", file=sys.stderr)
+                self._result_cache = False
+            return None
+        if self._result_cache is None:
+            from .resultcache import ResultCache
+            self._result_cache = ResultCache.for_processor(parsed_cmdline_args.cache,
+                                                           self, parsed_cmdline_args)
+        return self._result_cache
+
+    def _imap_files(self, func, paths, parsed_cmdline_args, catch = (DeviceError,)):
+        """
+        Return the iterator of (filename, result, error) of func for the
+        paths, with --jobs, --prefetch and --cache
+        """
+        from .parallel import imap_files
+
+        args = parsed_cmdline_args
+        def run(paths):
+            if args.prefetch > 0:
+                from . import pipeline
+                return pipeline.imap_files(func, paths, jobs=args.jobs, catch=catch,
+                                           depth=args.prefetch)
+            return imap_files(func, paths, jobs=args.jobs, catch=catch)
+
+        cache = self.result_cache(args)
+        if cache is None:
+            return run(paths)
+        return cache.imap(run, paths, profile=args.profile)
+
+    def call_one_file(self, f, parsed_cmdline_args):
+        """
+        Call process_one_file() for f in this process and return its
+        result. Tools that don't use map_files() should call this instead
+        of process_one_file() so --profile covers the file.
+        """
+        if self.precomputed is not None:
+            for pf, result, error in self.precomputed:
+                if pf == f:
+                    if error is not None:
+                        raise error
+                    return self._unpack(result, parsed_cmdline_args)
+        func = _ProcessOneFile(self, parsed_cmdline_args)
+        with profiling.stage("files"):
+            if self.result_cache(parsed_cmdline_args) is None:
+                result = func(f)
+            else:
+                for _, result, error in self._imap_files(func, [ f ], parsed_cmdline_args):
+                    if error is not None:
+                        raise error
+        return self._unpack(result, parsed_cmdline_args)
+
+    def map_files(self, parsed_cmdline_args):
+        """
+        Call process_one_file() for each source file and yield the tuple
+        (filename, result) in the order of the source files. Files that
+        raise a DeviceError are skipped.
+
+        With --jobs, the files are processed in worker processes. The
+        result of process_one_file() must then be picklable and
+        process_one_file() must not write to the output.
+
+        With --prefetch, the files are read ahead by the pipeline in
+        shared.pipeline while the previous ones are processed. With
+        --cache, the results of unchanged files are taken from the cache,
+        the result must then be picklable.
+
+        If precomputed is set, its results are used instead.
+        """
+        if self.precomputed is not None:
+            results = self.precomputed
+        else:
+            func = _ProcessOneFile(self, parsed_cmdline_args)
+            results = profiling.timed(self._imap_files(func, self.sourcefiles,
+                                                       parsed_cmdline_args), "files")
+        for f, result, error in results:
+            if error is not None:
+                print("Skipping {} with error: {}".format(f, error))
+                continue
+            yield f, self._unpack(result, parsed_cmdline_args)
+
+    def reduce_files(self, parsed_cmdline_args):
+        """
+        Call process_one_file() for each source file (see map_files())
+        and return the merged results. Accumulators are merged, lists are
+        concatenated and tuples or dicts are merged element-wise.
+        Returns None if no file could be processed.
+        """
+        from .accumulators import merge
+
+        total = None
+        for f, result in self.map_files(parsed_cmdline_args):
+            total = merge(total, result)
+        return total
+
     def process(self, parsed_cmdline_args):
         pass
 
     def run(self):
-        self.process(self.args)
+        args = self.args
+        if not args.profile:
+            self.process(args)
+            return
+
+        result, self.run_profile = profiling.profile_call(None, self.process, (args,))
+        profiling.print_table(self.profiles, self.run_profile)
+
+        if args.profile_cprofile is not None:
+            stats = profiling.merged_pstats(self.profiles)
+            if stats is not None:
+                stats.dump_stats(args.profile_cprofile)
+                stats.sort_stats("cumulative").print_stats(20)
+
+        if args.profile_output is not None:
+            import json
+            with open(args.profile_output, "w") as f:
+                json.dump({ "files": [ p.to_dict() for p in self.profiles ],
+                            "total": profiling.total(self.profiles).to_dict(),
+                            "run": self.run_profile.to_dict() },
+                          f, indent=2, sort_keys=True)
 
 def main(argv):
     d = evemu.Device(argv[0], create=False)
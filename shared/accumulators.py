@@ -0,0 +1,634 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Mergeable accumulators for corpus-wide reductions. Each accumulator
+# collects data for one file (or one worker) and can be merged with other
+# accumulators of the same type and configuration. All accumulators can
+# be serialized into a compact byte string and back.
+
+import collections
+import json
+import math
+import struct
+
+import numpy
+
+from . import stats
+
+class Accumulator(object):
+    """
+    Base class for all accumulators.
+
+    Subclasses implement add() to collect data, merge() to combine with
+    another accumulator of the same type and _state()/_from_state() for
+    serialization.
+    """
+
+    def merge(self, other):
+        """
+        Merge the other accumulator into this one and return self
+        """
+        raise NotImplementedError
+
+    def _check_mergeable(self, other, *attrs):
+        if type(other) is not type(self):
+            raise TypeError("Cannot merge {} into {}".format(
+                            type(other).__name__, type(self).__name__))
+        for a in attrs:
+            if getattr(self, a) != getattr(other, a):
+                raise ValueError("Cannot merge {}s with different {}".format(
+                                 type(self).__name__, a))
+
+    def _state(self):
+        """
+        Return the tuple (meta, arrays) where meta is a JSON-serializable
+        dict and arrays is a dict of name : numpy array
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        raise NotImplementedError
+
+    _MAGIC = b"ACC1"
+
+    def to_bytes(self):
+        """
+        Return a compact byte string representation of this accumulator,
+        see from_bytes()
+        """
+        meta, arrays = self._state()
+        names = sorted(arrays.keys())
+        arrays = [ numpy.ascontiguousarray(arrays[n]) for n in names ]
+        header = {
+            "type": type(self).__name__,
+            "meta": meta,
+            "arrays": [ (n, a.dtype.str, a.shape) for n, a in zip(names, arrays) ],
+        }
+        header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        data = [ self._MAGIC, struct.pack("<I", len(header)), header ]
+        data += [ a.tobytes() for a in arrays ]
+        return b"".join(data)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Create a new accumulator from the output of to_bytes(). The type
+        of the returned accumulator is the type that was serialized.
+        """
+        if data[:4] != cls._MAGIC:
+            raise ValueError("Not a serialized accumulator")
+        hlen, = struct.unpack("<I", data[4:8])
+        header = json.loads(data[8:8 + hlen].decode("utf-8"))
+        offset = 8 + hlen
+        arrays = {}
+        for name, dtype, shape in header["arrays"]:
+            dtype = numpy.dtype(dtype)
+            nbytes = dtype.itemsize * int(numpy.prod(shape))
+            a = numpy.frombuffer(data, dtype=dtype, count=nbytes // dtype.itemsize,
+                                 offset=offset)
+            arrays[name] = a.reshape(shape).copy()
+            offset += nbytes
+
+        return _accumulator_types()[header["type"]]._from_state(header["meta"], arrays)
+
+def _accumulator_types():
+    """
+    Return a dict of class name : class for all Accumulator subclasses,
+    including those defined in other modules
+    """
+    types = {}
+    todo = [ Accumulator ]
+    while todo:
+        cls = todo.pop()
+        for sub in cls.__subclasses__():
+            types[sub.__name__] = sub
+            todo.append(sub)
+    return types
+
+def merge(total, partial):
+    """
+    Merge partial into total and return the result. Accumulators are
+    merged, lists are concatenated, tuples and dicts are merged
+    element-wise. If total is None, partial is returned.
+    """
+    if total is None:
+        return partial
+    if partial is None:
+        return total
+    if isinstance(total, Accumulator):
+        return total.merge(partial)
+    if isinstance(total, list):
+        total.extend(partial)
+        return total
+    if isinstance(total, tuple):
+        return tuple(merge(t, p) for t, p in zip(total, partial))
+    if isinstance(total, dict):
+        for key, value in partial.items():
+            total[key] = merge(total.get(key), value)
+        return total
+
+    raise TypeError("Don't know how to merge {}".format(type(total).__name__))
+
+class Counter(Accumulator):
+    """
+    Counts occurrences of hashable keys. Keys must be JSON-serializable
+    (e.g. int or str) for to_bytes().
+    """
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def add(self, key, count = 1):
+        self.counts[key] += count
+
+    def update(self, keys):
+        """Count each key in the iterable keys"""
+        self.counts.update(keys)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def __getitem__(self, key):
+        return self.counts[key]
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        self.counts.update(other.counts)
+        return self
+
+    def _state(self):
+        return { "items": list(self.counts.items()) }, {}
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        c = Counter()
+        # JSON turns tuples into lists, tuples are the common composite key
+        c.counts.update({ tuple(k) if isinstance(k, list) else k: v
+                          for k, v in meta["items"] })
+        return c
+
+class _Buckets(object):
+    """
+    Internal use only. A growable array of int64 bucket counts, indexed
+    by an integer key that may be negative.
+    """
+    def __init__(self):
+        self.offset = 0
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+
+    @property
+    def lo(self):
+        return self.offset
+
+    @property
+    def hi(self):
+        return self.offset + len(self.counts)
+
+    def add_keys(self, keys, weights = None):
+        if len(keys) == 0:
+            return
+        offset = keys.min()
+        self.add_counts(offset, numpy.bincount(keys - offset, weights=weights).astype(numpy.int64))
+
+    def add_counts(self, offset, counts):
+        if len(counts) == 0:
+            return
+
+        if len(self.counts) == 0:
+            lo, hi = offset, offset + len(counts)
+        else:
+            lo = min(self.lo, offset)
+            hi = max(self.hi, offset + len(counts))
+
+        if lo != self.lo or hi - lo != len(self.counts):
+            grown = numpy.zeros(hi - lo, dtype=numpy.int64)
+            start = self.lo - lo
+            grown[start:start + len(self.counts)] = self.counts
+            self.counts = grown
+            self.offset = int(lo)
+
+        start = offset - self.offset
+        self.counts[start:start + len(counts)] += counts
+
+    def collapse_low(self, max_buckets):
+        """Fold the lowest buckets into one so at most max_buckets remain"""
+        excess = len(self.counts) - max_buckets
+        if excess > 0:
+            self.counts[excess] += self.counts[:excess].sum()
+            self.counts = self.counts[excess:]
+            self.offset += excess
+
+    def slice(self, lo, hi):
+        """Return the counts for the keys [lo, hi), zero-filled"""
+        out = numpy.zeros(max(hi - lo, 0), dtype=numpy.int64)
+        a, b = max(lo, self.lo), min(hi, self.hi)
+        if a < b:
+            out[a - lo:b - lo] = self.counts[a - self.lo:b - self.lo]
+        return out
+
+class Histogram(Accumulator):
+    """
+    A histogram with fixed-size bins that grows as needed. Bin i holds
+    the values in [origin + i * binsize, origin + (i + 1) * binsize), i
+    may be negative.
+
+    Members
+    -------
+        binsize : double
+        origin : double
+        count : int
+            The number of values added
+    """
+    def __init__(self, binsize = 1, origin = 0):
+        if binsize <= 0:
+            raise ValueError("binsize must be positive")
+        self.binsize = binsize
+        self.origin = origin
+        self._buckets = _Buckets()
+
+    def add(self, values, weights = None):
+        """
+        Add a single value or an array of values, optionally with integer
+        weights (counts) of the same shape
+        """
+        values = numpy.asarray(values, dtype=numpy.float64).ravel()
+        if not numpy.all(numpy.isfinite(values)):
+            raise ValueError("values must be finite numbers")
+        if weights is not None:
+            weights = numpy.asarray(weights).ravel()
+        keys = numpy.floor((values - self.origin) / self.binsize).astype(numpy.int64)
+        self._buckets.add_keys(keys, weights)
+
+    @property
+    def count(self):
+        return int(self._buckets.counts.sum())
+
+    @property
+    def bins(self):
+        """The range of bin indices with data, as tuple (lo, hi)"""
+        return self._buckets.lo, self._buckets.hi
+
+    def counts(self, lo = None, hi = None):
+        """
+        Return the counts for the bins [lo, hi) as numpy array. By
+        default, all bins with data are returned.
+        """
+        if lo is None:
+            lo = self._buckets.lo
+        if hi is None:
+            hi = self._buckets.hi
+        return self._buckets.slice(lo, hi)
+
+    def values(self):
+        """
+        Return the tuple (values, counts) with the lower edge of each bin
+        with data and the count of values in that bin
+        """
+        keys = numpy.arange(self._buckets.lo, self._buckets.hi)
+        return self.origin + keys * self.binsize, self._buckets.counts
+
+    def mean(self):
+        values, counts = self.values()
+        return stats.mean(counts, values)
+
+    def variance(self, ddof = 0):
+        values, counts = self.values()
+        return stats.variance(counts, values, ddof)
+
+    def percentiles(self, pcs):
+        values, counts = self.values()
+        return stats.percentiles(counts, pcs, values)
+
+    def merge(self, other):
+        self._check_mergeable(other, "binsize", "origin")
+        self._buckets.add_counts(other._buckets.offset, other._buckets.counts)
+        return self
+
+    def _state(self):
+        meta = { "binsize": self.binsize, "origin": self.origin,
+                 "offset": int(self._buckets.offset) }
+        return meta, { "counts": self._buckets.counts }
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        h = Histogram(meta["binsize"], meta["origin"])
+        h._buckets.offset = meta["offset"]
+        h._buckets.counts = arrays["counts"]
+        return h
+
+class LogHistogram(Accumulator):
+    """
+    A histogram with logarithmically sized buckets, similar to an HDR
+    histogram or DDSketch. Any value is mapped into a bucket whose
+    representative value is within the relative error of the original
+    value, so quantiles have a bounded relative error independent of the
+    number of samples.
+
+    Two LogHistograms with the same relative error can be merged, making
+    it possible to build one sketch per file (or per process) and combine
+    them afterwards.
+
+    Members
+    -------
+        relative_error : double
+            The maximum relative error of a value, e.g. 0.01 for 1%
+        max_buckets : int
+            The maximum number of buckets. If exceeded, the lowest buckets
+            are collapsed into one, sacrificing precision at the low end.
+        min_value : double
+            Values below this are counted in a separate zero bucket
+        count : int
+            The number of values added
+        min, max : double
+            The exact smallest and largest value added, None if empty
+    """
+
+    def __init__(self, relative_error = 0.01, max_buckets = 2048, min_value = 1e-6):
+        if not 0 < relative_error < 1:
+            raise ValueError("relative error must be in the range (0, 1)")
+
+        self.relative_error = relative_error
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.count = 0
+        self.zero_count = 0
+        self.min = None
+        self.max = None
+
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        # bucket k holds values in (gamma^(k - 1), gamma^k]
+        self._buckets = _Buckets()
+
+    def add(self, values):
+        """
+        Add a single value or an array of values. Negative values are not
+        supported.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64).ravel()
+        if len(values) == 0:
+            return
+        if numpy.any(values < 0) or numpy.any(numpy.isnan(values)):
+            raise ValueError("values must be positive numbers")
+
+        vmin, vmax = values.min(), values.max()
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+        self.count += len(values)
+
+        small = values <= self.min_value
+        self.zero_count += int(small.sum())
+        keys = numpy.ceil(numpy.log(values[~small]) / self._log_gamma).astype(numpy.int64)
+        self._buckets.add_keys(keys)
+        self._buckets.collapse_low(self.max_buckets)
+
+    def merge(self, other):
+        self._check_mergeable(other, "relative_error", "min_value", "max_buckets")
+
+        if other.count == 0:
+            return self
+
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.count += other.count
+        self.zero_count += other.zero_count
+        self._buckets.add_counts(other._buckets.offset, other._buckets.counts)
+        self._buckets.collapse_low(self.max_buckets)
+        return self
+
+    def values(self):
+        """
+        Return the tuple (values, counts) with the representative value
+        of each bucket and the count of values in that bucket. The zero
+        bucket is included as value 0.
+        """
+        keys = numpy.arange(self._buckets.lo, self._buckets.hi)
+        values = 2.0 * self._gamma ** keys / (self._gamma + 1)
+        # the representative value may be slightly outside the exact range
+        if self.count > 0:
+            values = numpy.clip(values, self.min, self.max)
+        values = numpy.concatenate(([0.0], values))
+        counts = numpy.concatenate(([self.zero_count], self._buckets.counts))
+        return values, counts
+
+    def percentiles(self, pcs):
+        """
+        Return the approximate percentiles in the range [0, 100] as numpy
+        array, filled with numpy.nan if the sketch is empty.
+        """
+        values, counts = self.values()
+        return stats.percentiles(counts, pcs, values)
+
+    def mean(self):
+        """Return the approximate mean or numpy.nan if empty"""
+        values, counts = self.values()
+        return stats.mean(counts, values)
+
+    def linear_buckets(self, bucketsize):
+        """
+        Return a numpy array of counts in fixed-size buckets, i.e. where
+        buckets[i] is the number of values in [i * bucketsize, (i + 1) *
+        bucketsize). Values are placed by their bucket's representative
+        value.
+        """
+        values, counts = self.values()
+        if self.count == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        idx = (values / bucketsize).astype(numpy.int64)
+        return numpy.bincount(idx, weights=counts,
+                              minlength=int(self.max / bucketsize) + 1).astype(numpy.int64)
+
+    def _state(self):
+        meta = {
+            "relative_error": self.relative_error,
+            "max_buckets": self.max_buckets,
+            "min_value": self.min_value,
+            "count": self.count,
+            "zero_count": self.zero_count,
+            "min": None if self.min is None else float(self.min),
+            "max": None if self.max is None else float(self.max),
+            "offset": int(self._buckets.offset),
+        }
+        return meta, { "counts": self._buckets.counts }
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        h = LogHistogram(meta["relative_error"], meta["max_buckets"], meta["min_value"])
+        h.count = meta["count"]
+        h.zero_count = meta["zero_count"]
+        h.min = meta["min"]
+        h.max = meta["max"]
+        h._buckets.offset = meta["offset"]
+        h._buckets.counts = arrays["counts"]
+        return h
+
+    def __repr__(self):
+        return "LogHistogram(count={}, min={}, max={}, buckets={})".format(
+                self.count, self.min, self.max, len(self._buckets.counts))
+
+class Histogram2D(Accumulator):
+    """
+    A two-dimensional histogram over a fixed grid. Cell (i, j) holds the
+    values with x in [xorigin + i * xbinsize, xorigin + (i + 1) *
+    xbinsize) and y likewise. Values outside the grid are only counted
+    in the outside member, unless clip is True in which case they are
+    counted in the nearest border cell.
+
+    Members
+    -------
+        shape : (nx, ny)
+        binsize : (xbinsize, ybinsize)
+        origin : (xorigin, yorigin)
+        grid : numpy array of shape (nx, ny)
+        outside : int
+            The number of values that fell outside the grid
+    """
+    def __init__(self, shape, binsize = (1, 1), origin = (0, 0), clip = False):
+        self.shape = tuple(int(s) for s in shape)
+        self.binsize = tuple(binsize)
+        self.origin = tuple(origin)
+        self.clip = clip
+        self.grid = numpy.zeros(self.shape, dtype=numpy.int64)
+        self.outside = 0
+
+    def add(self, x, y, weights = None):
+        """Add a single point or arrays of points"""
+        x = numpy.asarray(x, dtype=numpy.float64).ravel()
+        y = numpy.asarray(y, dtype=numpy.float64).ravel()
+        i = numpy.floor((x - self.origin[0]) / self.binsize[0]).astype(numpy.int64)
+        j = numpy.floor((y - self.origin[1]) / self.binsize[1]).astype(numpy.int64)
+        if self.clip:
+            i = numpy.clip(i, 0, self.shape[0] - 1)
+            j = numpy.clip(j, 0, self.shape[1] - 1)
+        inside = (i >= 0) & (i < self.shape[0]) & (j >= 0) & (j < self.shape[1])
+        if weights is not None:
+            weights = numpy.asarray(weights).ravel()
+            self.outside += int(weights[~inside].sum())
+            weights = weights[inside]
+        else:
+            self.outside += int(len(x) - inside.sum())
+
+        flat = i[inside] * self.shape[1] + j[inside]
+        counts = numpy.bincount(flat, weights=weights, minlength=self.grid.size)
+        self.grid += counts.astype(numpy.int64).reshape(self.shape)
+
+    @property
+    def count(self):
+        return int(self.grid.sum()) + self.outside
+
+    def merge(self, other):
+        self._check_mergeable(other, "shape", "binsize", "origin", "clip")
+        self.grid += other.grid
+        self.outside += other.outside
+        return self
+
+    def _state(self):
+        meta = { "shape": self.shape, "binsize": self.binsize,
+                 "origin": self.origin, "clip": self.clip, "outside": self.outside }
+        return meta, { "grid": self.grid }
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        h = Histogram2D(meta["shape"], meta["binsize"], meta["origin"], meta["clip"])
+        h.grid = arrays["grid"]
+        h.outside = meta["outside"]
+        return h
+
+class MeanVariance(Accumulator):
+    """
+    Running mean and variance using Welford's algorithm, merged with
+    Chan's parallel update so merging is numerically stable.
+
+    Members
+    -------
+        count : int
+        mean : double
+            numpy.nan if empty
+    """
+    def __init__(self):
+        self.count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, values):
+        """Add a single value or an array of values"""
+        values = numpy.asarray(values, dtype=numpy.float64).ravel()
+        if len(values) == 0:
+            return
+        batch = MeanVariance()
+        batch.count = len(values)
+        batch._mean = float(values.mean())
+        batch._m2 = float(((values - batch._mean) ** 2).sum())
+        self.merge(batch)
+
+    @property
+    def mean(self):
+        return self._mean if self.count > 0 else numpy.nan
+
+    def variance(self, ddof = 0):
+        if self.count <= ddof:
+            return numpy.nan
+        return self._m2 / (self.count - ddof)
+
+    def stddev(self, ddof = 0):
+        return math.sqrt(self.variance(ddof))
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        n = self.count + other.count
+        if other.count == 0:
+            return self
+        delta = other._mean - self._mean
+        self._mean += delta * other.count / n
+        self._m2 += other._m2 + delta ** 2 * self.count * other.count / n
+        self.count = n
+        return self
+
+    def _state(self):
+        return { "count": self.count, "mean": self._mean, "m2": self._m2 }, {}
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        m = MeanVariance()
+        m.count = meta["count"]
+        m._mean = meta["mean"]
+        m._m2 = meta["m2"]
+        return m
+
+class MinMax(Accumulator):
+    """
+    The minimum and maximum of all values added, both None if empty
+    """
+    def __init__(self):
+        self.min = None
+        self.max = None
+
+    def add(self, values):
+        """Add a single value or an array of values"""
+        values = numpy.asarray(values).ravel()
+        if len(values) == 0:
+            return
+        self._update(values.min().item(), values.max().item())
+
+    def _update(self, vmin, vmax):
+        if vmin is None:
+            return
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        self._update(other.min, other.max)
+        return self
+
+    def _state(self):
+        return { "min": self.min, "max": self.max }, {}
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        m = MinMax()
+        m.min = meta["min"]
+        m.max = meta["max"]
+        return m
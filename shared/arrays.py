@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Flat numpy views of touch sequences for vectorised processing.
+
+import numpy
+
+class PointArrays(object):
+    """
+    The points of a list of TouchSequences, concatenated into flat numpy
+    arrays. The points of sequence i are in the index range
+    [offsets[i], offsets[i + 1]).
+
+    Members
+    -------
+        time : numpy array of double
+            timestamp in µs, relative to each sequence's start time
+        x, y : numpy array of double
+            x/y coordinate in mm relative to the origin
+        x_percent, y_percent : numpy array of double
+            x/y coordinate normalized to [0.0, 1.0]
+        pressure : numpy array of double
+            pressure per point, numpy.nan where the point has no pressure
+        offsets : numpy array of int
+            The start index of each sequence, with one extra element for
+            the end of the last sequence
+    """
+    def __init__(self, time, x, y, x_percent, y_percent, pressure, offsets):
+        self.time = time
+        self.x = x
+        self.y = y
+        self.x_percent = x_percent
+        self.y_percent = y_percent
+        self.pressure = pressure
+        self.offsets = offsets
+
+    @classmethod
+    def from_sequences(self, sequences):
+        """
+        Create the arrays from a list of TouchSequences
+        """
+        points = [ p for s in sequences for p in s.points ]
+        lengths = [ len(s.points) for s in sequences ]
+        offsets = numpy.zeros(len(sequences) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+
+        def column(values):
+            return numpy.array(values, dtype=numpy.float64)
+
+        return PointArrays(column([ p.time for p in points ]),
+                           column([ p.mm[0] for p in points ]),
+                           column([ p.mm[1] for p in points ]),
+                           column([ p.percent[0] for p in points ]),
+                           column([ p.percent[1] for p in points ]),
+                           column([ numpy.nan if p.pressure is None else p.pressure
+                                    for p in points ]),
+                           offsets)
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def nsequences(self):
+        return len(self.offsets) - 1
+
+    def sequence_index(self):
+        """
+        Return an array with the index of the sequence for each point
+        """
+        return numpy.repeat(numpy.arange(self.nsequences), numpy.diff(self.offsets))
+
+    def position_in_sequence(self):
+        """
+        Return an array with the index of each point within its sequence
+        """
+        return numpy.arange(len(self)) - numpy.repeat(self.offsets[:-1],
+                                                      numpy.diff(self.offsets))
+
+    def split(self, values):
+        """
+        Split an array aligned with the points into one array per sequence
+        """
+        return numpy.split(values, self.offsets[1:-1])
+
+def segment_diff(values, offsets):
+    """
+    Return the tuple (deltas, offsets) with numpy.diff() applied to each
+    segment [offsets[i], offsets[i + 1]) of values separately, and the
+    offsets of the segments in deltas. A segment of n values has
+    max(n - 1, 0) deltas.
+    """
+    values = numpy.asarray(values)
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    deltas = numpy.diff(values, axis=0)
+
+    # drop the deltas across segment boundaries
+    starts = offsets[1:-1]
+    starts = starts[(starts > 0) & (starts < len(values))]
+    keep = numpy.ones(len(deltas), dtype=bool)
+    keep[starts - 1] = False
+
+    lengths = numpy.maximum(numpy.diff(offsets) - 1, 0)
+    delta_offsets = numpy.zeros(len(offsets), dtype=numpy.int64)
+    numpy.cumsum(lengths, out=delta_offsets[1:])
+    return deltas[keep], delta_offsets
+
+def segment_reduce(ufunc, values, offsets):
+    """
+    Return ufunc.reduceat() over each segment [offsets[i], offsets[i + 1])
+    of values, numpy.nan for empty segments
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    starts = offsets[:-1]
+    empty = numpy.diff(offsets) == 0
+
+    result = numpy.full(len(starts), numpy.nan)
+    if numpy.all(empty):
+        return result
+    # the non-empty segments tile values, so reduceat covers exactly
+    # one segment per start
+    result[~empty] = ufunc.reduceat(values, starts[~empty])
+    return result
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# A memory-bounded LRU cache of parsed recordings for long-lived sessions
+# (notebooks, scripted sweeps) that parse the same files again and again:
+#
+#       cache = RecordingCache(max_bytes=512 * 1024 * 1024)
+#       seqs = cache.sequences("touchpad.evemu")
+#       frames = cache.frames("touchpad.evemu", [ "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y" ])
+#       print(cache.stats())
+#
+# With enable(), load_recording() uses a cache too, so EventProcessor
+# tools run repeatedly in the same process only parse a file once.
+
+import collections
+import os
+import sys
+
+import evemu
+
+import shared
+from .extract import FrameData
+
+def _sizeof_point(p):
+    size = sys.getsizeof(p) + sys.getsizeof(p.__dict__)
+    for v in (p.mm, p.percent):
+        size += sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v)
+    size += sys.getsizeof(p.time) + sys.getsizeof(p.pressure)
+    return size
+
+def sizeof_sequences(seqs):
+    """
+    Return the estimated size in bytes of a list of TouchSequences, based
+    on the size of the first point
+    """
+    npoints = sum(len(s.points) for s in seqs)
+    point = next((s.points[0] for s in seqs if s.points), None)
+    size = sys.getsizeof(seqs)
+    for s in seqs:
+        size += sys.getsizeof(s) + sys.getsizeof(s.__dict__) + \
+                sys.getsizeof(s.points) + sys.getsizeof(s.linked)
+    if point is not None:
+        size += npoints * _sizeof_point(point)
+    return size
+
+def sizeof_frames(frames):
+    """Return the size in bytes of the arrays of a FrameData"""
+    size = frames.time.nbytes + frames.tracking_id.nbytes + frames.touching.nbytes
+    for a in frames.values.keys():
+        size += frames.values[a].nbytes + frames.changed[a].nbytes
+    return size
+
+class RecordingCache(object):
+    """
+    An LRU cache of parsed recordings with a byte budget. An entry is
+    keyed by the path, the kind of data and the parser options, and is
+    only valid as long as the file's mtime and size are unchanged.
+
+    Members
+    -------
+        max_bytes : int
+            The budget, the least recently used entries are evicted to
+            stay below it. Entries larger than the budget are not cached.
+        bytes : int
+            The estimated size of all entries
+        hits, misses, evictions : int
+    """
+    def __init__(self, max_bytes = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict() # key : (stamp, value, size)
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+
+    def _remove(self, key):
+        stamp, value, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, path, kind, options, load, sizeof):
+        """
+        Return the cached value for path, kind and options or call
+        load() to create it.
+
+        Params
+        ------
+        kind : str
+            The kind of data, e.g. "sequences"
+        options : tuple
+            The parser options, must be hashable
+        load : callable
+            Called without arguments to parse the recording on a miss
+        sizeof : callable
+            Called with the value, returns its size in bytes
+        """
+        key = (os.path.realpath(path), kind, options)
+        stamp = self._stamp(path)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] == stamp:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            # the file changed
+            self._remove(key)
+
+        self.misses += 1
+        value = load()
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return value
+
+        while self._entries and self.bytes + size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        self._entries[key] = (stamp, value, size)
+        self.bytes += size
+        return value
+
+    def sequences(self, path):
+        """
+        Return the TouchSequence.create_from_recording() sequences of the
+        recording. The sequences are shared by all callers and must not
+        be modified.
+        """
+        def load():
+            d = evemu.Device(path, create=False)
+            return shared.TouchSequence.create_from_recording(d)
+        return self.get(path, "sequences", (), load, sizeof_sequences)
+
+    def frames(self, path, axes):
+        """
+        Return the FrameData.from_recording() of the recording for the
+        given axes. The arrays are shared by all callers and must not be
+        modified.
+        """
+        def load():
+            d = evemu.Device(path, create=False)
+            return FrameData.from_recording(d, axes)
+        return self.get(path, "frames", tuple(axes), load, sizeof_frames)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Return a dict with the hits, misses, evictions, entries, bytes
+        held and the budget max_bytes
+        """
+        return { "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                 "entries": len(self._entries), "bytes": self.bytes,
+                 "max_bytes": self.max_bytes }
+
+def enable(max_bytes = 256 * 1024 * 1024):
+    """
+    Make load_recording() use a new RecordingCache with the given budget
+    and return it
+    """
+    cache = RecordingCache(max_bytes)
+    shared._recording_cache = cache
+    return cache
+
+def disable():
+    shared._recording_cache = None
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Reduces large point clouds and time series before they are written, so
+# the data files stay small enough for gnuplot.
+
+import numpy
+
+from .accumulators import Accumulator, Histogram2D
+
+def _cells(x, y, shape, xrange, yrange):
+    """
+    Return the flat grid cell index for each point, points outside the
+    ranges are clipped into the border cells
+    """
+    i = numpy.floor((x - xrange[0]) / (xrange[1] - xrange[0]) * shape[0])
+    j = numpy.floor((y - yrange[0]) / (yrange[1] - yrange[0]) * shape[1])
+    i = numpy.clip(i, 0, shape[0] - 1).astype(numpy.int64)
+    j = numpy.clip(j, 0, shape[1] - 1).astype(numpy.int64)
+    return i * shape[1] + j
+
+def spatial_sample(x, y, shape, xrange, yrange, per_cell = 1, seed = 0):
+    """
+    Return the indices of an approximately uniform spatial sample of the
+    points: at most per_cell randomly chosen points in each cell of a
+    grid over the given ranges. The indices are sorted, the selection is
+    deterministic for a given seed.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    cells = _cells(x, y, shape, xrange, yrange)
+
+    # shuffle, then group by cell, the first per_cell of each group win
+    rng = numpy.random.RandomState(seed)
+    order = rng.permutation(len(x))
+    order = order[numpy.argsort(cells[order], kind="stable")]
+    sorted_cells = cells[order]
+    rank = numpy.arange(len(order)) - numpy.searchsorted(sorted_cells, sorted_cells, side="left")
+
+    return numpy.sort(order[rank < per_cell])
+
+def minmax(x, y, buckets):
+    """
+    Return the sorted indices of the minimum and maximum y value in each
+    of buckets equally sized buckets, plus the first and last point.
+    This keeps every peak of the series.
+    """
+    y = numpy.asarray(y, dtype=numpy.float64)
+    n = len(y)
+    if buckets * 2 + 2 >= n:
+        return numpy.arange(n)
+
+    size = -(-n // buckets)
+    padded = numpy.full(size * buckets, numpy.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    # the last bucket may be partially or entirely padding
+    valid = ~numpy.all(numpy.isnan(padded), axis=1)
+    starts = numpy.arange(buckets)[valid] * size
+    imin = starts + numpy.nanargmin(padded[valid], axis=1)
+    imax = starts + numpy.nanargmax(padded[valid], axis=1)
+
+    return numpy.unique(numpy.concatenate(([0, n - 1], imin, imax)))
+
+def lttb(x, y, n):
+    """
+    Return the sorted indices of n points selected with the
+    Largest-Triangle-Three-Buckets algorithm, which preserves the visual
+    shape of the series.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    npoints = len(x)
+    if n >= npoints or n < 3:
+        return numpy.arange(npoints)
+
+    # n - 2 buckets over the points between the first and the last point
+    edges = 1 + (numpy.arange(n - 1) * (npoints - 2)) // (n - 2)
+    indices = numpy.zeros(n, dtype=numpy.int64)
+    indices[-1] = npoints - 1
+
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo = edges[i + 1]
+        nhi = edges[i + 2] if i + 2 < len(edges) else npoints
+        avgx = x[nlo:nhi].mean()
+        avgy = y[nlo:nhi].mean()
+
+        area = numpy.abs((x[a] - avgx) * (y[lo:hi] - y[a]) -
+                         (x[a] - x[lo:hi]) * (avgy - y[a]))
+        a = lo + int(numpy.argmax(area))
+        indices[i + 1] = a
+
+    return indices
+
+def downsample(x, y, npoints, method = "lttb"):
+    """
+    Return the sorted indices of about npoints points of the series using
+    the method "lttb" or "minmax".
+    """
+    if method == "lttb":
+        return lttb(x, y, npoints)
+    elif method == "minmax":
+        return minmax(x, y, max(npoints // 2, 1))
+    raise ValueError("Unknown downsampling method {}".format(method))
+
+class PointSample(Accumulator):
+    """
+    A mergeable spatial sample of a point cloud, see spatial_sample(). If
+    per_cell is None, all points are kept.
+
+    Members
+    -------
+        points : numpy array of shape (n, 2)
+            The points kept
+        count : int
+            The number of points added, including those dropped
+    """
+    def __init__(self, shape, xrange, yrange, per_cell = None, seed = 0):
+        self.shape = tuple(shape)
+        self.xrange = tuple(xrange)
+        self.yrange = tuple(yrange)
+        self.per_cell = per_cell
+        self.seed = seed
+        self.count = 0
+        self.points = numpy.zeros((0, 2))
+
+    def _reduce(self, points):
+        if self.per_cell is None:
+            return points
+        keep = spatial_sample(points[:, 0], points[:, 1], self.shape,
+                              self.xrange, self.yrange, self.per_cell, self.seed)
+        return points[keep]
+
+    def add(self, x, y):
+        """Add a single point or arrays of points"""
+        points = numpy.column_stack((numpy.asarray(x, dtype=numpy.float64).ravel(),
+                                     numpy.asarray(y, dtype=numpy.float64).ravel()))
+        self.count += len(points)
+        self.points = self._reduce(numpy.concatenate((self.points, points)))
+
+    def merge(self, other):
+        self._check_mergeable(other, "shape", "xrange", "yrange", "per_cell")
+        self.count += other.count
+        self.points = self._reduce(numpy.concatenate((self.points, other.points)))
+        return self
+
+    def _state(self):
+        meta = { "shape": self.shape, "xrange": self.xrange, "yrange": self.yrange,
+                 "per_cell": self.per_cell, "seed": self.seed, "count": self.count }
+        return meta, { "points": self.points }
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        s = PointSample(meta["shape"], meta["xrange"], meta["yrange"],
+                        meta["per_cell"], meta["seed"])
+        s.count = meta["count"]
+        s.points = arrays["points"]
+        return s
+
+def add_decimation_args(parser):
+    """
+    Add the command line arguments for new_point_decimator() to the
+    argparse parser
+    """
+    parser.add_argument("--decimate", choices=["none", "grid", "sample"],
+                        default="none",
+                        help="Reduce the points written: bin them into a grid "
+                             "or keep a spatially uniform sample (default none)")
+    parser.add_argument("--grid-size", action="store", type=int, default=256,
+                        help="Number of grid cells along each axis for --decimate (default 256)")
+    parser.add_argument("--per-cell", action="store", type=int, default=1,
+                        help="Points to keep per grid cell for --decimate sample (default 1)")
+
+def new_point_decimator(args, xrange, yrange):
+    """
+    Return an empty accumulator for the points, based on the arguments
+    from add_decimation_args(): a Histogram2D for grid binning, otherwise
+    a PointSample.
+    """
+    shape = (args.grid_size, args.grid_size)
+    if args.decimate == "grid":
+        binsize = ((xrange[1] - xrange[0]) / float(shape[0]),
+                   (yrange[1] - yrange[0]) / float(shape[1]))
+        return Histogram2D(shape, binsize, (xrange[0], yrange[0]), clip=True)
+    per_cell = args.per_cell if args.decimate == "sample" else None
+    return PointSample(shape, xrange, yrange, per_cell)
+
+def decimated_data(points, title = "notitle"):
+    """
+    Return the tuple (data, comment, using) for an accumulator from
+    new_point_decimator(): the numpy array to write, a comment describing
+    the reduction and the gnuplot using/title/style specification.
+    """
+    if isinstance(points, Histogram2D):
+        i, j = numpy.nonzero(points.grid)
+        x = points.origin[0] + (i + 0.5) * points.binsize[0]
+        y = points.origin[1] + (j + 0.5) * points.binsize[1]
+        data = numpy.column_stack((x, y, points.grid[i, j]))
+        comment = "binned {} points into {} grid cells ({:.4f} of the data)".format(
+                  points.count, len(data), len(data) / float(max(points.count, 1)))
+        using = "using 1:2:3 {} with points pt 7 ps 0.5 palette".format(title)
+    else:
+        data = points.points
+        comment = "kept {} of {} points ({:.4f} of the data)".format(
+                  len(data), points.count, len(data) / float(max(points.count, 1)))
+        using = "using 1:2 {}".format(title)
+
+    return data, comment, using
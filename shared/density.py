@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Touch density grids over the sensor area. Per-file counts are collected
+# in a SparseGrid, which is small and cheap to send between processes, and
+# merged into a DensityGrid holding the counts for the whole corpus. A
+# DensityGrid may be backed by a memory-mapped .npy file and is always
+# processed in tiles of rows, so it never has to be in memory in full.
+
+import numpy
+
+from .accumulators import Accumulator
+
+class _GridGeometry(Accumulator):
+    """
+    Internal use only. The mapping from sensor coordinates to grid cells.
+    Cell (row, column) holds the coordinates with x in [xmin + column *
+    binsize, xmin + (column + 1) * binsize) and y likewise. Coordinates
+    outside the ranges are counted in the nearest border cell.
+
+    Members
+    -------
+        xrange, yrange : (min, max)
+            The inclusive coordinate ranges covered by the grid
+        binsize : int
+            The size of one cell in device units
+        shape : (rows, columns)
+    """
+    def __init__(self, xrange, yrange, binsize = 1):
+        if binsize < 1:
+            raise ValueError("binsize must be at least 1")
+        self.xrange = tuple(xrange)
+        self.yrange = tuple(yrange)
+        self.binsize = binsize
+        self.shape = ((yrange[1] - yrange[0]) // binsize + 1,
+                      (xrange[1] - xrange[0]) // binsize + 1)
+
+    def _flat_indices(self, x, y):
+        x = numpy.asarray(x, dtype=numpy.int64).ravel()
+        y = numpy.asarray(y, dtype=numpy.int64).ravel()
+        col = numpy.clip((x - self.xrange[0]) // self.binsize, 0, self.shape[1] - 1)
+        row = numpy.clip((y - self.yrange[0]) // self.binsize, 0, self.shape[0] - 1)
+        return row * self.shape[1] + col
+
+    def _geometry(self):
+        return { "xrange": self.xrange, "yrange": self.yrange, "binsize": self.binsize }
+
+class SparseGrid(_GridGeometry):
+    """
+    Counts per grid cell, storing only the cells with a nonzero count.
+
+    Members
+    -------
+        indices : numpy array of int
+            The sorted flat indices (row * columns + column) of the cells
+        counts : numpy array of int
+            The count for each cell in indices
+    """
+    def __init__(self, xrange, yrange, binsize = 1):
+        _GridGeometry.__init__(self, xrange, yrange, binsize)
+        self.indices = numpy.zeros(0, dtype=numpy.int64)
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+
+    def _add_indices(self, indices, counts):
+        indices = numpy.concatenate((self.indices, indices))
+        counts = numpy.concatenate((self.counts, counts))
+        self.indices, inverse = numpy.unique(indices, return_inverse=True)
+        self.counts = numpy.bincount(inverse.ravel(), weights=counts,
+                                     minlength=len(self.indices)).astype(numpy.int64)
+
+    def add(self, x, y):
+        """Add a single point or arrays of points"""
+        indices = self._flat_indices(x, y)
+        self._add_indices(indices, numpy.ones(len(indices), dtype=numpy.int64))
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def merge(self, other):
+        self._check_mergeable(other, "xrange", "yrange", "binsize")
+        self._add_indices(other.indices, other.counts)
+        return self
+
+    def _state(self):
+        return self._geometry(), { "indices": self.indices, "counts": self.counts }
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        g = SparseGrid(meta["xrange"], meta["yrange"], meta["binsize"])
+        g.indices = arrays["indices"]
+        g.counts = arrays["counts"]
+        return g
+
+class DensityGrid(_GridGeometry):
+    """
+    Counts for every grid cell, see _GridGeometry. If path is given, the
+    counts are stored in a memory-mapped .npy file at that path, otherwise
+    in memory.
+
+    SparseGrids and other DensityGrids can be merged into a DensityGrid,
+    merging is done in tiles of tile_rows rows.
+
+    Members
+    -------
+        grid : numpy array or numpy.memmap of shape (rows, columns)
+    """
+    def __init__(self, xrange, yrange, binsize = 1, path = None,
+                 dtype = "uint32", tile_rows = None):
+        _GridGeometry.__init__(self, xrange, yrange, binsize)
+        self.path = path
+        if path is not None:
+            self.grid = numpy.lib.format.open_memmap(path, mode="w+", dtype=dtype,
+                                                     shape=self.shape)
+        else:
+            self.grid = numpy.zeros(self.shape, dtype=dtype)
+
+        if tile_rows is None:
+            # about 16M cells per tile
+            tile_rows = max(1, (1 << 24) // self.shape[1])
+        self.tile_rows = tile_rows
+
+    def tiles(self):
+        """Yield the (first, last + 1) row ranges of each tile"""
+        for r in range(0, self.shape[0], self.tile_rows):
+            yield r, min(r + self.tile_rows, self.shape[0])
+
+    def add(self, x, y):
+        """Add a single point or arrays of points"""
+        sparse = SparseGrid(self.xrange, self.yrange, self.binsize)
+        sparse.add(x, y)
+        self.merge(sparse)
+
+    def _merge_sparse(self, other):
+        # indices are unique, so a fancy-indexed add is safe
+        flat = self.grid.reshape(-1)
+        for r0, r1 in self.tiles():
+            lo, hi = numpy.searchsorted(other.indices, [r0 * self.shape[1], r1 * self.shape[1]])
+            if lo < hi:
+                idx = other.indices[lo:hi]
+                flat[idx] += other.counts[lo:hi].astype(self.grid.dtype)
+
+    def merge(self, other):
+        if not isinstance(other, (SparseGrid, DensityGrid)):
+            raise TypeError("Cannot merge {} into {}".format(
+                            type(other).__name__, type(self).__name__))
+        for a in ("xrange", "yrange", "binsize"):
+            if getattr(self, a) != getattr(other, a):
+                raise ValueError("Cannot merge grids with different {}".format(a))
+
+        if isinstance(other, SparseGrid):
+            self._merge_sparse(other)
+        else:
+            for r0, r1 in self.tiles():
+                self.grid[r0:r1] += other.grid[r0:r1]
+        return self
+
+    @property
+    def count(self):
+        return int(sum(self.grid[r0:r1].sum(dtype=numpy.int64) for r0, r1 in self.tiles()))
+
+    def max(self):
+        return int(max(self.grid[r0:r1].max() for r0, r1 in self.tiles()))
+
+    def save(self, path):
+        """
+        Save the counts as .npy file. For a memory-mapped grid at the same
+        path, this only flushes the data to disk.
+        """
+        if self.path is not None and self.path == path:
+            self.grid.flush()
+            return
+
+        out = numpy.lib.format.open_memmap(path, mode="w+", dtype=self.grid.dtype,
+                                           shape=self.shape)
+        for r0, r1 in self.tiles():
+            out[r0:r1] = self.grid[r0:r1]
+        out.flush()
+
+    def log_image(self):
+        """
+        Return the counts as uint8 array scaled logarithmically to [0, 255]
+        """
+        image = numpy.zeros(self.shape, dtype=numpy.uint8)
+        vmax = self.max()
+        if vmax == 0:
+            return image
+
+        scale = 255.0 / numpy.log1p(vmax)
+        for r0, r1 in self.tiles():
+            image[r0:r1] = numpy.log1p(self.grid[r0:r1]) * scale
+        return image
+
+    def _state(self):
+        return self._geometry(), { "grid": numpy.asarray(self.grid) }
+
+    @classmethod
+    def _from_state(cls, meta, arrays):
+        g = DensityGrid(meta["xrange"], meta["yrange"], meta["binsize"],
+                        dtype=arrays["grid"].dtype)
+        g.grid = arrays["grid"]
+        return g
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Extracts the state of a set of axes at every frame (SYN_REPORT) of a
+# recording in one pass, as numpy arrays per slot.
+
+import numpy
+
+from . import profiling
+
+def _tv2us(sec, usec):
+    return sec * 1e6 + usec
+
+def _is_mt(axis):
+    return axis.startswith("ABS_MT_")
+
+def _fill_forward(nframes, frames, values, initial):
+    """
+    Return an array of nframes elements where element i is the last of
+    values with a frame <= i, or initial if there is none. frames must be
+    sorted.
+    """
+    filled = numpy.full(nframes, initial, dtype=numpy.float64)
+    if len(frames) == 0:
+        return filled
+    last = numpy.searchsorted(frames, numpy.arange(nframes), side="right") - 1
+    have = last >= 0
+    filled[have] = values[last[have]]
+    return filled
+
+def _runs(active, ids):
+    """
+    Return the list of (start, end) frame ranges where active is True and
+    ids does not change
+    """
+    if len(active) == 0:
+        return []
+    edges = numpy.flatnonzero(numpy.diff(ids) != 0) + 1
+    starts = numpy.concatenate(([0], edges))
+    ends = numpy.concatenate((edges, [len(ids)]))
+    return [ (s, e) for s, e in zip(starts, ends) if active[s] ]
+
+class FrameData(object):
+    """
+    The values of a set of axes at each frame of a recording. A frame is
+    the device state at a SYN_REPORT. Multitouch axes (ABS_MT_*) have one
+    column per slot, all other axes are a single column.
+
+    Values are numpy.nan where the axis has no value yet, where the
+    slot has no touch (multitouch axes) or where no finger is down
+    (other axes, if the device has BTN_TOUCH).
+
+    Members
+    -------
+        time : numpy array of double, shape (frames,)
+            timestamp of each frame in µs, relative to the first event
+        tracking_id : numpy array of int, shape (frames, slots)
+            The tracking ID in each slot, -1 if the slot has no touch. On
+            devices without slots, each BTN_TOUCH down starts a new ID in
+            slot 0.
+        touching : numpy array of bool, shape (frames,)
+            True if at least one finger is down
+        values : { axis : numpy array of double }
+            shape (frames, slots) for multitouch axes, (frames,) otherwise
+        changed : { axis : numpy array of bool }
+            Same shape as values, True where the axis was updated in that
+            frame
+        absinfo : { axis : (minimum, maximum, resolution) }
+            The axis ranges as described by the device, None for an axis
+            the device doesn't have
+    """
+    def __init__(self, time, tracking_id, touching, values, changed, absinfo):
+        self.time = time
+        self.tracking_id = tracking_id
+        self.touching = touching
+        self.values = values
+        self.changed = changed
+        self.absinfo = absinfo
+
+    @property
+    def nframes(self):
+        return len(self.time)
+
+    @property
+    def nslots(self):
+        return self.tracking_id.shape[1]
+
+    def resolution(self, axis):
+        """Return the resolution of the axis in units/mm, 0 if unknown"""
+        info = self.absinfo.get(axis)
+        return info[2] if info is not None else 0
+
+    def sequences(self, axis):
+        """
+        Return the list of (slot, tracking id, frame indices) for each
+        touch sequence, ordered by the first frame. For an axis that is
+        not multitouch, a sequence is a range of frames with a finger down
+        and slot and tracking id are None.
+        """
+        seqs = []
+        if _is_mt(axis):
+            for slot in range(self.nslots):
+                ids = self.tracking_id[:, slot]
+                for s, e in _runs(ids != -1, ids):
+                    seqs.append((slot, int(ids[s]), numpy.arange(s, e)))
+        else:
+            touching = self.touching
+            for s, e in _runs(touching, touching.astype(numpy.int64)):
+                seqs.append((None, None, numpy.arange(s, e)))
+
+        seqs.sort(key=lambda seq: seq[2][0])
+        return seqs
+
+    def series(self, axis, slot = None):
+        """
+        Return the tuple (time, values) of the frames where the axis has a
+        value, for the given slot for multitouch axes
+        """
+        v = self.values[axis]
+        if v.ndim == 2:
+            v = v[:, slot if slot is not None else 0]
+        have = ~numpy.isnan(v)
+        return self.time[have], v[have]
+
+    @classmethod
+    def from_recording(self, evemu_device, axes):
+        """
+        Extract the given axes from the recording in one pass.
+
+        Params
+        ------
+        evemu_device : evemu.EvemuDevice
+                An initialized evemu device, ready to read events from
+        axes : [ str ]
+                The axis names, e.g. [ "ABS_MT_PRESSURE", "ABS_PRESSURE" ]
+
+        Return
+        ------
+        FrameData
+        """
+        with profiling.stage("extract"):
+            frames = self._extract(evemu_device, list(axes))
+        profiling.count("frames", frames.nframes)
+        return frames
+
+    @classmethod
+    def _extract(self, evemu_device, axes):
+        absinfo = {}
+        for a in axes:
+            if evemu_device.has_event("EV_ABS", a):
+                absinfo[a] = (evemu_device.get_abs_minimum(a),
+                              evemu_device.get_abs_maximum(a),
+                              evemu_device.get_abs_resolution(a))
+            else:
+                absinfo[a] = None
+
+        has_slots = evemu_device.has_event("EV_ABS", "ABS_MT_SLOT")
+        nslots = evemu_device.get_abs_maximum("ABS_MT_SLOT") + 1 if has_slots else 1
+        has_ids = evemu_device.has_event("EV_ABS", "ABS_MT_TRACKING_ID")
+        has_touch = evemu_device.has_event("EV_KEY", "BTN_TOUCH")
+
+        # The events of interest as (frame, slot, index, value), index is
+        # the position in axes, -1 for the tracking ID and -2 for
+        # BTN_TOUCH. The frame state is reconstructed afterwards.
+        TRACKING_ID, TOUCH = -1, -2
+        watched = [ (i, a) for i, a in enumerate(axes) if absinfo[a] is not None ]
+        events = []
+        times = []
+        frame = 0
+        slot = 0
+        start = None
+
+        for e in profiling.timed(evemu_device.events(), "parse", "events"):
+            if start is None:
+                start = _tv2us(e.sec, e.usec)
+
+            if e.matches("EV_SYN", "SYN_REPORT"):
+                times.append(_tv2us(e.sec, e.usec) - start)
+                frame += 1
+            elif e.matches("EV_ABS", "ABS_MT_SLOT"):
+                slot = e.value
+            elif e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
+                events.append((frame, slot, TRACKING_ID, e.value))
+            elif e.matches("EV_KEY", "BTN_TOUCH"):
+                events.append((frame, 0, TOUCH, e.value))
+            else:
+                for i, a in watched:
+                    if e.matches("EV_ABS", a):
+                        events.append((frame, slot if _is_mt(a) else 0, i, e.value))
+                        break
+
+        nframes = len(times)
+        events = numpy.array(events, dtype=numpy.int64).reshape(-1, 4)
+        # events after the last SYN_REPORT are incomplete
+        events = events[events[:, 0] < nframes]
+        ev_frame, ev_slot, ev_index, ev_value = events.T
+
+        def column(index, slot, initial):
+            sel = (ev_index == index) & (ev_slot == slot)
+            f = _fill_forward(nframes, ev_frame[sel], ev_value[sel], initial)
+            c = numpy.zeros(nframes, dtype=bool)
+            c[ev_frame[sel]] = True
+            return f, c
+
+        if has_touch:
+            touching = column(TOUCH, 0, 0)[0] != 0
+
+        if has_ids:
+            tracking_id = numpy.column_stack([ column(TRACKING_ID, s, -1)[0]
+                                               for s in range(nslots) ]).astype(numpy.int64)
+            if not has_touch:
+                touching = numpy.any(tracking_id != -1, axis=1)
+        else:
+            if not has_touch:
+                touching = numpy.ones(nframes, dtype=bool)
+            presses = numpy.cumsum(touching & ~numpy.concatenate(([False], touching[:-1])))
+            tracking_id = numpy.where(touching, presses - 1, -1).reshape(-1, 1)
+
+        values = {}
+        changed = {}
+        for i, a in enumerate(axes):
+            if _is_mt(a):
+                cols = [ column(i, s, numpy.nan) for s in range(nslots) ]
+                v = numpy.column_stack([ c[0] for c in cols ]).reshape(nframes, nslots)
+                c = numpy.column_stack([ c[1] for c in cols ]).reshape(nframes, nslots)
+                v[tracking_id == -1] = numpy.nan
+            else:
+                v, c = column(i, 0, numpy.nan)
+                if has_touch:
+                    v[~touching] = numpy.nan
+            values[a] = v
+            changed[a] = c
+
+        return FrameData(numpy.array(times, dtype=numpy.float64), tracking_id,
+                         touching, values, changed, absinfo)
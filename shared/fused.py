@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Runs several EventProcessor analyses over the same recordings with one
+# parse per recording. Each recording is processed by all analyses in
+# turn inside a shared_recordings() block, so load_recording() parses it
+# only for the first one. The per-file results are then handed to each
+# analysis' normal process(), which writes its usual output.
+
+from . import DeviceError, _ProcessOneFile, shared_recordings
+from .parallel import imap_files
+
+class _FusedCall(object):
+    """
+    Picklable per-file function, returns the list of (result, error)
+    with one element per analysis
+    """
+    def __init__(self, processors):
+        self.calls = [ _ProcessOneFile(p, p.args) for p in processors ]
+
+    def __call__(self, f):
+        results = []
+        with shared_recordings():
+            for call in self.calls:
+                try:
+                    results.append((call(f), None))
+                except DeviceError as e:
+                    results.append((None, e))
+        return results
+
+def run_fused(processors, paths, jobs = 1):
+    """
+    Process each of the paths with all processors, parsing each recording
+    once, then run() each processor on the results.
+
+    The processors must use load_recording() in their process_one_file()
+    and must not write to the output in it.
+
+    Params
+    ------
+    processors : [ EventProcessor ]
+        The analyses, already initialized with their arguments
+    paths : [ str ]
+        The recordings
+    jobs : int
+        The number of worker processes for the per-file pass
+    """
+    precomputed = [ [] for _ in processors ]
+    for f, results, error in imap_files(_FusedCall(processors), paths, jobs=jobs):
+        for i, (result, e) in enumerate(results):
+            precomputed[i].append((f, result, e))
+
+    for p, results in zip(processors, precomputed):
+        p.sourcefiles = list(paths)
+        p.precomputed = results
+        p.run()
@@ -8,12 +8,86 @@ import sys
 import os
 
 import datetime
+import numpy
+import queue
+import threading
 
 from . import *
+from . import profiling
+
+class _DataWriter(object):
+    """
+    Internal use only. Formats and writes blocks of data to the data
+    file. A block is a tuple of (kind, value, fmt) where kind is one of
+    "text", "array" or "binary".
+    """
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+
+    def _write_block(self, block):
+        kind, value, fmt = block
+        if kind == "text":
+            self.file_obj.write(value)
+        elif kind == "binary":
+            self.file_obj.write(numpy.ascontiguousarray(value, dtype="<f4").tobytes())
+        else:
+            numpy.savetxt(self.file_obj, value, fmt=fmt)
+
+    def write(self, block):
+        self._write_block(block)
+
+    def close(self):
+        """
+        Return the exception that prevented data from being written, if
+        any
+        """
+        return None
+
+class _BackgroundDataWriter(_DataWriter):
+    """
+    Internal use only. Formats and writes blocks of data from a separate
+    thread so the caller can continue processing. The queue is bounded,
+    a caller that produces data faster than it can be written blocks.
+
+    If writing fails, the exception is raised on the next write() and
+    returned by close(), the remaining blocks are discarded.
+    """
+    _STOP = None
+
+    def __init__(self, file_obj, queue_size):
+        _DataWriter.__init__(self, file_obj)
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, name="gnuplot-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            block = self.queue.get()
+            if block is self._STOP:
+                break
+            # after an error, keep draining so the producer never blocks
+            if self.error is not None:
+                continue
+            try:
+                self._write_block(block)
+            except Exception as e:
+                self.error = e
+
+    def write(self, block):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(block)
+
+    def close(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+        return self.error
 
 class GnuPlot(object):
     @classmethod
-    def from_object(self, obj, suffixes = None):
+    def from_object(self, obj, suffixes = None, **kwargs):
         """
         Creates a new GnuPLot object in a directory named after the object's
         class name, with a timestamp. If suffixes are provided, multiple of
@@ -32,6 +106,8 @@ class GnuPlot(object):
                 Any object, will be used for the directory and file name
             suffixes : [ s1, s2, ... ]
                 A list of string with suffixes to use.
+            kwargs :
+                Passed to each GnuPlot object, e.g. binary=True
         Return
         ------
             If no suffixes were given, a single GnuPlot object with the
@@ -43,13 +119,13 @@ class GnuPlot(object):
         """
         clsname = obj.__class__.__name__
         if suffixes is None:
-            return GnuPlot(clsname)
+            return GnuPlot(clsname, **kwargs)
         else:
             gs = []
             dirname = self._make_date_dir(clsname)
             for s in suffixes:
                 name = "{}-{}".format(clsname, s)
-                gs.append(GnuPlot(name, dirname = dirname))
+                gs.append(GnuPlot(name, dirname = dirname, **kwargs))
             return gs
 
     @classmethod
@@ -60,6 +136,28 @@ class GnuPlot(object):
         return dirname
 
     def __init__(self, path, **kwargs):
+        """
+        Parameters
+        ----------
+            path : str
+                The name of the output files, without extension
+            dirname : str
+                The directory to write to, by default a new directory named
+                after the path and the current time
+            binary : bool
+                If True, arrays passed to data() are written as raw float32
+                values and the plot commands read the file with gnuplot's
+                binary format. Only arrays can be written in binary mode.
+            background : bool
+                If True, data is formatted and written to the data file in
+                a separate thread. Arrays passed to data() must not be
+                modified afterwards.
+            queue_size : int
+                The number of data blocks that may be waiting for the
+                background thread before data() blocks (default 16)
+
+        Any other keyword arguments are passed to open().
+        """
         # We take the time on init, not on enter so for long-running scripts
         # the start time rather than the finish time.
         try:
@@ -68,6 +166,11 @@ class GnuPlot(object):
         except KeyError:
             dirname = self._make_date_dir(path)
 
+        self.binary = kwargs.pop("binary", False)
+        self.columns = None
+        self.background = kwargs.pop("background", False)
+        self.queue_size = kwargs.pop("queue_size", 16)
+
         self.path_cmd = "{}/{}.gnuplot".format(dirname, path)
         self.path_data_filename = "{}.dat".format(path)
         self.path_data = "{}/{}".format(dirname, self.path_data_filename)
@@ -85,17 +188,32 @@ class GnuPlot(object):
         f.write("set autoscale\n")
         self.file_obj_cmd = f
 
-        f = open(self.path_data, "w", **self.kwargs)
-        f.write("# for processing see {}\n".format(self.path_cmd))
+        if self.binary:
+            f = open(self.path_data, "wb", **self.kwargs)
+        else:
+            f = open(self.path_data, "w", **self.kwargs)
+            f.write("# for processing see {}\n".format(self.path_cmd))
         self.file_obj_data = f
+
+        if self.background:
+            self._writer = _BackgroundDataWriter(f, self.queue_size)
+        else:
+            self._writer = _DataWriter(f)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        # Wait for all data to be written. A failure to write the data is
+        # handled like an exception inside the with block.
+        with profiling.stage("output"):
+            writer_error = self._writer.close()
+        if exc_value is None:
+            exc_value = writer_error
+
         if exc_value is None:
             if len(self.plots) >= 1:
-                self.file_obj_cmd.write("plot file {}\\\n".format(", \\\n     ".join(self.plots)))
+                self.file_obj_cmd.write("plot {} {}\\\n".format(self._file_spec(), ", \\\n     ".join(self.plots)))
             elif len(self.splots) >= 1:
-                self.file_obj_cmd.write("splot file {}\n".format(", \\\n    ".join(self.splots)))
+                self.file_obj_cmd.write("splot {} {}\n".format(self._file_spec(), ", \\\n    ".join(self.splots)))
             self.file_obj_cmd.write("\npause -1\n")
 
         self.file_obj_cmd.close()
@@ -110,6 +228,9 @@ class GnuPlot(object):
                 # Directory may not be empty if there's other files
                 pass
 
+        if writer_error is not None and exc_type is None:
+            raise writer_error
+
     def labels(self, xlabel, ylabel, zlabel = None):
         if xlabel is not None:
             self.file_obj_cmd.write("set xlabel '{}'\n".format(xlabel))
@@ -124,11 +245,52 @@ class GnuPlot(object):
         if yrange is not None:
             self.file_obj_cmd.write("set yrange [{}]\n".format(yrange))
 
-    def data(self, string):
-        self.file_obj_data.write("{}\n".format(string))
+    def _file_spec(self):
+        if self.binary and self.columns is not None:
+            return "file binary format='{}'".format("%float" * self.columns)
+        return "file"
+
+    def data(self, data, fmt = "%.9g"):
+        """
+        Write data to the data file. data is either a string, written as
+        one line, or a numpy array written in one go. A 1D array is
+        written as a single column, a 2D array as one row per line.
+
+        In binary mode, only arrays can be written and all arrays must
+        have the same number of columns. fmt is the per-value format used
+        for arrays in text mode.
+        """
+        with profiling.stage("output"):
+            self._data(data, fmt)
+
+    def _data(self, data, fmt):
+        if isinstance(data, str):
+            if self.binary:
+                raise ValueError("Cannot write text data in binary mode")
+            self._writer.write(("text", "{}\n".format(data), None))
+            return
+
+        data = numpy.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
+        elif data.ndim != 2:
+            raise ValueError("Only 1D or 2D arrays can be written")
+
+        if self.binary:
+            if self.columns is not None and self.columns != data.shape[1]:
+                raise ValueError("Expected {} columns, got {}".format(self.columns, data.shape[1]))
+            self.columns = data.shape[1]
+            self._writer.write(("binary", data, None))
+        else:
+            self._writer.write(("array", data, fmt))
 
     def comment(self, string):
-        self.file_obj_data.write("# {}\n".format(string))
+        # binary data files can't have comments, put them in the command
+        # file instead
+        if self.binary:
+            self.file_obj_cmd.write("# {}\n".format(string))
+        else:
+            self._writer.write(("text", "# {}\n".format(string), None))
 
     def plot(self, command):
         self.plots.append(command)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Runs a per-file function over a list of recordings, optionally in a pool
+# of worker processes.
+#
+# Large numpy arrays in the results of worker processes are not pickled
+# through the pool's pipe. The worker copies them into shared memory
+# blocks and only sends a descriptor, the parent maps the block and uses
+# the memory directly as the array's buffer.
+
+import collections
+import copy
+import multiprocessing
+
+import numpy
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# arrays of this size in bytes or larger are sent through shared memory
+SHARED_MEMORY_MIN_BYTES = 64 * 1024
+
+def _shared_array_type():
+    """
+    Return the SharedArray class, created on first use so importing this
+    module doesn't load numpy
+    """
+    global SharedArray
+    try:
+        return SharedArray
+    except NameError:
+        pass
+
+    class SharedArray(numpy.ndarray):
+        """
+        A numpy array in a shared memory block received from a worker
+        process. The block is released together with the array. It is
+        pickled as plain numpy.ndarray with a copy of the data.
+        """
+        def __reduce_ex__(self, protocol):
+            return self.view(numpy.ndarray).__reduce_ex__(protocol)
+
+    SharedArray.__qualname__ = "SharedArray"
+    return SharedArray
+
+def __getattr__(name):
+    if name == "SharedArray":
+        return _shared_array_type()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+class _SharedArrayRef(object):
+    """The picklable descriptor of an array in a shared memory block"""
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    @classmethod
+    def from_array(cls, a):
+        shm = shared_memory.SharedMemory(create=True, size=a.nbytes)
+        numpy.copyto(numpy.ndarray(a.shape, a.dtype, buffer=shm.buf), a)
+        ref = cls(shm.name, a.shape, a.dtype.str)
+        shm.close()
+        return ref
+
+    def attach(self):
+        shm = shared_memory.SharedMemory(self.name)
+        # the name is no longer needed, the memory stays until the
+        # mapping is closed
+        shm.unlink()
+        a = numpy.ndarray(self.shape, numpy.dtype(self.dtype), buffer=shm.buf).view(_shared_array_type())
+        a._shm = shm
+        return a
+
+    def release(self):
+        """Free the block without attaching it"""
+        try:
+            shm = shared_memory.SharedMemory(self.name)
+        except (IOError, OSError):
+            return
+        shm.close()
+        shm.unlink()
+
+def _export(obj, min_bytes, depth = 0):
+    """
+    Return obj with the numpy arrays of min_bytes or more replaced by
+    _SharedArrayRefs. Tuples, lists, dicts and object attributes are
+    searched, the containers are copied if they contain such an array.
+    """
+    if isinstance(obj, numpy.ndarray):
+        if obj.nbytes >= min_bytes and not obj.dtype.hasobject:
+            return _SharedArrayRef.from_array(obj)
+        return obj
+    if depth > 4:
+        return obj
+
+    if isinstance(obj, (list, tuple)):
+        items = [ _export(o, min_bytes, depth + 1) for o in obj ]
+        if all(a is b for a, b in zip(items, obj)):
+            return obj
+        return type(obj)(items) if type(obj) in (list, tuple) else type(obj)(*items)
+    if isinstance(obj, dict):
+        items = [ (k, _export(v, min_bytes, depth + 1)) for k, v in obj.items() ]
+        if all(v is obj[k] for k, v in items):
+            return obj
+        new = copy.copy(obj)
+        new.update(items)
+        return new
+    if hasattr(obj, "__dict__") and not isinstance(obj, type):
+        attrs = _export(obj.__dict__, min_bytes, depth + 1)
+        if attrs is obj.__dict__:
+            return obj
+        new = copy.copy(obj)
+        new.__dict__.update(attrs)
+        return new
+    return obj
+
+def _attach(obj, depth = 0):
+    """Reverse of _export() in the parent process, in place"""
+    if isinstance(obj, _SharedArrayRef):
+        return obj.attach()
+    if depth > 4:
+        return obj
+
+    if isinstance(obj, list):
+        obj[:] = [ _attach(o, depth + 1) for o in obj ]
+    elif isinstance(obj, tuple):
+        items = [ _attach(o, depth + 1) for o in obj ]
+        if any(a is not b for a, b in zip(items, obj)):
+            obj = type(obj)(items) if type(obj) is tuple else type(obj)(*items)
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            obj[k] = _attach(v, depth + 1)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        _attach(obj.__dict__, depth + 1)
+    return obj
+
+def _detach(obj, depth = 0):
+    """
+    Replace the SharedArrays from _attach() in obj with plain arrays, in
+    place like _attach(), and return obj
+    """
+    cls = globals().get("SharedArray")
+    if cls is None:
+        # nothing was attached in this process
+        return obj
+    if isinstance(obj, cls):
+        return numpy.array(obj)
+    if depth > 4:
+        return obj
+
+    if isinstance(obj, list):
+        obj[:] = [ _detach(o, depth + 1) for o in obj ]
+    elif isinstance(obj, tuple):
+        items = [ _detach(o, depth + 1) for o in obj ]
+        if any(a is not b for a, b in zip(items, obj)):
+            obj = type(obj)(items) if type(obj) is tuple else type(obj)(*items)
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            obj[k] = _detach(v, depth + 1)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        _detach(obj.__dict__, depth + 1)
+    return obj
+
+def _release(obj, depth = 0):
+    """Free the blocks of the _SharedArrayRefs in obj, see _export()"""
+    if isinstance(obj, _SharedArrayRef):
+        obj.release()
+    elif depth > 4:
+        return
+    elif isinstance(obj, (list, tuple)):
+        for o in obj:
+            _release(o, depth + 1)
+    elif isinstance(obj, dict):
+        for o in obj.values():
+            _release(o, depth + 1)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        _release(obj.__dict__, depth + 1)
+
+class _FileCall(object):
+    """
+    Picklable wrapper around the per-file function. Exceptions listed in
+    catch are returned instead of raised so one broken recording doesn't
+    take down the whole pool. With export, large arrays in the result are
+    moved to shared memory, see _export().
+    """
+    def __init__(self, func, catch, export = False):
+        self.func = func
+        self.catch = catch
+        self.export = export and shared_memory is not None
+
+    def __call__(self, path):
+        try:
+            result = self.func(path)
+        except self.catch as e:
+            return path, None, e
+        if self.export:
+            result = _export(result, SHARED_MEMORY_MIN_BYTES)
+        return path, result, None
+
+def start_resource_tracker():
+    """
+    Start the resource tracker of shared memory blocks before the worker
+    processes, so they share it with the parent. Otherwise each worker
+    starts its own that reports the blocks the parent took over as leaked.
+    """
+    if shared_memory is None:
+        return
+    try:
+        from multiprocessing import resource_tracker
+    except ImportError:
+        return
+    resource_tracker.ensure_running()
+
+def attach_result(r):
+    """
+    Return the (path, result, error) tuple of a _FileCall with export
+    with its arrays attached in this process
+    """
+    path, result, error = r
+    return path, _attach(result), error
+
+def release_result(r):
+    """
+    Free the shared memory of the (path, result, error) tuple of a
+    _FileCall with export that is not passed on
+    """
+    _release(r[1])
+
+def imap_files(func, paths, jobs = 1, catch = ()):
+    """
+    Call func(path) for each path and yield the tuple (path, result, error)
+    in the order of the paths. error is the exception instance if func
+    raised one of the exceptions in catch, result is None in that case.
+
+    With jobs > 1, the calls are distributed across a pool of jobs worker
+    processes. func and its results must be picklable, and func should
+    not write any output the parent process relies on.
+
+    Arrays of SHARED_MEMORY_MIN_BYTES or more in the results of worker
+    processes are passed through shared memory and yielded as
+    SharedArray.
+
+    Params
+    ------
+    func : callable
+        Called with the path, the return value is yielded as result
+    paths : [ str ]
+        The files to process
+    jobs : int
+        The number of worker processes, 1 to process in this process
+    catch : (Exception, ...)
+        The exception types that are yielded instead of raised
+    """
+    if jobs <= 1 or len(paths) <= 1:
+        call = _FileCall(func, tuple(catch))
+        for p in paths:
+            yield call(p)
+        return
+
+    call = _FileCall(func, tuple(catch), export=True)
+    start_resource_tracker()
+    jobs = min(jobs, len(paths))
+    pool = multiprocessing.Pool(jobs)
+    # a window of calls instead of pool.imap(), so when the caller stops
+    # early only these are left to wait for and their shared memory can
+    # be freed
+    remaining = iter(paths)
+    pending = collections.deque()
+    def submit():
+        for p in remaining:
+            pending.append(pool.apply_async(call, (p,)))
+            if len(pending) >= 2 * jobs:
+                break
+    try:
+        submit()
+        while pending:
+            r = pending.popleft().get()
+            submit()
+            yield attach_result(r)
+        pool.close()
+    finally:
+        for a in pending:
+            try:
+                release_result(a.get())
+            except Exception:
+                pass
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Pipelined ingestion of recordings with asyncio: reader threads prefetch
+# the next files while the per-file function parses the current ones in
+# an executor, and the results are handed to the caller as they are
+# ready. Useful when the recordings are on slow or network-mounted
+# storage, where reading and parsing one file after the other leaves the
+# CPU idle while waiting for the disk.
+#
+#       for path, result, error in pipeline.imap_files(func, paths, jobs=4, depth=8):
+#           ...
+#
+# evemu parses a recording from its path, so a prefetch reads the whole
+# file and drops the data, the parse then reads it from the page cache.
+# At most depth files are in flight between the start of their prefetch
+# and the caller taking their result, this bounds the memory used.
+
+import asyncio
+import concurrent.futures
+import time
+
+from .parallel import _FileCall, attach_result, release_result, start_resource_tracker
+
+_CHUNK_SIZE = 1024 * 1024
+
+def _prefetch(path):
+    """Read the file and return the number of bytes read"""
+    n = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(_CHUNK_SIZE)
+            if not data:
+                break
+            n += len(data)
+    return n
+
+class PipelineStats(object):
+    """
+    Members
+    -------
+        bytes_read : int
+            The number of bytes prefetched
+        read_time : float
+            The sum of the time spent prefetching in s
+        parse_time : float
+            The sum of the time from the start of a parse until its result
+            is available in s
+        max_in_flight : int
+            The highest number of files in flight at the same time
+    """
+    def __init__(self):
+        self.bytes_read = 0
+        self.read_time = 0
+        self.parse_time = 0
+        self.max_in_flight = 0
+
+async def ingest(func, paths, depth = 4, readers = 2, jobs = 1, catch = (),
+                 ordered = True, stats = None):
+    """
+    Asynchronous generator calling func(path) for each path with the
+    file prefetched, yields the tuple (path, result, error) like
+    shared.parallel.imap_files().
+
+    Params
+    ------
+    func : callable
+        Called with the path, in a worker process if jobs > 1. func and
+        its result must then be picklable.
+    paths : [ str ]
+        The files to process
+    depth : int
+        The maximum number of files in flight, i.e. prefetched or parsed
+        but not yet taken by the caller
+    readers : int
+        The number of files prefetched concurrently
+    jobs : int
+        The number of concurrent calls to func. With jobs > 1 the calls
+        run in a pool of worker processes, with large arrays passed
+        through shared memory like shared.parallel.imap_files().
+        Otherwise they run in a thread.
+    catch : (Exception, ...)
+        The exception types that are yielded instead of raised
+    ordered : bool
+        If True, the results are yielded in the order of the paths,
+        otherwise in the order they complete
+    stats : PipelineStats
+        Updated while the pipeline runs, if not None
+    """
+    if depth < 1 or readers < 1 or jobs < 1:
+        raise ValueError("depth, readers and jobs must be at least 1")
+    if stats is None:
+        stats = PipelineStats()
+
+    loop = asyncio.get_event_loop()
+    call = _FileCall(func, tuple(catch), export=jobs > 1)
+    read_pool = concurrent.futures.ThreadPoolExecutor(readers)
+    if jobs > 1:
+        start_resource_tracker()
+        parse_pool = concurrent.futures.ProcessPoolExecutor(jobs)
+    else:
+        parse_pool = concurrent.futures.ThreadPoolExecutor(1)
+
+    # taken before the prefetch, released when the caller has the result
+    in_flight = asyncio.Semaphore(depth)
+    todo = asyncio.Queue()
+    prefetched = asyncio.Queue()
+    done = asyncio.Queue()
+    for item in enumerate(paths):
+        todo.put_nowait(item)
+    count = [ 0 ]
+
+    async def reader():
+        while True:
+            # the slot first so the files are taken in order, the
+            # caller may be waiting for the next one in order
+            await in_flight.acquire()
+            if todo.empty():
+                in_flight.release()
+                return
+            index, path = todo.get_nowait()
+            count[0] += 1
+            stats.max_in_flight = max(stats.max_in_flight, count[0])
+            start = time.time()
+            try:
+                # into a local first, the other readers update the stats
+                # while this one waits
+                nbytes = await loop.run_in_executor(read_pool, _prefetch, path)
+                stats.bytes_read += nbytes
+            except (IOError, OSError):
+                pass # func gets to deal with the file
+            stats.read_time += time.time() - start
+            await prefetched.put((index, path))
+
+    # the calls whose result isn't in done yet
+    running = set()
+
+    async def parser():
+        while True:
+            index, path = await prefetched.get()
+            start = time.time()
+            future = parse_pool.submit(call, path)
+            running.add(future)
+            try:
+                result = await asyncio.wrap_future(future)
+            except Exception as e:
+                # not in catch, raised to the caller
+                result = e
+            stats.parse_time += time.time() - start
+            done.put_nowait((index, result))
+            running.discard(future)
+
+    tasks = [ loop.create_task(reader()) for _ in range(min(readers, len(paths))) ]
+    tasks += [ loop.create_task(parser()) for _ in range(min(jobs, len(paths))) ]
+
+    pending = {}
+    try:
+        next_index = 0
+        while next_index < len(paths):
+            if ordered:
+                while next_index not in pending:
+                    index, result = await done.get()
+                    pending[index] = result
+                result = pending.pop(next_index)
+            else:
+                index, result = await done.get()
+            next_index += 1
+
+            if isinstance(result, BaseException):
+                raise result
+            count[0] -= 1
+            in_flight.release()
+            yield attach_result(result) if jobs > 1 else result
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        read_pool.shutdown(wait=False)
+        if jobs > 1:
+            # free the shared memory of the results the caller never got,
+            # including those of the calls still running
+            leftover = list(pending.values())
+            while not done.empty():
+                leftover.append(done.get_nowait()[1])
+            concurrent.futures.wait(running)
+            for f in running:
+                if not f.cancelled() and f.exception() is None:
+                    leftover.append(f.result())
+            for r in leftover:
+                if not isinstance(r, BaseException):
+                    release_result(r)
+        parse_pool.shutdown(wait=True)
+
+def imap_files(func, paths, jobs = 1, catch = (), depth = 4, readers = 2, stats = None):
+    """
+    Synchronous version of ingest(), yields the tuple (path, result,
+    error) in the order of the paths, see shared.parallel.imap_files()
+    """
+    loop = asyncio.new_event_loop()
+    agen = ingest(func, paths, depth=depth, readers=readers, jobs=jobs, catch=catch,
+                  stats=stats)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
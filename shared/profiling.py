@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Stage timings and counters for EventProcessor --profile. Shared code
+# reports into the active profile, if any:
+#
+#       with profiling.stage("filter"):
+#           singles = [ s for s in seqs if s.is_single ]
+#       profiling.count("sequences", len(seqs))
+#
+# Without an active profile these calls do nothing. The active profile is
+# per thread, a recording processed in a pipeline thread reports into its
+# own profile, not into the one of the main thread.
+
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+_clock = getattr(time, "perf_counter", time.time)
+
+# the order of the columns in the table, other stages and counters follow
+# in alphabetical order
+STAGES = [ "files", "parse", "sequences", "extract", "filter", "analysis", "output" ]
+COUNTERS = [ "events", "frames", "sequences", "points" ]
+
+# the active profile of the thread, as _active.profile
+_active = threading.local()
+
+class FileProfile(object):
+    """
+    The stage timings and counters of processing one recording.
+
+    Members
+    -------
+        path : str
+            The recording, None for the aggregate of several recordings
+            or the processing outside the per-file calls
+        total : double
+            The wall time in s of the whole call
+        stages : { str : double }
+            The time in s spent in each stage, excluding the time of the
+            stages nested in it
+        counters : { str : int }
+        peak_memory : int
+            The peak memory in bytes allocated by Python during the call,
+            with tracemalloc only
+        pstats : dict
+            The cProfile statistics of the call, with cProfile only
+    """
+    def __init__(self, path = None):
+        self.path = path
+        self.total = 0.0
+        self.stages = {}
+        self.counters = {}
+        self.peak_memory = 0
+        self.pstats = None
+        self._stack = []
+
+    def add_time(self, name, seconds):
+        """
+        Add seconds to a stage, as if it was nested in the current stage
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if self._stack:
+            self._stack[-1] += seconds
+
+    def stage(self, name):
+        """
+        Return a context manager that adds the time spent in it to the
+        stage name
+        """
+        return _Stage(self, name)
+
+    def timed(self, iterable, name, counter = None):
+        """
+        Iterate over iterable and add the time spent fetching each item to
+        the stage name. If counter is given, the number of items is added
+        to that counter.
+        """
+        it = iter(iterable)
+        elapsed = 0.0
+        count = 0
+        try:
+            while True:
+                start = _clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += _clock() - start
+                count += 1
+                yield item
+        finally:
+            self.add_time(name, elapsed)
+            if counter is not None:
+                self.count(counter, count)
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def other(self):
+        """Return the time in s not covered by any stage"""
+        return self.total - sum(self.stages.values())
+
+    def merge(self, other):
+        self.total += other.total
+        for k, v in other.stages.items():
+            self.stages[k] = self.stages.get(k, 0.0) + v
+        for k, v in other.counters.items():
+            self.counters[k] = self.counters.get(k, 0) + v
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+        return self
+
+    def to_dict(self):
+        return { "path": self.path, "total": self.total, "stages": dict(self.stages),
+                 "other": self.other(), "counters": dict(self.counters),
+                 "peak_memory": self.peak_memory }
+
+class _Stage(object):
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile._stack.append(0.0)
+        self.start = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = _clock() - self.start
+        nested = self.profile._stack.pop()
+        self.profile.add_time(self.name, elapsed - nested)
+        if self.profile._stack:
+            self.profile._stack[-1] += nested
+        return False
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+def current():
+    """Return the active FileProfile of this thread or None"""
+    return getattr(_active, "profile", None)
+
+def activate(profile):
+    """
+    Make profile the active profile of this thread, return the previously
+    active one. profile may be None.
+    """
+    previous = current()
+    _active.profile = profile
+    return previous
+
+def stage(name):
+    """See FileProfile.stage(), does nothing without active profile"""
+    profile = current()
+    if profile is None:
+        return _NoStage()
+    return profile.stage(name)
+
+def timed(iterable, name, counter = None):
+    """See FileProfile.timed(), returns iterable without active profile"""
+    profile = current()
+    if profile is None:
+        return iterable
+    return profile.timed(iterable, name, counter)
+
+def count(name, n = 1):
+    """See FileProfile.count(), does nothing without active profile"""
+    profile = current()
+    if profile is not None:
+        profile.count(name, n)
+
+def profile_call(path, func, args = (), cprofile = False, memory = False):
+    """
+    Call func(*args) with a new FileProfile active in this thread and
+    return the tuple (result, profile). A profile active before is
+    restored afterwards, the call's time is not added to it.
+
+    Params
+    ------
+    path : str
+        The recording processed by the call
+    cprofile : bool
+        Run the call under cProfile
+    memory : bool
+        Track the peak memory with tracemalloc
+    """
+    profile = FileProfile(path)
+    previous = activate(profile)
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    profiler = None
+    if cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    start = _clock()
+    try:
+        if profiler is not None:
+            result = profiler.runcall(func, *args)
+        else:
+            result = func(*args)
+    finally:
+        profile.total = _clock() - start
+        if profiler is not None:
+            profiler.create_stats()
+            profile.pstats = profiler.stats
+        if memory:
+            profile.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        activate(previous)
+    return result, profile
+
+def total(profiles):
+    """Return a FileProfile with the sum of all profiles"""
+    t = FileProfile()
+    for p in profiles:
+        t.merge(p)
+    return t
+
+class _PStats(object):
+    """cProfile statistics in the form pstats.Stats loads them from"""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def merged_pstats(profiles, stream = sys.stderr):
+    """
+    Return a pstats.Stats with the combined cProfile statistics of all
+    profiles, or None if none has any
+    """
+    import pstats
+
+    stats = None
+    for p in profiles:
+        if p.pstats is None:
+            continue
+        if stats is None:
+            stats = pstats.Stats(_PStats(dict(p.pstats)), stream=stream)
+        else:
+            stats.add(_PStats(dict(p.pstats)))
+    return stats
+
+def _columns(names, order):
+    known = [ n for n in order if n in names ]
+    return known + sorted(n for n in names if n not in order)
+
+def print_table(profiles, run = None, file = sys.stderr):
+    """
+    Print a table with one row per profile, the sum of all profiles and
+    the run profile if given, to file
+    """
+    everything = list(profiles) + ([ run ] if run is not None else [])
+    stages = _columns(set(k for p in everything for k in p.stages), STAGES)
+    counters = _columns(set(k for p in everything for k in p.counters), COUNTERS)
+    memory = any(p.peak_memory for p in everything)
+
+    header = "{:24s} {:>9s}".format("profile (s)", "total")
+    header += "".join(" {:>9s}".format(s[:9]) for s in stages + [ "other" ])
+    header += "".join(" {:>10s}".format(c[:10]) for c in counters)
+    if memory:
+        header += " {:>9s}".format("peak MB")
+    print(header, file=file)
+
+    def row(name, p):
+        line = "{:24s} {:9.3f}".format(name[-24:], p.total)
+        line += "".join(" {:9.3f}".format(p.stages.get(s, 0.0)) for s in stages)
+        line += " {:9.3f}".format(p.other())
+        line += "".join(" {:10d}".format(p.counters.get(c, 0)) for c in counters)
+        if memory:
+            line += " {:9.1f}".format(p.peak_memory / 1048576.0)
+        print(line, file=file)
+
+    for p in profiles:
+        row(os.path.basename(p.path or ""), p)
+    if len(profiles) > 1:
+        row("all files", total(profiles))
+    if run is not None:
+        row("run", run)
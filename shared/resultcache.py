@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# A disk cache of the per-file results of EventProcessor tools, so a run
+# over a growing corpus only processes the new or changed recordings:
+#
+#       $ ./touchpad-tap-speed.py --cache ~/.cache/input-analysis recordings/*.evemu
+#
+# An entry is keyed by the hash of the recording's content, the tool's
+# version and the tool's arguments that affect process_one_file(). The
+# version is the hash of the tool's script and of the shared package, so
+# any change to the code invalidates the entries. The cached results are
+# merged with the new ones by the tool as usual, the output is the same
+# as without cache. A cache hit skips process_one_file(), tools whose
+# process_one_file() writes output with some arguments return False from
+# EventProcessor.cacheable() for them.
+#
+# Entries are never removed, delete the directory to clear the cache.
+
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+
+_CHUNK_SIZE = 1024 * 1024
+
+# EventProcessor arguments that don't change the result of a file
+RUNTIME_ARGS = ( "path", "jobs", "prefetch", "profile", "profile_cprofile",
+                 "profile_memory", "profile_output", "cache" )
+
+def _hash_file(path, h = None):
+    if h is None:
+        h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(_CHUNK_SIZE)
+            if not data:
+                break
+            h.update(data)
+    return h
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def tool_version(processor):
+    """
+    Return a hash of the source code of the processor's script and of the
+    shared package, and of the processor's cache_version member
+    """
+    h = hashlib.sha256()
+    h.update(str(getattr(processor, "cache_version", 0)).encode("utf-8"))
+    h.update(type(processor).__name__.encode("utf-8"))
+
+    module = sys.modules.get(type(processor).__module__)
+    files = [ getattr(module, "__file__", None) ]
+    shared_dir = os.path.dirname(os.path.abspath(__file__))
+    files += [ os.path.join(shared_dir, f) for f in sorted(os.listdir(shared_dir))
+               if f.endswith(".py") ]
+    for f in files:
+        if f is not None and os.path.exists(f):
+            _hash_file(f, h)
+    return h.hexdigest()
+
+def arguments_key(processor, args):
+    """
+    Return the arguments that affect process_one_file() as string. These
+    are the processor's cache_args if set, otherwise all arguments except
+    RUNTIME_ARGS.
+    """
+    names = getattr(processor, "cache_args", None)
+    if names is None:
+        names = [ n for n in vars(args).keys() if n not in RUNTIME_ARGS ]
+    values = dict((n, getattr(args, n)) for n in names)
+    return json.dumps(values, sort_keys=True, default=repr)
+
+class ResultCache(object):
+    """
+    The cache of one tool with one set of arguments.
+
+    Members
+    -------
+        directory : str
+            The cache directory, shared by all tools
+        hits, misses : int
+            The number of results found and not found in the cache
+    """
+    def __init__(self, directory, tool, version, arguments):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = os.path.join(directory, tool)
+        self._key = hashlib.sha256((version + arguments).encode("utf-8")).hexdigest()[:24]
+        self._index_path = os.path.join(directory, "index.json")
+        self._index = None
+        self._index_changed = False
+        if not os.path.isdir(self._entries):
+            os.makedirs(self._entries)
+
+    @classmethod
+    def for_processor(cls, directory, processor, args):
+        return cls(directory, type(processor).__name__,
+                   tool_version(processor), arguments_key(processor, args))
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self._index_path) as f:
+                    self._index = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def save_index(self):
+        """Save the content hashes of the recordings, see file_hash()"""
+        if self._index_changed:
+            _write_atomic(self._index_path, json.dumps(self._index).encode("utf-8"))
+            self._index_changed = False
+
+    def file_hash(self, path):
+        """
+        Return the hash of the file's content. The hashes are kept in the
+        cache directory by path, modification time and size, so the file
+        is only read again when it changed.
+        """
+        st = os.stat(path)
+        stamp = [ st.st_mtime_ns, st.st_size ]
+        realpath = os.path.realpath(path)
+        index = self._load_index()
+        entry = index.get(realpath)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+
+        digest = _hash_file(path).hexdigest()
+        index[realpath] = stamp + [ digest ]
+        self._index_changed = True
+        return digest
+
+    def _entry_path(self, path):
+        return os.path.join(self._entries, "{}-{}.pickle".format(self.file_hash(path), self._key))
+
+    def get(self, path):
+        """
+        Return the tuple (result, error) of the recording or None if it
+        is not in the cache
+        """
+        try:
+            with open(self._entry_path(path), "rb") as f:
+                entry = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, path, result, error):
+        data = pickle.dumps((result, error), pickle.HIGHEST_PROTOCOL)
+        _write_atomic(self._entry_path(path), data)
+
+    def imap(self, run, paths, profile = False):
+        """
+        Yield the tuple (path, result, error) for each path like
+        shared.parallel.imap_files(), with the results in the cache taken
+        from there and the others computed by run() and added to the
+        cache.
+
+        Params
+        ------
+        run : callable
+            Called with the list of paths not in the cache, returns an
+            iterator of (path, result, error) in the order of the paths
+        profile : bool
+            The results are (result, FileProfile) tuples, only the result
+            is cached and an empty FileProfile is yielded for the results
+            from the cache
+        """
+        from .parallel import _detach
+        from .profiling import FileProfile
+
+        cached = {}
+        for p in paths:
+            entry = self.get(p)
+            if entry is not None:
+                cached[p] = entry
+        computed = run([ p for p in paths if p not in cached ])
+
+        for p in paths:
+            if p in cached:
+                result, error = cached[p]
+                if profile and error is None:
+                    result = (result, FileProfile(p))
+            else:
+                p, result, error = next(computed)
+                # arrays from --jobs workers are views of shared memory
+                # mappings of this process, store them as plain arrays
+                result = _detach(result)
+                self.put(p, result[0] if profile and error is None else result, error)
+            yield p, result, error
+
+        self.save_index()
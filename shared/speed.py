@@ -1,107 +1,119 @@
 #!/usr/bin/env python
 # -*- coding: utf-8
+#
+# Vectorised velocity calculation over touch sequences. The calculators
+# work on the concatenated points of all sequences (see PointArrays) and
+# apply their kernel as a convolution over the whole array at once.
 
-import abc
-import argparse
-import evemu
-import sys
+import numpy
 
-sys.path.append("..")
-from shared import *
+from .arrays import PointArrays
 
-class Velocity:
+class VelocityCalculator(object):
     """
-    A class representing one velocity value at a given time.
+    Base class for velocity calculators. A calculator applies an N-point
+    kernel to the x, y and time arrays, the velocity of a point is
+    calculated from that point and the N - 1 points before it in the same
+    sequence.
 
     Members
     -------
-
-    vel : int
-        velocity in mm/s
-
-    time : int
-        timestamp in µs
-        The timestamp is that of the last point considered, i.e. if 4 points
-        are considered for the calculation of the velocity, the timestamp is
-        that of the fourth point
+        npoints : int
+            The number of points needed for one velocity value
     """
+    npoints = None
 
-    def __init__(self, vel, time):
-        self.vel = vel
-        self.time = time
-
-class VelocityCalculator:
-    __metaclass__ = abc.ABCMeta
-
-    @abc.abstractmethod
-    def __init__():
-        pass
+    def _kernels(self):
+        """
+        Return the tuple (position kernel, time kernel). The position
+        delta at index i is sum(k[j] * x[i - j]), likewise for time.
+        """
+        raise NotImplementedError
 
-    def calculate(sequence):
+    def _deltas(self, points):
+        """
+        Return the tuple (dx, dy, dt) as arrays aligned with the points
+        """
+        kpos, ktime = self._kernels()
+        n = len(points)
+        dx = numpy.convolve(points.x, kpos)[:n]
+        dy = numpy.convolve(points.y, kpos)[:n]
+        dt = numpy.convolve(points.time, ktime)[:n]
+        return dx, dy, dt
+
+    def calculate(self, points):
         """
         Params:
         ------
-        points : TouchSequence
+        points : PointArrays or [ TouchSequence ]
 
         Return:
         -------
-        A list of Velocity objects
+        A numpy array of velocities in mm/s, aligned with the points. The
+        first npoints - 1 points of each sequence (and any point without a
+        time delta) have no velocity and are numpy.nan. The timestamp of a
+        velocity is that of the point it is aligned with, i.e. the last
+        point considered.
         """
-        return
+        if not isinstance(points, PointArrays):
+            points = PointArrays.from_sequences(points)
+
+        if len(points) == 0:
+            return numpy.zeros(0)
+
+        dx, dy, dt = self._deltas(points)
+        # kernels must not reach across the start of a sequence
+        valid = (points.position_in_sequence() >= self.npoints - 1) & (dt > 0)
+
+        vels = numpy.full(len(points), numpy.nan)
+        vels[valid] = 1e6 * numpy.hypot(dx[valid], dy[valid]) / dt[valid]
+        return vels
 
 class VelocityCalculator2point(VelocityCalculator):
     """
     Calculates velocity values between each two points of a TouchSequence
     """
-    def __init__():
-        pass
-
-    def calculate(sequence):
-        vels = []
-        for idx in range(1, len(sequence.points)):
-            dx = (points[idx].x - points[idx-1].x)
-            dy = (points[idx].y - points[idx-1].y)
-            dt = points[idx].time - points[idx-1].time
-            vel = math.hypot(dx, dy)/dt
-            vels.append(Velocity(vel, points[idx].time))
-        return vels
+    npoints = 2
 
-class VelocityCalculator4point(VelocityCalculator):
-    def __init__():
-        pass
-
-    def calculate(points):
-        vels = []
-        for idx in range(3, len(sequence.points)):
-            dx = (points[idx].x + points[idx-1].x - points[idx-2].x - points[idx-3].x)/4.0
-            dy = (points[idx].y + points[idx-1].y - points[idx-2].y - points[idx-3].y)/4.0
-            dt = points[idx].time - points[idx-3].time
-            vel = math.hypot(dx, dy)/dt
-            vels.append(Velocity(vel, points[idx].time))
-        return vels
+    def _kernels(self):
+        k = numpy.array([1.0, -1.0])
+        return k, k
 
-class EventProcessor:
+class VelocityCalculator4point(VelocityCalculator):
     """
-    Members
-    -------
-        sourcefiles : [ str ]
-            All source files given on the command line
+    Calculates velocity values from four points, the motion between the
+    midpoint of the last two points and the midpoint of the two points
+    before.
     """
-    def __init__(self):
-        parser = argparse.ArgumentParser(description="")
-        parser.add_argument("path", metavar="recording", nargs="*", help="Path to evemu recording")
-        self.add_args(parser)
-        self.args = parser.parse_args()
-
-        self.sourcefiles = self.args.path
-
-    def add_args(self, arg_parser):
-        pass
+    npoints = 4
 
-    def process(self, parsed_cmdline_args):
-        pass
+    def _kernels(self):
+        k = numpy.array([0.5, 0.5, -0.5, -0.5])
+        return k, k
 
-    def run(self):
-        self.gnuplot = GnuPlot(self.__class__.__name__)
-        with self.gnuplot as f:
-            self.process(self.args)
+class VelocityCalculatorLeastSquares(VelocityCalculator):
+    """
+    Calculates velocity values as the slope of a least-squares line fit
+    of x and y over time across a window of npoints points.
+    """
+    def __init__(self, npoints = 5):
+        if npoints < 2:
+            raise ValueError("At least two points are required")
+        self.npoints = npoints
+
+    def _deltas(self, points):
+        n = len(points)
+        ones = numpy.ones(self.npoints)
+
+        def window_sum(a):
+            return numpy.convolve(a, ones)[:n]
+
+        # slope = (N * sum(tx) - sum(t) * sum(x)) / (N * sum(tt) - sum(t)^2)
+        # The numerator is returned as the position delta, the
+        # denominator as the time delta.
+        t = points.time
+        st = window_sum(t)
+        dt = self.npoints * window_sum(t * t) - st * st
+        dx = self.npoints * window_sum(t * points.x) - st * window_sum(points.x)
+        dy = self.npoints * window_sum(t * points.y) - st * window_sum(points.y)
+        return dx, dy, dt
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Finger spread between all pairs of touches, computed with numpy
+# broadcasting over a frames × slots coordinate array (see FrameData).
+# Inactive slots are numpy.nan and drop out of every pair they are in.
+# The pair arrays are slots times larger than the coordinates, so only the
+# frames that can have a pair are passed in, see multi_finger_frames().
+
+import numpy
+
+def multi_finger_frames(x):
+    """
+    Return the indices of the frames with two or more active slots
+
+    Params
+    ------
+    x : numpy array of shape (frames, slots)
+        A coordinate per slot, numpy.nan where the slot is inactive
+    """
+    return numpy.flatnonzero(numpy.count_nonzero(~numpy.isnan(x), axis=1) >= 2)
+
+def pair_deltas(x, y):
+    """
+    Return the tuple (dx, dy) of the absolute coordinate differences
+    between each two slots in each frame, both of shape (frames, slots,
+    slots). The diagonal and any pair with an inactive slot is numpy.nan.
+
+    Params
+    ------
+    x, y : numpy array of shape (frames, slots)
+        The coordinates per slot, numpy.nan where the slot is inactive
+    """
+    dx = numpy.abs(x[:, :, numpy.newaxis] - x[:, numpy.newaxis, :])
+    dy = numpy.abs(y[:, :, numpy.newaxis] - y[:, numpy.newaxis, :])
+    diagonal = numpy.arange(x.shape[1])
+    dx[:, diagonal, diagonal] = numpy.nan
+    dy[:, diagonal, diagonal] = numpy.nan
+    return dx, dy
+
+def frame_spread(dx, dy, resolution = None):
+    """
+    Return the per-frame spread for all frames with two or more fingers
+    down, as dict of name : numpy array with one element per such frame:
+
+        "min", "max" : the smallest/largest distance between two fingers
+        "horizontal_min", "horizontal_max" : the same for the x component
+        "vertical_min", "vertical_max" : the same for the y component
+        "units_min", "units_max" : "min" and "max" in device units, only
+            if resolution is given
+
+    Params
+    ------
+    dx, dy : numpy array of shape (frames, slots, slots)
+        see pair_deltas()
+    resolution : (float, float)
+        The x and y resolution the coordinates were divided by, if the
+        deltas are in mm
+    """
+    nslots = dx.shape[1]
+    i, j = numpy.triu_indices(nslots, 1)
+    dx = dx[:, i, j]
+    dy = dy[:, i, j]
+    dist = numpy.hypot(dx, dy)
+
+    # at least one pair with both fingers down
+    multi = numpy.any(~numpy.isnan(dist), axis=1)
+    dx, dy, dist = dx[multi], dy[multi], dist[multi]
+
+    spread = {
+        "min": numpy.nanmin(dist, axis=1) if len(dist) else numpy.zeros(0),
+        "max": numpy.nanmax(dist, axis=1) if len(dist) else numpy.zeros(0),
+        "horizontal_min": numpy.nanmin(dx, axis=1) if len(dx) else numpy.zeros(0),
+        "horizontal_max": numpy.nanmax(dx, axis=1) if len(dx) else numpy.zeros(0),
+        "vertical_min": numpy.nanmin(dy, axis=1) if len(dy) else numpy.zeros(0),
+        "vertical_max": numpy.nanmax(dy, axis=1) if len(dy) else numpy.zeros(0),
+    }
+    if resolution is not None:
+        # the coordinates are integer units, rounding undoes the division
+        xres, yres = resolution
+        units = numpy.hypot(numpy.rint(dx * xres), numpy.rint(dy * yres))
+        spread["units_min"] = numpy.nanmin(units, axis=1) if len(units) else numpy.zeros(0)
+        spread["units_max"] = numpy.nanmax(units, axis=1) if len(units) else numpy.zeros(0)
+    return spread
+
+def landing_spread(x, y, tracking_id):
+    """
+    Return the spread when a finger lands while other fingers are down, as
+    tuple (distance, dx, dy) of numpy arrays with one element per landing.
+    The spread is measured to the nearest other finger down.
+
+    Params
+    ------
+    x, y : numpy array of shape (frames, slots)
+        The coordinates per slot, numpy.nan where the slot is inactive
+    tracking_id : numpy array of shape (frames, slots)
+        The tracking ID per slot, -1 where the slot is inactive
+    """
+    previous = numpy.vstack((numpy.full((1, tracking_id.shape[1]), -1),
+                             tracking_id[:-1]))
+    landed = (tracking_id != -1) & (tracking_id != previous)
+
+    # the pairs of the frames with a landing and another slot active only
+    rows = numpy.intersect1d(numpy.flatnonzero(numpy.any(landed, axis=1)),
+                             multi_finger_frames(x))
+    dx, dy = pair_deltas(x[rows], y[rows])
+    frames, slots = numpy.nonzero(landed[rows])
+
+    dx = dx[frames, slots]
+    dy = dy[frames, slots]
+    dist = numpy.hypot(dx, dy)
+
+    # landings with another finger down only
+    multi = numpy.any(~numpy.isnan(dist), axis=1)
+    dx, dy, dist = dx[multi], dy[multi], dist[multi]
+    if len(dist) == 0:
+        return numpy.zeros(0), numpy.zeros(0), numpy.zeros(0)
+
+    nearest = numpy.nanargmin(dist, axis=1)
+    rows = numpy.arange(len(dist))
+    return dist[rows, nearest], dx[rows, nearest], dy[rows, nearest]
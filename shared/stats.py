@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Statistics computed directly from histogram bucket counts, without
+# expanding the histogram into one element per sample.
+
+import numpy
+
+def _histogram(counts, values = None):
+    """
+    Normalize the counts and bucket values into two numpy arrays of equal
+    length, sorted by bucket value.
+    """
+    counts = numpy.asarray(counts)
+    if values is None:
+        values = numpy.arange(len(counts))
+    else:
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if values.shape != counts.shape:
+            raise ValueError("counts and values must have the same shape")
+        order = numpy.argsort(values, kind="stable")
+        values = values[order]
+        counts = counts[order]
+
+    if numpy.any(counts < 0):
+        raise ValueError("counts must not be negative")
+
+    return counts, values
+
+def total(counts):
+    """Return the number of samples in the histogram"""
+    return numpy.asarray(counts).sum()
+
+def mean(counts, values = None):
+    """
+    Return the mean of the samples described by the histogram.
+
+    Params
+    ------
+    counts : [ int ]
+        counts[i] is the number of samples with the value values[i]
+    values : [ double ] or None
+        The value of each bucket. If None, the bucket value is its index.
+
+    Return
+    ------
+    The mean or numpy.nan if the histogram is empty
+    """
+    counts, values = _histogram(counts, values)
+    n = counts.sum()
+    if n == 0:
+        return numpy.nan
+    return numpy.dot(counts, values) / float(n)
+
+def variance(counts, values = None, ddof = 0):
+    """
+    Return the variance of the samples described by the histogram, see
+    mean() for the parameters. ddof is the delta degrees of freedom as in
+    numpy.var.
+
+    Return
+    ------
+    The variance or numpy.nan if the histogram has ddof samples or fewer
+    """
+    counts, values = _histogram(counts, values)
+    n = counts.sum()
+    if n <= ddof:
+        return numpy.nan
+    m = numpy.dot(counts, values) / float(n)
+    return numpy.dot(counts, (values - m) ** 2) / float(n - ddof)
+
+def percentiles(counts, pcs, values = None):
+    """
+    Return the percentiles of the samples described by the histogram. The
+    result is identical to numpy.percentile() with linear interpolation
+    on the flattened samples.
+
+    Params
+    ------
+    counts : [ int ]
+        see mean()
+    pcs : [ double ]
+        A list of percentiles in the range [0, 100]
+    values : [ double ] or None
+        see mean()
+
+    Return
+    ------
+    A numpy array of the same length as pcs, filled with numpy.nan if the
+    histogram is empty
+    """
+    counts, values = _histogram(counts, values)
+    pcs = numpy.asarray(pcs, dtype=numpy.float64)
+    if numpy.any(pcs < 0) or numpy.any(pcs > 100):
+        raise ValueError("percentiles must be in the range [0, 100]")
+
+    n = counts.sum()
+    if n == 0:
+        return numpy.full(pcs.shape, numpy.nan)
+
+    # rank of each percentile in the (virtual) sorted sample list, then
+    # map the ranks below/above back to the bucket they fall into
+    cumulative = numpy.cumsum(counts)
+    rank = pcs / 100.0 * (n - 1)
+    lo = numpy.floor(rank)
+    hi = numpy.ceil(rank)
+    vlo = values[numpy.searchsorted(cumulative, lo, side="right")]
+    vhi = values[numpy.searchsorted(cumulative, hi, side="right")]
+
+    return vlo + (vhi - vlo) * (rank - lo)
+
+def count_in_rectangles(x, y, corners):
+    """
+    Count the points inside each rectangle spanned from the origin to the
+    given corners, i.e. the points where x < cx and y < cy.
+
+    Params
+    ------
+    x, y : [ double ]
+        The point coordinates
+    corners : [ (cx, cy), ... ]
+        The upper right corner of each rectangle
+
+    Return
+    ------
+    A numpy array with the number of points for each rectangle
+    """
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+    corners = numpy.asarray(corners, dtype=numpy.float64).reshape(-1, 2)
+
+    inside = (x[numpy.newaxis, :] < corners[:, 0, numpy.newaxis]) & \
+             (y[numpy.newaxis, :] < corners[:, 1, numpy.newaxis])
+    return inside.sum(axis=1)
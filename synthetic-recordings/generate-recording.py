@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Generates synthetic touchpad recordings in evemu format. The device
+# description is copied from a real recording (the template), the events
+# are a seeded random mix of taps and drags with one or more fingers. The
+# output is written as it is generated, so recordings of any size can be
+# created without holding them in memory.
+#
+# Protocol faults can be injected on purpose to test the analysis tools:
+# slot jumps (a touch ends and continues in another slot), SYN_DROPPED and
+# two BTN_TOOL_* keys down at the same time.
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import numpy
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+
+SYN_REPORT = 0x00
+SYN_DROPPED = 0x03
+
+BTN_TOOL_FINGER = 0x145
+BTN_TOOL_QUINTTAP = 0x148
+BTN_TOUCH = 0x14a
+BTN_TOOL_DOUBLETAP = 0x14d
+BTN_TOOL_TRIPLETAP = 0x14e
+BTN_TOOL_QUADTAP = 0x14f
+
+ABS_X = 0x00
+ABS_Y = 0x01
+ABS_PRESSURE = 0x18
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+ABS_MT_PRESSURE = 0x3a
+
+# BTN_TOOL_* for 1..5 fingers
+TOOLS = [ BTN_TOOL_FINGER, BTN_TOOL_DOUBLETAP, BTN_TOOL_TRIPLETAP,
+          BTN_TOOL_QUADTAP, BTN_TOOL_QUINTTAP ]
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "touchpad-max-delta", "t440s.evemu")
+
+class DeviceTemplate(object):
+    """
+    The device description of a real evemu recording.
+
+    Members
+    -------
+        header : str
+            All lines of the recording before the first event
+        absinfo : { code : (minimum, maximum, resolution) }
+        keys : set of int
+            The EV_KEY codes the device supports
+    """
+    def __init__(self, path):
+        lines = []
+        bits = {}
+        self.absinfo = {}
+        with open(path) as f:
+            for line in f:
+                if line.startswith("E:"):
+                    break
+                lines.append(line)
+                fields = line.split()
+                if line.startswith("A:"):
+                    code = int(fields[1], 16)
+                    res = int(fields[6]) if len(fields) > 6 else 0
+                    self.absinfo[code] = (int(fields[2]), int(fields[3]), res)
+                elif line.startswith("B:"):
+                    bits.setdefault(int(fields[1], 16), []).extend(int(b, 16) for b in fields[2:])
+
+        self.header = "".join(lines)
+        self.keys = set()
+        for i, byte in enumerate(bits.get(EV_KEY, [])):
+            for bit in range(8):
+                if byte & (1 << bit):
+                    self.keys.add(i * 8 + bit)
+
+        if ABS_MT_POSITION_X not in self.absinfo and ABS_X not in self.absinfo:
+            raise ValueError("{} is not a touchpad recording".format(path))
+
+    def has_abs(self, code):
+        return code in self.absinfo
+
+    @property
+    def nslots(self):
+        if ABS_MT_SLOT not in self.absinfo:
+            return 1
+        return self.absinfo[ABS_MT_SLOT][1] + 1
+
+    def units_per_mm(self, code):
+        res = self.absinfo[code][2]
+        return res if res > 0 else 1.0
+
+class EventWriter(object):
+    """
+    Writes events in evemu format, skipping ABS values that didn't change
+    like the kernel does. Lines are buffered and written in blocks.
+    """
+    def __init__(self, output, buffer_lines = 65536):
+        self.output = output
+        self.buffer_lines = buffer_lines
+        self.lines = []
+        self.abs_state = {}
+        self.slot = None
+        self.bytes_written = 0
+        self.events_written = 0
+
+    def event(self, time, type, code, value):
+        self.events_written += 1
+        self.lines.append("E: %d.%06d %04x %04x %d\n" % (time // 1000000, time % 1000000,
+                                                         type, code, value))
+
+    def abs(self, time, code, value, slot = None):
+        if slot is not None and slot != self.slot:
+            self.event(time, EV_ABS, ABS_MT_SLOT, slot)
+            self.slot = slot
+        key = (code, slot)
+        if self.abs_state.get(key) == value:
+            return
+        self.abs_state[key] = value
+        self.event(time, EV_ABS, code, value)
+
+    def key(self, time, code, value):
+        self.event(time, EV_KEY, code, value)
+
+    def syn(self, time, code = SYN_REPORT):
+        self.event(time, EV_SYN, code, 0)
+        if len(self.lines) >= self.buffer_lines:
+            self.flush()
+
+    def block(self, times, columns, dropped = -1):
+        """
+        Write a block of frames at once, the vectorised equivalent of
+        calling abs()/key() for each column in order and syn() for each
+        frame.
+
+        Params
+        ------
+        times : numpy array of int
+            The time of each frame in µs
+        columns : [ (type, code, slot, values) ]
+            The events of each frame in order, values is a numpy array
+            with one value per frame. For EV_ABS, unchanged values are
+            skipped.
+        dropped : int
+            The index of a frame ending in SYN_DROPPED, the frame after
+            it is lost, -1 for none
+        """
+        nframes = len(times)
+        if nframes == 0:
+            return
+        ncols = len(columns)
+        types = numpy.array([ c[0] for c in columns ], dtype=numpy.int64)
+        codes = numpy.array([ c[1] for c in columns ], dtype=numpy.int64)
+        slots = numpy.array([ -1 if c[2] is None else c[2] for c in columns ], dtype=numpy.int64)
+        values = numpy.column_stack([ c[3] for c in columns ]).astype(numpy.int64)
+
+        # ABS events are only written when the value changes
+        emit = numpy.ones((nframes, ncols), dtype=bool)
+        for i, (type, code, slot, v) in enumerate(columns):
+            if type == EV_ABS:
+                previous = self.abs_state.get((code, slot))
+                before = numpy.empty(nframes, dtype=numpy.int64)
+                before[1:] = values[:-1, i]
+                before[0] = previous if previous is not None else values[0, i] - 1
+                emit[:, i] = values[:, i] != before
+                self.abs_state[(code, slot)] = int(values[-1, i])
+        if 0 <= dropped < nframes - 1:
+            emit[dropped + 1] = False
+
+        frame, col = numpy.nonzero(emit)
+        ev_time = times[frame]
+        ev_type = types[col]
+        ev_code = codes[col]
+        ev_value = values[frame, col]
+
+        # an ABS_MT_SLOT event before each slot event in a different slot
+        # than the slot event before it
+        ev_slot = slots[col]
+        is_mt = numpy.flatnonzero(ev_slot >= 0)
+        mt_slots = ev_slot[is_mt]
+        previous = numpy.empty(len(mt_slots), dtype=numpy.int64)
+        previous[1:] = mt_slots[:-1]
+        if len(mt_slots):
+            previous[0] = self.slot if self.slot is not None else -1
+            self.slot = int(mt_slots[-1])
+        switch = is_mt[mt_slots != previous]
+
+        # the SYN_REPORT of each frame, or SYN_DROPPED
+        syn_code = numpy.full(nframes, SYN_REPORT, dtype=numpy.int64)
+        if 0 <= dropped < nframes:
+            syn_code[dropped] = SYN_DROPPED
+
+        # merge by sort key: slot switch before its event, events in
+        # order, the frame's SYN last
+        keys = numpy.concatenate((2 * switch, 2 * numpy.arange(len(frame)) + 1,
+                                  numpy.searchsorted(frame, numpy.arange(nframes), side="right") * 2))
+        order = numpy.argsort(keys, kind="stable")
+        all_time = numpy.concatenate((ev_time[switch], ev_time, times))[order]
+        all_type = numpy.concatenate((numpy.full(len(switch), EV_ABS), ev_type,
+                                      numpy.full(nframes, EV_SYN)))[order]
+        all_code = numpy.concatenate((numpy.full(len(switch), ABS_MT_SLOT), ev_code, syn_code))[order]
+        all_value = numpy.concatenate((ev_slot[switch], ev_value, numpy.zeros(nframes, dtype=numpy.int64)))[order]
+
+        self.events_written += len(all_time)
+        fmt = "E: %d.%06d %04x %04x %d\n"
+        self.lines.extend([ fmt % e for e in zip((all_time // 1000000).tolist(),
+                                                 (all_time % 1000000).tolist(),
+                                                 all_type.tolist(), all_code.tolist(),
+                                                 all_value.tolist()) ])
+        if len(self.lines) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self):
+        data = "".join(self.lines)
+        self.output.write(data)
+        self.bytes_written += len(data)
+        self.lines = []
+
+class RecordingGenerator(object):
+    """
+    Generates a recording as a sequence of gestures separated by idle
+    time. Each gesture is a tap or a drag with one or more fingers that
+    land and lift together. Random numbers come from a seeded
+    numpy.random.RandomState, so the output is deterministic.
+    """
+    def __init__(self, template, args):
+        self.template = template
+        self.args = args
+        self.rng = numpy.random.RandomState(args.seed)
+        self.tracking_id = 0
+
+        fingers = [ f.split(":") for f in args.fingers.split(",") ]
+        self.finger_counts = numpy.array([ int(f[0]) for f in fingers ])
+        weights = numpy.array([ float(f[1]) if len(f) > 1 else 1.0 for f in fingers ])
+        self.finger_weights = weights / weights.sum()
+
+        if template.has_abs(ABS_MT_POSITION_X):
+            self.xcode, self.ycode = ABS_MT_POSITION_X, ABS_MT_POSITION_Y
+        else:
+            self.xcode, self.ycode = ABS_X, ABS_Y
+        self.xres = template.units_per_mm(self.xcode)
+        self.yres = template.units_per_mm(self.ycode)
+        self.xrange = template.absinfo[self.xcode][:2]
+        self.yrange = template.absinfo[self.ycode][:2]
+
+    def frame_times(self, start, duration):
+        """
+        Return the frame timestamps in µs of a gesture starting at start
+        """
+        interval = 1e6 / self.args.rate
+        n = max(int(duration * self.args.rate), 2)
+        jitter = self.rng.normal(0, self.args.jitter * interval, n)
+        offsets = numpy.arange(n) * interval + jitter
+        offsets[0] = 0
+        return start + numpy.maximum.accumulate(offsets).astype(numpy.int64)
+
+    def gesture_path(self, nframes, nfingers, tap):
+        """
+        Return the tuple (x, y) of position arrays in mm of shape (frames,
+        fingers), relative to the origin of the axis range. The start
+        point and the length of the movement are chosen so that all
+        fingers stay on the touchpad for the whole gesture.
+        """
+        width = (self.xrange[1] - self.xrange[0]) / self.xres
+        height = (self.yrange[1] - self.yrange[0]) / self.yres
+        margin = 2 + 4 * self.args.noise
+
+        # fingers side by side, narrower if they don't fit next to each other
+        spacing = self.rng.uniform(15, 25)
+        if nfingers > 1:
+            spacing = min(spacing, (width - 2 * margin) / (nfingers - 1))
+        offset_x = numpy.arange(nfingers) * spacing
+        offset_y = numpy.clip(self.rng.normal(0, 3, nfingers), -6, 6)
+        offset_y -= offset_y.min()
+        # the room left for the movement of the group
+        room_x = max(width - 2 * margin - offset_x[-1], 0)
+        room_y = max(height - 2 * margin - offset_y.max(), 0)
+
+        if tap:
+            speed = self.rng.uniform(0, 5)
+        else:
+            speed = self.rng.uniform(20, 150)
+        direction = self.rng.uniform(0, 2 * numpy.pi)
+        length = speed * (nframes - 1) / float(self.args.rate)
+        dx, dy = numpy.cos(direction), numpy.sin(direction)
+        # shorten the movement to what fits in its direction
+        if abs(dx) > 1e-9:
+            length = min(length, room_x / abs(dx))
+        if abs(dy) > 1e-9:
+            length = min(length, room_y / abs(dy))
+        dx, dy = dx * length, dy * length
+
+        start_x = margin + max(-dx, 0) + self.rng.uniform() * (room_x - abs(dx))
+        start_y = margin + max(-dy, 0) + self.rng.uniform() * (room_y - abs(dy))
+
+        t = numpy.linspace(0, 1, nframes)[:, numpy.newaxis]
+        x = start_x + offset_x + t * dx
+        y = start_y + offset_y + t * dy
+
+        # the noise may still cross the edge
+        x += self.rng.normal(0, self.args.noise, x.shape)
+        y += self.rng.normal(0, self.args.noise, y.shape)
+        return numpy.clip(x, 0, width), numpy.clip(y, 0, height)
+
+    def pressure_curve(self, nframes, code):
+        """
+        Return the pressure per frame: a rise at the start, a plateau
+        with noise and a fall at the end
+        """
+        pmin, pmax = self.template.absinfo[code][:2]
+        peak = self.rng.uniform(0.4, 0.9) * (pmax - pmin)
+        phase = numpy.linspace(0, numpy.pi, nframes)
+        curve = peak * numpy.sqrt(numpy.sin(phase)) + self.rng.normal(0, 0.02 * peak, nframes)
+        return numpy.clip(pmin + curve, pmin + 1, pmax).astype(numpy.int64)
+
+    def gesture(self, writer, start):
+        """
+        Write one gesture starting at start, return the time of its last
+        frame
+        """
+        args = self.args
+        tpl = self.template
+        nfingers = int(self.rng.choice(self.finger_counts, p=self.finger_weights))
+        tap = self.rng.uniform() < args.taps
+        duration = self.rng.uniform(0.05, 0.18) if tap else self.rng.uniform(0.3, 2.0)
+
+        times = self.frame_times(start, duration)
+        nframes = len(times)
+        nslots = min(nfingers, tpl.nslots)
+        x, y = self.gesture_path(nframes, nslots, tap)
+        x = (self.xrange[0] + x * self.xres).astype(numpy.int64)
+        y = (self.yrange[0] + y * self.yres).astype(numpy.int64)
+
+        mt = tpl.has_abs(ABS_MT_POSITION_X)
+        mt_pressure = tpl.has_abs(ABS_MT_PRESSURE)
+        st_pressure = tpl.has_abs(ABS_PRESSURE)
+        if mt_pressure:
+            pressure = self.pressure_curve(nframes, ABS_MT_PRESSURE)
+        elif st_pressure:
+            pressure = self.pressure_curve(nframes, ABS_PRESSURE)
+
+        slots = list(range(nslots))
+        ids = []
+        for s in slots:
+            ids.append(self.tracking_id)
+            self.tracking_id = (self.tracking_id + 1) % 65536
+
+        # faults, decided per gesture
+        jump_frame = -1
+        if mt and not tap and nslots < tpl.nslots and self.rng.uniform() < args.slot_jumps:
+            jump_frame = nframes // 2
+        drop_frame = -1
+        if self.rng.uniform() < args.syn_dropped and nframes > 4:
+            drop_frame = self.rng.randint(1, nframes - 2)
+        double_tool = self.rng.uniform() < args.double_tool
+
+        tool = TOOLS[min(nfingers, len(TOOLS)) - 1]
+        # the next tool up, or down for the last one
+        index = TOOLS.index(tool)
+        other_tool = TOOLS[index + 1 if index + 1 < len(TOOLS) else index - 1]
+
+        # the first frame puts the fingers down
+        t = int(times[0])
+        for f, s in enumerate(slots):
+            if mt:
+                writer.abs(t, ABS_MT_TRACKING_ID, ids[f], s)
+                writer.abs(t, ABS_MT_POSITION_X, int(x[0, f]), s)
+                writer.abs(t, ABS_MT_POSITION_Y, int(y[0, f]), s)
+                if mt_pressure:
+                    writer.abs(t, ABS_MT_PRESSURE, int(pressure[0]), s)
+        writer.key(t, BTN_TOUCH, 1)
+        if tool in tpl.keys:
+            writer.key(t, tool, 1)
+        if double_tool:
+            writer.key(t, other_tool, 1)
+        if tpl.has_abs(ABS_X):
+            writer.abs(t, ABS_X, int(x[0, 0]))
+            writer.abs(t, ABS_Y, int(y[0, 0]))
+        if st_pressure:
+            writer.abs(t, ABS_PRESSURE, int(pressure[0]))
+        writer.syn(t)
+
+        # the remaining frames only move, in two blocks around a slot jump
+        if jump_frame < 0:
+            jump_frame = nframes
+        for first, last in ((1, jump_frame), (jump_frame, nframes)):
+            if first >= last:
+                continue
+            if first == jump_frame:
+                # the touch in the last slot ends and continues in a free
+                # slot with the same coordinates
+                t = int(times[first])
+                writer.abs(t, ABS_MT_TRACKING_ID, -1, slots[-1])
+                slots[-1] = nslots
+                ids[-1] = self.tracking_id
+                self.tracking_id = (self.tracking_id + 1) % 65536
+                writer.abs(t, ABS_MT_TRACKING_ID, ids[-1], slots[-1])
+
+            rows = slice(first, last)
+            columns = []
+            for f, s in enumerate(slots):
+                if mt:
+                    columns.append((EV_ABS, ABS_MT_POSITION_X, s, x[rows, f]))
+                    columns.append((EV_ABS, ABS_MT_POSITION_Y, s, y[rows, f]))
+                    if mt_pressure:
+                        columns.append((EV_ABS, ABS_MT_PRESSURE, s, pressure[rows]))
+            if tpl.has_abs(ABS_X):
+                # single-touch emulation follows the first finger
+                columns.append((EV_ABS, ABS_X, None, x[rows, 0]))
+                columns.append((EV_ABS, ABS_Y, None, y[rows, 0]))
+            if st_pressure:
+                columns.append((EV_ABS, ABS_PRESSURE, None, pressure[rows]))
+            writer.block(times[rows], columns, drop_frame - first)
+
+        t = int(times[-1]) + int(1e6 / args.rate)
+        for s in slots:
+            if mt:
+                writer.abs(t, ABS_MT_TRACKING_ID, -1, s)
+        writer.key(t, BTN_TOUCH, 0)
+        if tool in tpl.keys:
+            writer.key(t, tool, 0)
+        if double_tool:
+            writer.key(t, other_tool, 0)
+        if st_pressure:
+            writer.abs(t, ABS_PRESSURE, tpl.absinfo[ABS_PRESSURE][0])
+        writer.syn(t)
+        return t
+
+    def run(self, output):
+        args = self.args
+        output.write(self.template.header)
+        if args.events:
+            length = "{} events".format(args.events)
+        else:
+            length = "{}s".format(args.duration)
+        output.write("# Synthetic recording: seed {}, {} at {}Hz\n".format(
+                     args.seed, length, args.rate))
+
+        writer = EventWriter(output)
+        end = int(args.duration * 1e6)
+        t = 0
+        while (writer.events_written < args.events) if args.events else (t < end):
+            t = self.gesture(writer, t)
+            t += int(self.rng.uniform(0.1, 1.0) * 1e6)
+        writer.flush()
+        return writer.bytes_written
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Generate a synthetic touchpad recording in evemu format")
+    parser.add_argument("--template", action="store", default=DEFAULT_TEMPLATE,
+                        help="evemu recording to copy the device description from "
+                             "(default ../touchpad-max-delta/t440s.evemu)")
+    parser.add_argument("--output", "-o", action="store", default="-",
+                        help="Output file (default stdout)")
+    parser.add_argument("--seed", action="store", type=int, default=0,
+                        help="Random seed, the same seed gives the same recording (default 0)")
+    parser.add_argument("--duration", action="store", type=float, default=60,
+                        help="Length of the recording in s (default 60)")
+    parser.add_argument("--events", action="store", type=int, default=0,
+                        help="Stop after the gesture that reaches this number of events, "
+                             "instead of after --duration")
+    parser.add_argument("--rate", action="store", type=float, default=80,
+                        help="Report rate in Hz (default 80)")
+    parser.add_argument("--jitter", action="store", type=float, default=0.05,
+                        help="Standard deviation of the frame interval as fraction "
+                             "of the interval (default 0.05)")
+    parser.add_argument("--fingers", action="store", default="1:0.7,2:0.2,3:0.1",
+                        help="Finger counts and their weights (default 1:0.7,2:0.2,3:0.1)")
+    parser.add_argument("--taps", action="store", type=float, default=0.3,
+                        help="Fraction of gestures that are taps, the rest are drags (default 0.3)")
+    parser.add_argument("--noise", action="store", type=float, default=0.05,
+                        help="Standard deviation of the position noise in mm (default 0.05)")
+    parser.add_argument("--slot-jumps", action="store", type=float, default=0.0,
+                        help="Probability of a slot jump in a drag (default 0)")
+    parser.add_argument("--syn-dropped", action="store", type=float, default=0.0,
+                        help="Probability of a SYN_DROPPED in a gesture (default 0)")
+    parser.add_argument("--double-tool", action="store", type=float, default=0.0,
+                        help="Probability of two BTN_TOOL_* down in a gesture (default 0)")
+    args = parser.parse_args(argv[1:])
+
+    template = DeviceTemplate(args.template)
+    generator = RecordingGenerator(template, args)
+    if args.output == "-":
+        generator.run(sys.stdout)
+    else:
+        with open(args.output, "w") as output:
+            generator.run(output)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,43 +1,57 @@
 #!/usr/bin/python
 #
-# Input is a single-touch recording, this script does not handle slots and
-# only looks at ABS_MT_PRESSURE.
-# 
+# Prints the pressure changes within each touch sequence. Uses
+# ABS_MT_PRESSURE per slot if the device has it, ABS_PRESSURE otherwise.
+#
 
 from __future__ import print_function
 
 import evemu
 import sys
 import os
-import math
+import numpy
+
+sys.path.append("..")
+from shared.extract import FrameData
+
+# Pressure deltas with an absolute value up to this are filtered
+MIN_DELTA = 2
 
 def main(argv):
     d = evemu.Device(argv[1], create=False)
 
-    pressure = None
-    dpressure = None
-    vals = []
-
-    for e in d.events():
-        if e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
-            if e.value == -1:
-                pressure = None
-                dpressure = None
-        elif e.matches("EV_ABS", "ABS_PRESSURE"):
-            if pressure is not None:
-                dpressure = e.value - pressure
-            pressure = e.value
-        elif e.matches("EV_SYN", "SYN_REPORT"):
-            if dpressure is not None and abs(dpressure) <= 2:
-                continue
-            vals.append((pressure, dpressure))
-    
-    print("Pressure deltas <= 2 are filtered")
-    for p, dp in vals:
-        print("Pressure: {} delta {}".format(p, dp))
+    if d.has_event("EV_ABS", "ABS_MT_PRESSURE"):
+        axis = "ABS_MT_PRESSURE"
+    else:
+        axis = "ABS_PRESSURE"
+
+    frames = FrameData.from_recording(d, [axis])
+    values = frames.values[axis]
+    changed = frames.changed[axis]
+
+    print("Pressure deltas <= {} are filtered".format(MIN_DELTA))
+    for slot, tid, idx in frames.sequences(axis):
+        if values.ndim == 2:
+            p = values[idx, slot]
+            c = changed[idx, slot]
+            header = "Touch {} in slot {}:".format(tid, slot)
+        else:
+            p = values[idx]
+            c = changed[idx]
+            header = "Touch:"
+
+        # one value per pressure update, the first one has no delta
+        p = p[c & ~numpy.isnan(p)]
+        if len(p) == 0:
+            continue
+        print(header)
+        dp = numpy.diff(p)
+        print("Pressure: {} delta None".format(int(p[0])))
+        for pressure, delta in zip(p[1:][abs(dp) > MIN_DELTA], dp[abs(dp) > MIN_DELTA]):
+            print("Pressure: {} delta {}".format(int(pressure), int(delta)))
 
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
+    if len(sys.argv) == 1 or sys.argv[1] in ("-h", "--help"):
         print("Usage: %s events.evemu" % os.path.basename(sys.argv[0]))
-        sys.exit(1)
+        sys.exit(1 if len(sys.argv) == 1 else 0)
     main(sys.argv)
@@ -6,63 +6,50 @@ import sys
 sys.path.append("..")
 from shared import *
 from shared.gnuplot import *
+from shared.accumulators import Histogram, MinMax
 
-class TouchPressure(EventProcessor):
+class TouchPressureStatistics(EventProcessor):
     def process_one_file(self, f, args):
         """
         Returns
         -------
-           A nested list of num-touchpoints elements, each of which is a
-           list of range min-pressure:max-pressure containting the item
-           count for that pressure. i.e. data[4][60] is the number of events
-           in sequence 4 with pressure value 60.
+           A tuple of (pressure, range) where pressure is a Histogram of
+           the pressure values of all single-finger touch points and range
+           is a MinMax of the device's pressure axis range.
         """
-        d = evemu.Device(f, create=False)
-
-        seqs = TouchSequence.create_from_recording(d)
+        d, seqs = load_recording(f)
         singles = [s for s in seqs if s.is_single and s.points ]
 
-        pmin = d.get_abs_minimum("ABS_MT_PRESSURE")
-        pmax = d.get_abs_maximum("ABS_MT_PRESSURE")
-
-        self.gnuplot.ranges(None, "{}:{}".format(pmin, pmax))
+        prange = MinMax()
+        prange.add([d.get_abs_minimum("ABS_MT_PRESSURE"),
+                    d.get_abs_maximum("ABS_MT_PRESSURE")])
 
-        pvals = [ 0 ] * (pmax + 1)
-        for s in singles:
-            for point in s.points:
-                p = point.pressure
-                try:
-                    pvals[p] += 1
-                except:
-                    print(p)
+        pvals = Histogram()
+        pvals.add([point.pressure for s in singles for point in s.points
+                   if point.pressure is not None])
 
-        return pvals
+        return pvals, prange
 
     def process(self, args):
         self.gnuplot = GnuPlot.from_object(self)
         with self.gnuplot as g:
             g.labels("pressure value", "count")
 
-            sums = None
-
-
-            for f in self.sourcefiles:
-                f = self.sourcefiles[0]
+            result = self.reduce_files(args)
+            if result is None:
+                return
 
-                data = self.process_one_file(f, args)
-                if sums is None:
-                    sums = data
-                else:
-                    sums = [ (x + y) for x, y in zip(sums, data)]
+            pvals, prange = result
+            g.ranges(None, "{}:{}".format(prange.min, prange.max))
 
-                g.comment("pressure-value event-count")
-                for pidx, count in enumerate(sums):
-                    g.data("{} {}".format(pidx, count))
+            g.comment("pressure-value event-count")
+            for pidx, count in enumerate(pvals.counts(0, prange.max + 1)):
+                g.data("{} {}".format(pidx, count))
 
-                g.plot("using 1:2 notitle with lines")
+            g.plot("using 1:2 notitle with lines")
 
 def main(sysargs):
-    TouchPressure().run()
+    TouchPressureStatistics().run()
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -12,21 +12,20 @@ class TouchPressure(EventProcessor):
         """
         Returns
         -------
-           A nested list of num-touchpoints elements, each of which is a
-           list of range min-pressure:max-pressure containting the item
-           count for that pressure. i.e. data[4][60] is the number of events
-           in sequence 4 with pressure value 60.
+           ( pmin, pmax, data )
+                where pmin and pmax are the pressure axis range
+                where data is a nested list of num-touchpoints elements,
+                each of which is a list of range min-pressure:max-pressure
+                containting the item count for that pressure. i.e.
+                data[4][60] is the number of events in sequence 4 with
+                pressure value 60.
         """
-        d = evemu.Device(f, create=False)
-
-        seqs = TouchSequence.create_from_recording(d)
+        d, seqs = load_recording(f)
         singles = [s for s in seqs if s.is_single and s.points ]
 
         pmin = d.get_abs_minimum("ABS_MT_PRESSURE")
         pmax = d.get_abs_maximum("ABS_MT_PRESSURE")
 
-        self.gnuplot.ranges(None, "{}:{}".format(pmin, pmax))
-
         # three-dimensional plot:
         #   left: touch sequence number
         #   right: pressure value
@@ -40,11 +39,7 @@ class TouchPressure(EventProcessor):
                 pvals[p] += 1
             data.append(pvals)
 
-        gridx = min(len(data), 150)
-        gridy = min(pmax, 150)
-        self.gnuplot.cmd("set dgrid3d {},{}".format(gridx, gridy))
-        
-        return data
+        return pmin, pmax, data
 
     def process(self, args):
         self.gnuplot = GnuPlot.from_object(self)
@@ -58,7 +53,12 @@ class TouchPressure(EventProcessor):
                 print("Only processing first source file");
 
             f = self.sourcefiles[0]
-            data = self.process_one_file(f, args)
+            pmin, pmax, data = self.call_one_file(f, args)
+
+            g.ranges(None, "{}:{}".format(pmin, pmax))
+            gridx = min(len(data), 150)
+            gridy = min(pmax, 150)
+            g.cmd("set dgrid3d {},{}".format(gridx, gridy))
 
             g.comment("touch-sequence-number pressure-value event-count")
             for sidx, sequence in enumerate(data):
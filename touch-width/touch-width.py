@@ -1,15 +1,20 @@
 #!/usr/bin/python
 #
-# Input is a single-touch recording, this script does not handle slots and
-# only looks at ABS_MT_WIDTH_MAJOR/MINOR.
-# 
+# Prints the touch width and height (ABS_MT_WIDTH_MAJOR/MINOR) in device
+# units and in mm for each slot, whenever either changes.
+#
 
 from __future__ import print_function
 
 import evemu
 import sys
 import os
-import math
+import numpy
+
+sys.path.append("..")
+from shared.extract import FrameData
+
+AXES = [ "ABS_MT_WIDTH_MAJOR", "ABS_MT_WIDTH_MINOR" ]
 
 def main(argv):
     d = evemu.Device(argv[1], create=False)
@@ -22,27 +27,27 @@ def main(argv):
         xres = 94
         yres = 90
 
-    width, height = None, None
-    ow, oh = 0, 0
-
-    for e in d.events():
-        if e.matches("EV_ABS", "ABS_MT_WIDTH_MAJOR"):
-            width = e.value
-        elif e.matches("EV_ABS", "ABS_MT_WIDTH_MINOR"):
-            height = e.value
-        elif e.matches("EV_SYN", "SYN_REPORT"):
-            if width == None or height == None:
-                continue
-            w = width/xres
-            h = height/yres
-            if w == ow and h == oh:
-                continue
-            ow = w
-            oh = h
-            print("width: {} height {} phys: {}x{}mm".format(width, height, w, h))
+    frames = FrameData.from_recording(d, AXES)
+    width = frames.values["ABS_MT_WIDTH_MAJOR"]
+    height = frames.values["ABS_MT_WIDTH_MINOR"]
+
+    for slot in range(frames.nslots):
+        w, h = width[:, slot], height[:, slot]
+        have = ~numpy.isnan(w) & ~numpy.isnan(h)
+        w, h = w[have], h[have]
+        if len(w) == 0:
+            continue
+
+        # only print when the size changes
+        keep = numpy.concatenate(([True], (numpy.diff(w) != 0) | (numpy.diff(h) != 0)))
+        print("Slot {}:".format(slot))
+        for width_units, height_units in zip(w[keep], h[keep]):
+            print("width: {} height {} phys: {}x{}mm".format(
+                  int(width_units), int(height_units),
+                  width_units/xres, height_units/yres))
 
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
+    if len(sys.argv) == 1 or sys.argv[1] in ("-h", "--help"):
         print("Usage: %s events.evemu" % os.path.basename(sys.argv[0]))
-        sys.exit(1)
+        sys.exit(1 if len(sys.argv) == 1 else 0)
     main(sys.argv)
@@ -1,77 +1,127 @@
-#!/usr/bin/python
+#!/usr/bin/env python
+# -*- coding: utf-8
 #
 # Detect slot jumps in a touchpad recording. These can be observed when slot A
 # ends and slot B continues with slot A's coordinates.
-# Only works for two slots
+#
+# Whenever a tracking ID ends, the last position of that touch is compared
+# to the positions of all touches in the other slots in the following
+# frames. The nearest one closer than the threshold is a suspected jump.
 
 from __future__ import print_function
 
-import evemu
 import sys
-import os
-import math
-import argparse
-
-THRESHOLD=100
-
-class SlotState:
-    NONE = 0
-    END = 1
-    BEGIN = 2
-    UPDATE = 3
-
-class Slot:
-    index = 0
-    state = SlotState.NONE
-    x = 0
-    y = 0
-
-    def near_enough_to(self, other):
-        if other.state < SlotState.BEGIN:
-            return False
-
-        return abs(other.x - self.x) < THRESHOLD or \
-            abs(other.y - self.y) < THRESHOLD
-
-def main(argv):
-    slots = []
-    xres, yres = 1, 1
-
-    d = evemu.Device(argv[1], create=False)
-    nslots = d.get_abs_maximum("ABS_MT_SLOT") + 1
-    slots = [Slot() for _ in range(0, nslots)]
-    print("Tracking %d slots" % nslots)
-
-    slot = 0
-    for e in d.events():
-        s = slots[slot]
-        if e.matches("EV_ABS", "ABS_MT_SLOT"):
-            slot = e.value
-            s = slots[slot]
-            s.dirty = True
-        elif e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
-            if e.value == -1:
-                s.state = SlotState.END
-            else:
-                s.state = SlotState.BEGIN
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_X"):
-            s.x = e.value
-            s.dirty = True
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_Y"):
-            s.y = e.value
-            s.dirty = True
-        elif e.matches("EV_SYN", "SYN_REPORT"):
-
-            if (slots[0].state == SlotState.END and slots[0].near_enough_to(slots[1])) or \
-                    (slots[1].state == SlotState.END and slots[1].near_enough_to(slots[0])):
-                print("{:2d}.{:06d}: possible slot jump".format(e.sec, e.usec))
-
-            for sl in slots:
-                if sl.state == SlotState.BEGIN:
-                    sl.state = SlotState.UPDATE
-                elif sl.state == SlotState.END:
-                    sl.state = SlotState.NONE
+sys.path.append("..")
+from shared import *
+from shared.extract import FrameData
+
+import numpy
+
+AXES = [ "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y" ]
+
+def find_slot_jumps(frames, xres, yres, threshold, window):
+    """
+    Return the list of suspected slot jumps as tuples of (time, from slot,
+    to slot, distance, frames) with the time in s of the frame where the
+    touch ended, the slots, the distance in mm and the number of frames
+    after the end the matching touch was seen.
+
+    Params
+    ------
+    frames : FrameData
+        with ABS_MT_POSITION_X/Y
+    xres, yres : double
+        The resolution in units/mm
+    threshold : double
+        The maximum distance in mm for a match
+    window : int
+        The number of frames after the end (including the end frame) to
+        look for a match in
+    """
+    x = frames.values["ABS_MT_POSITION_X"] / xres
+    y = frames.values["ABS_MT_POSITION_Y"] / yres
+    ids = frames.tracking_id
+    nframes, nslots = ids.shape
+
+    # frame f ends the touch in slot s if the touch was active in f - 1
+    # and the slot has no or a different touch in f
+    ended = (ids[:-1] != -1) & (ids[1:] != ids[:-1])
+    end_frames, end_slots = numpy.nonzero(ended)
+    end_frames += 1
+    if len(end_frames) == 0:
+        return []
+
+    # last position of each ending touch, shape (ends, 1, 1)
+    ex = x[end_frames - 1, end_slots][:, numpy.newaxis, numpy.newaxis]
+    ey = y[end_frames - 1, end_slots][:, numpy.newaxis, numpy.newaxis]
+
+    # positions of all slots in the window after each end, shape
+    # (ends, window, slots), numpy.nan beyond the recording and for the
+    # ending slot itself
+    offsets = numpy.arange(window)
+    idx = end_frames[:, numpy.newaxis] + offsets[numpy.newaxis, :]
+    beyond = idx >= nframes
+    idx = numpy.minimum(idx, nframes - 1)
+    cx = x[idx]
+    cy = y[idx]
+    cx[beyond] = numpy.nan
+    cx[numpy.arange(len(end_slots)), :, end_slots] = numpy.nan
+
+    dist = numpy.hypot(cx - ex, cy - ey).reshape(len(end_frames), -1)
+    have = numpy.any(~numpy.isnan(dist), axis=1)
+    nearest = numpy.zeros(len(dist), dtype=numpy.int64)
+    nearest[have] = numpy.nanargmin(dist[have], axis=1)
+    mindist = dist[numpy.arange(len(dist)), nearest]
+    jump = have & (mindist < threshold)
+
+    delay, to_slot = numpy.divmod(nearest[jump], nslots)
+    times = frames.time[end_frames[jump]] / 1e6
+    return list(zip(times.tolist(), end_slots[jump].tolist(), to_slot.tolist(),
+                    mindist[jump].tolist(), delay.tolist()))
+
+class TouchpadDetectSlotJumps(EventProcessor):
+    def add_args(self, parser):
+        parser.add_argument("--threshold", action="store", type=float, default=3.0,
+                            help="Maximum distance in mm between the end of a touch "
+                                 "and the continuing touch (default 3.0)")
+        parser.add_argument("--frames", action="store", type=int, default=2,
+                            help="Number of frames after the end of a touch to "
+                                 "look for the continuing touch in (default 2)")
+
+    def process_one_file(self, f, args):
+        """
+        Returns
+        -------
+            The list of suspected jumps, see find_slot_jumps()
+        """
+        d = evemu.Device(f, create=False)
+        if not d.has_event("EV_ABS", "ABS_MT_SLOT"):
+            raise InvalidDeviceError()
+
+        xres = d.get_abs_resolution("ABS_MT_POSITION_X")
+        yres = d.get_abs_resolution("ABS_MT_POSITION_Y")
+        if xres == 0 or yres == 0:
+            raise NoResolutionError()
+
+        frames = FrameData.from_recording(d, AXES)
+        return find_slot_jumps(frames, xres, yres, args.threshold, args.frames)
+
+    def process(self, args):
+        njumps = 0
+        nfiles = 0
+        print("{:>12s} {:>4s} {:>4s} {:>8s} {:>6s}  {}".format(
+              "time", "from", "to", "mm", "frames", "recording"))
+        for f, jumps in self.map_files(args):
+            nfiles += 1
+            njumps += len(jumps)
+            for time, from_slot, to_slot, dist, delay in jumps:
+                print("{:12.6f} {:4d} {:4d} {:8.2f} {:6d}  {}".format(
+                      time, from_slot, to_slot, dist, delay, f))
+
+        print("{} possible slot jumps in {} recordings".format(njumps, nfiles))
 
+def main(sysargs):
+    TouchpadDetectSlotJumps().run()
 
 if __name__ == "__main__":
     main(sys.argv)
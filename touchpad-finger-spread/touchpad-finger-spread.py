@@ -1,60 +1,104 @@
-#!/usr/bin/python
+#!/usr/bin/env python
+# -*- coding: utf-8
 #
-# Measures min/max finger spread between two fingers on a touchpad evemu recording
+# Measures min/max finger spread between all fingers on a touchpad evemu
+# recording, for every frame with two or more fingers down.
 # Touchpad must support ABS_MT_POSITION_X
-#
-# Data must be in slots 0 and 1
 
-import evemu
+from __future__ import print_function
+
 import sys
-import os
-import math
-
-def main(argv):
-    slot = 0
-    slots = [[0, 0], [0, 0]]
-    tracking_ids = [-1, -1]
-    distances = []
-    mm = []
-    horiz = []
-    vert = []
-
-    d = evemu.Device(argv[1], create=False)
-    width = d.get_abs_maximum("ABS_MT_POSITION_X") - d.get_abs_minimum("ABS_MT_POSITION_X")
-    height = d.get_abs_maximum("ABS_MT_POSITION_Y") - d.get_abs_minimum("ABS_MT_POSITION_Y")
+sys.path.append("..")
+from shared import *
+from shared.accumulators import Histogram
+from shared.extract import FrameData
+from shared.spread import multi_finger_frames, pair_deltas, frame_spread
+
+AXES = [ "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y" ]
+
+def device_resolution(d):
+    """
+    Return the tuple (xres, yres), at least 1.0 each
+    """
     xres = max(1.0, d.get_abs_resolution("ABS_MT_POSITION_X") * 1.0)
     yres = max(1.0, d.get_abs_resolution("ABS_MT_POSITION_Y") * 1.0)
-    print "Touchpad dimensions: %dx%dmm (%dx%d units)" % (width/xres, height/yres, width, height)
-
-    for e in d.events():
-        if e.matches("EV_ABS", "ABS_MT_SLOT"):
-            slot = e.value
-        elif e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
-            tracking_ids[slot] = e.value
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_X"):
-            slots[slot][0] = e.value
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_Y"):
-            slots[slot][1] = e.value
-        elif e.matches("EV_SYN", "SYN_REPORT"):
-            if tracking_ids[0] != -1 and tracking_ids[1] != -1:
-                dist = math.hypot(slots[0][0] - slots[1][0],
-                                  slots[0][1] - slots[1][1])
-                distances.append(dist)
-
-                dist = math.hypot(slots[0][0]/xres - slots[1][0]/xres,
-                                  slots[0][1]/yres - slots[1][1]/yres)
-                mm.append(dist)
-                horiz.append(abs(slots[0][0]/xres - slots[1][0]/xres));
-                vert.append(abs(slots[0][1]/yres - slots[1][1]/yres));
-
-    print "Max distance: %dmm, %d units" % (max(mm), max(distances))
-    print "Min distance %dmm, %d units" % (min(mm), min(distances))
-
-    print "Max distance: %dmm horiz %dmm vert" % (max(horiz), max(vert))
-    print "Min distance %dmm horiz, %dmm vert" % (min(horiz), min(vert))
+    return xres, yres
+
+def print_dimensions(path):
+    d = evemu.Device(path, create=False)
+    width = d.get_abs_maximum("ABS_MT_POSITION_X") - d.get_abs_minimum("ABS_MT_POSITION_X")
+    height = d.get_abs_maximum("ABS_MT_POSITION_Y") - d.get_abs_minimum("ABS_MT_POSITION_Y")
+    xres, yres = device_resolution(d)
+    print("Touchpad dimensions: %dx%dmm (%dx%d units)" % (width/xres, height/yres, width, height))
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+def print_percentiles(name, hist, unit):
+    print("{:16s} {}".format(name, " ".join("{:7.1f}{}".format(v, unit)
+                                            for v in hist.percentiles(PERCENTILES))))
+
+class TouchpadFingerSpread(EventProcessor):
+    def add_args(self, parser):
+        parser.add_argument("--binsize", action="store", type=float, default=0.1,
+                            help="Histogram bin size in mm (default 0.1)")
+
+    def process_one_file(self, f, args):
+        """
+        Returns
+        -------
+            A dict of name : Histogram with the per-frame spread, see
+            frame_spread(), in mm and, for "units_min" and "units_max",
+            in device units.
+        """
+        d = evemu.Device(f, create=False)
+        xres, yres = device_resolution(d)
+
+        frames = FrameData.from_recording(d, AXES)
+        rows = multi_finger_frames(frames.values["ABS_MT_POSITION_X"])
+        x = frames.values["ABS_MT_POSITION_X"][rows]
+        y = frames.values["ABS_MT_POSITION_Y"][rows]
+
+        spread = frame_spread(*pair_deltas(x / xres, y / yres), resolution=(xres, yres))
+
+        result = {}
+        for name, values in spread.items():
+            result[name] = Histogram(1 if name.startswith("units_") else args.binsize)
+            result[name].add(values)
+        return result
+
+    def process(self, args):
+        if not self.sourcefiles:
+            return
+        print_dimensions(self.sourcefiles[0])
+
+        h = self.reduce_files(args)
+        if h is None or h["max"].count == 0:
+            print("No frames with two or more fingers")
+            return
+
+        print("Frames with two or more fingers: {}".format(h["max"].count))
+        # histograms are accurate to the bin size
+        def top(name):
+            return h[name].percentiles([100])[0] + h[name].binsize
+
+        def bottom(name):
+            return h[name].percentiles([0])[0]
+
+        print("Max distance: %dmm, %d units" % (top("max"), top("units_max")))
+        print("Min distance %dmm, %d units" % (bottom("min"), bottom("units_min")))
+
+        print("Max distance: %dmm horiz %dmm vert" % (top("horizontal_max"), top("vertical_max")))
+        print("Min distance %dmm horiz, %dmm vert" % (bottom("horizontal_min"), bottom("vertical_min")))
+
+        print("{:16s} {}".format("per frame", " ".join("{:>9s}".format("{}%".format(p))
+                                                       for p in PERCENTILES)))
+        print_percentiles("min distance", h["min"], "mm")
+        print_percentiles("max distance", h["max"], "mm")
+        print_percentiles("max horizontal", h["horizontal_max"], "mm")
+        print_percentiles("max vertical", h["vertical_max"], "mm")
+
+def main(sysargs):
+    TouchpadFingerSpread().run()
 
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        print "Usage: %s events.evemu" % os.path.basename(sys.argv[0])
-        sys.exit(1)
     main(sys.argv)
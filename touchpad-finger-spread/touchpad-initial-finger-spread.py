@@ -1,69 +1,79 @@
-#!/usr/bin/python
+#!/usr/bin/env python
+# -*- coding: utf-8
 #
-# Measures min/max finger spread between two fingers when the second slot
-# starts. Touchpad must support ABS_MT_POSITION_X
-#
-# Data must be in slots 0 and 1
+# Measures the finger spread when a finger lands while other fingers are
+# down, the distance to the nearest finger already down.
+# Touchpad must support ABS_MT_POSITION_X
+
+from __future__ import print_function
 
-import evemu
 import sys
-import os
-import math
+sys.path.append("..")
+from shared import *
+from shared.accumulators import Histogram
+from shared.extract import FrameData
+from shared.spread import landing_spread
+
+AXES = [ "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y" ]
+
+class TouchpadInitialFingerSpread(EventProcessor):
+    def add_args(self, parser):
+        parser.add_argument("--binsize", action="store", type=float, default=0.1,
+                            help="Histogram bin size in mm (default 0.1)")
+        parser.add_argument("--verbose", action="store_true",
+                            help="Print each new touch (single process only)")
+
+    def cacheable(self, args):
+        # --verbose prints from process_one_file()
+        return not args.verbose
+
+    def process_one_file(self, f, args):
+        """
+        Returns
+        -------
+            A dict of name : Histogram of the spread in mm at each landing
+            finger, "distance" for the distance to the nearest finger,
+            "horizontal" and "vertical" for its components.
+        """
+        d = evemu.Device(f, create=False)
+        xres = max(1.0, d.get_abs_resolution("ABS_MT_POSITION_X") * 1.0)
+        yres = max(1.0, d.get_abs_resolution("ABS_MT_POSITION_Y") * 1.0)
 
-def main(argv):
-    slot = 0
-    slots = [[0, 0], [0, 0]]
-    tracking_ids = [-1, -1]
-    tracking_ids_old = [-1, -1]
-    distances = []
-    mm = []
-    horiz = []
-    vert = []
+        frames = FrameData.from_recording(d, AXES)
+        dist, h, v = landing_spread(frames.values["ABS_MT_POSITION_X"] / xres,
+                                    frames.values["ABS_MT_POSITION_Y"] / yres,
+                                    frames.tracking_id)
 
-    d = evemu.Device(argv[1], create=False)
-    width = d.get_abs_maximum("ABS_MT_POSITION_X") - d.get_abs_minimum("ABS_MT_POSITION_X")
-    height = d.get_abs_maximum("ABS_MT_POSITION_Y") - d.get_abs_minimum("ABS_MT_POSITION_Y")
-    xres = max(1.0, d.get_abs_resolution("ABS_MT_POSITION_X") * 1.0)
-    yres = max(1.0, d.get_abs_resolution("ABS_MT_POSITION_Y") * 1.0)
-    print "Touchpad dimensions: %dx%dmm (%dx%d units)" % (width/xres, height/yres, width, height)
+        if args.verbose and args.jobs <= 1:
+            for i in range(len(dist)):
+                print("New multi-finger touch: distance %dmm (h %dmm v %dmm)" % (dist[i], h[i], v[i]))
 
-    for e in d.events():
-        if e.matches("EV_ABS", "ABS_MT_SLOT"):
-            slot = e.value
-        elif e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
-            tracking_ids[slot] = e.value
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_X"):
-            slots[slot][0] = e.value
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_Y"):
-            slots[slot][1] = e.value
-        elif e.matches("EV_SYN", "SYN_REPORT"):
-            if tracking_ids[0] != -1 and tracking_ids[1] != -1 and \
-                (tracking_ids_old[0] == -1 or tracking_ids_old[1] == -1):
-                dist = math.hypot(slots[0][0] - slots[1][0],
-                                  slots[0][1] - slots[1][1])
-                distances.append(dist)
+        result = {}
+        for name, values in (("distance", dist), ("horizontal", h), ("vertical", v)):
+            result[name] = Histogram(args.binsize)
+            result[name].add(values)
+        return result
 
-                dist = math.hypot(slots[0][0]/xres - slots[1][0]/xres,
-                                  slots[0][1]/yres - slots[1][1]/yres)
-                mm.append(dist)
-                h = abs(slots[0][0]/xres - slots[1][0]/xres)
-                horiz.append(h)
-                v = abs(slots[0][1]/yres - slots[1][1]/yres)
-                vert.append(v)
+    def process(self, args):
+        h = self.reduce_files(args)
+        if h is None or h["distance"].count == 0:
+            print("No finger landed while another finger was down")
+            return
 
-                print "New 2fg touch: distance %dmm (h %dmm v %dmm)" % (dist, h, v)
+        # histograms are accurate to the bin size
+        def top(name):
+            return h[name].percentiles([100])[0] + h[name].binsize
 
-            tracking_ids_old[0] = tracking_ids[0]
-            tracking_ids_old[1] = tracking_ids[1]
+        def bottom(name):
+            return h[name].percentiles([0])[0]
 
-    print "Max distance: %dmm, %d units" % (max(mm), max(distances))
-    print "Min distance %dmm, %d units" % (min(mm), min(distances))
+        print("New multi-finger touches: {}".format(h["distance"].count))
+        print("Max distance: %dmm, horiz %dmm, vert %dmm" % (top("distance"), top("horizontal"), top("vertical")))
+        print("Min distance: %dmm, horiz %dmm, vert %dmm" % (bottom("distance"), bottom("horizontal"), bottom("vertical")))
+        print("Median distance %.1fmm, 5%%-95%% %.1f-%.1fmm" % tuple(h["distance"].percentiles([50, 5, 95])))
 
-    print "Max distance: %dmm horiz %dmm vert" % (max(horiz), max(vert))
-    print "Min distance %dmm horiz, %dmm vert" % (min(horiz), min(vert))
+def main(sysargs):
+    TouchpadInitialFingerSpread().run()
 
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        print "Usage: %s events.evemu" % os.path.basename(sys.argv[0])
-        sys.exit(1)
     main(sys.argv)
@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8
 
+import numpy
 import sys
 
 sys.path.append("..")
 from shared import *
 from shared.gnuplot import *
+from shared.decimate import add_decimation_args, new_point_decimator, decimated_data
 
 class TouchpadFingerStartPoint(EventProcessor):
 
@@ -18,34 +20,50 @@ class TouchpadFingerStartPoint(EventProcessor):
         arg_parser.add_argument("--last",
                                 action="store_true",
                                 help="use the last point of the touch sequence instead of the first")
+        arg_parser.add_argument("--binary",
+                                action="store_true",
+                                help="write the data file in gnuplot's binary format")
+        add_decimation_args(arg_parser)
 
     def process_one_file(self, f, args):
-        self.gnuplot.comment("processing {}".format(f))
-        d = evemu.Device(f, create=False)
-
-        seqs = TouchSequence.create_from_recording(d)
+        """
+        Returns
+        -------
+            A numpy array of shape (n, 2) with the x/y start (or end)
+            points of each sequence in percent of the touchpad size
+        """
+        d, seqs = load_recording(f)
         singles = [s for s in seqs if s.is_single and s.points ]
 
-        for s in singles:
-            if args.last:
-                x, y = s.last.percent
-            else:
-                x, y = s.first.percent
-            self.gnuplot.data("{} {}".format(x, y))
+        if args.last:
+            points = [ s.last.percent for s in singles ]
+        else:
+            points = [ s.first.percent for s in singles ]
+
+        return numpy.array(points, dtype=numpy.float64).reshape(-1, 2)
 
     def process(self, args):
-        self.gnuplot = GnuPlot.from_object(self)
+        self.gnuplot = GnuPlot.from_object(self, binary=args.binary)
         with self.gnuplot as g:
             g.labels("touchpad width", "touchpad height")
             g.ranges("0.0:1.0", "0.0:1.0")
 
-            for f in self.sourcefiles:
-                try:
-                    self.process_one_file(f, args)
-                except DeviceError as e:
-                    print("Skipping {} with error: {}".format(f, e))
+            if args.decimate == "none":
+                for f, points in self.map_files(args):
+                    g.comment("processing {}".format(f))
+                    g.data(points)
+                g.plot("using 1:2 notitle")
+                return
+
+            decimator = new_point_decimator(args, (0.0, 1.0), (0.0, 1.0))
+            for f, points in self.map_files(args):
+                g.comment("processing {}".format(f))
+                decimator.add(points[:, 0], points[:, 1])
 
-            g.plot("using 1:2 notitle")
+            data, comment, using = decimated_data(decimator)
+            g.comment(comment)
+            g.data(data)
+            g.plot(using)
 
 def main(sysargs):
     TouchpadFingerStartPoint().run()
@@ -1,85 +1,163 @@
-#!/usr/bin/python
+#!/usr/bin/env python
+# -*- coding: utf-8
 #
 # Measures maximum delta between events on a touchpad evemu recording
 # Touchpad must support ABS_MT_POSITION_X
-# Recording of a single finger only
+#
+# All slots are considered, a delta is the movement of one touch between
+# two consecutive position updates.
+
+from __future__ import print_function
 
-import evemu
-import sys
-import os
 import math
+import sys
+sys.path.append("..")
+from shared import *
+from shared.accumulators import Histogram, MinMax
+from shared.arrays import segment_diff, segment_reduce
+from shared.extract import FrameData
+
+import numpy
+
+AXES = [ "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y" ]
+
+def touch_positions(frames, xres, yres):
+    """
+    Return the tuple (time, x, y, offsets, slots) with the positions in mm
+    of every touch at each frame where it moved, concatenated over all
+    touches. The positions of touch i are in [offsets[i], offsets[i + 1]),
+    slots holds the slot of each touch.
+    """
+    ids = frames.tracking_id
+    x = frames.values["ABS_MT_POSITION_X"]
+    y = frames.values["ABS_MT_POSITION_Y"]
+    moved = frames.changed["ABS_MT_POSITION_X"] | frames.changed["ABS_MT_POSITION_Y"]
+    valid = (ids != -1) & moved & ~numpy.isnan(x) & ~numpy.isnan(y)
+
+    # transposed, so the frames of each slot are contiguous
+    slot, frame = numpy.nonzero(valid.T)
+    tid = ids[frame, slot]
+    new_touch = numpy.ones(len(frame), dtype=bool)
+    new_touch[1:] = (slot[1:] != slot[:-1]) | (tid[1:] != tid[:-1])
+    starts = numpy.flatnonzero(new_touch)
+    offsets = numpy.append(starts, len(frame))
+
+    return (frames.time[frame], x[frame, slot] / xres, y[frame, slot] / yres,
+            offsets, slot[starts])
+
+def touch_deltas(frames, xres, yres):
+    """
+    Return a dict with numpy arrays of one element per touch with at least
+    one delta: "slot", "end" (the time in µs of the last position),
+    "count" (the number of deltas), "mean", "max" and "total" of the
+    delta lengths and "max_x", "max_y" of the absolute x/y deltas, all in
+    mm.
+    """
+    time, x, y, offsets, slots = touch_positions(frames, xres, yres)
+    dxy, doffsets = segment_diff(numpy.column_stack((x, y)), offsets)
+    dist = numpy.hypot(dxy[:, 0], dxy[:, 1])
+    count = numpy.diff(doffsets)
+
+    total = segment_reduce(numpy.add, dist, doffsets)
+    result = {
+        "slot": slots,
+        "end": time[offsets[1:] - 1],
+        "count": count,
+        "mean": total / numpy.maximum(count, 1),
+        "max": segment_reduce(numpy.maximum, dist, doffsets),
+        "total": total,
+        "max_x": segment_reduce(numpy.maximum, numpy.abs(dxy[:, 0]), doffsets),
+        "max_y": segment_reduce(numpy.maximum, numpy.abs(dxy[:, 1]), doffsets),
+    }
+    has_deltas = count > 0
+    return { k: v[has_deltas] for k, v in result.items() }
+
+class SynapticsMovementDelta(EventProcessor):
+    def add_args(self, parser):
+        parser.add_argument("--per-touch", action="store_true",
+                            help="Print the statistics of each touch")
+        parser.add_argument("--binsize", action="store", type=float, default=0.1,
+                            help="Bin size in mm of the maximum delta distribution (default 0.1)")
+
+    def process_one_file(self, f, args):
+        """
+        Returns
+        -------
+            A tuple of (max, max_x, max_y, touches) where max is a
+            Histogram of the maximum delta of each touch, max_x and max_y
+            are MinMax of the maximum x/y delta and touches is a list
+            with the per-touch dict from touch_deltas(), or an empty list
+            without --per-touch.
+        """
+        d = evemu.Device(f, create=False)
+        xres = d.get_abs_resolution("ABS_MT_POSITION_X") * 1.0
+        yres = d.get_abs_resolution("ABS_MT_POSITION_Y") * 1.0
+        if xres == 0 or yres == 0:
+            raise NoResolutionError()
+
+        frames = FrameData.from_recording(d, AXES)
+        touches = touch_deltas(frames, xres, yres)
+
+        max_delta = Histogram(args.binsize)
+        max_delta.add(touches["max"])
+        max_x = MinMax()
+        max_x.add(touches["max_x"])
+        max_y = MinMax()
+        max_y.add(touches["max_y"])
+
+        return max_delta, max_x, max_y, [ touches ] if args.per_touch else []
+
+    def print_dimensions(self, f):
+        d = evemu.Device(f, create=False)
+        width = d.get_abs_maximum("ABS_MT_POSITION_X") - d.get_abs_minimum("ABS_MT_POSITION_X")
+        height = d.get_abs_maximum("ABS_MT_POSITION_Y") - d.get_abs_minimum("ABS_MT_POSITION_Y")
+        xres = d.get_abs_resolution("ABS_MT_POSITION_X") * 1.0
+        yres = d.get_abs_resolution("ABS_MT_POSITION_Y") * 1.0
+        if xres == 0 or yres == 0:
+            return
+
+        diag = math.hypot(width, height)
+        print("Touchpad dimensions: %dx%dmm" % (width/xres, height/yres))
+        print("Touchpad diagonal: %.2f (0.25 == %.2f)" % (diag, 0.25 * diag))
+        diag = math.hypot(width/xres, height/yres)
+        print("Touchpad diagonal: %.2fmm (0.25 == %.2fmm)" % (diag, 0.25 * diag))
+
+    def print_touches(self, touches):
+        for i in range(len(touches["slot"])):
+            print("%.6f: slot %d: %d deltas, average %.2f, max %.2f, total distance %.2f in mm" %
+                  (touches["end"][i] / 1e6, touches["slot"][i], touches["count"][i],
+                   touches["mean"][i], touches["max"][i], touches["total"][i]))
+            print("... max x: %.2fmm, max y: %.2fmm" % (touches["max_x"][i], touches["max_y"][i]))
+
+    def process(self, args):
+        if not self.sourcefiles:
+            return
+        self.print_dimensions(self.sourcefiles[0])
+
+        result = self.reduce_files(args)
+        if result is None:
+            return
+        max_delta, max_x, max_y, touches = result
+
+        for t in touches:
+            self.print_touches(t)
+
+        if max_delta.count == 0:
+            print("No touch movement recorded")
+            return
+
+        # accurate to the bin size
+        print("Maximum recorded delta: %.2fmm" % (max_delta.percentiles([100])[0] + max_delta.binsize))
+        print("... x: %.2fmm" % max_x.max)
+        print("... y: %.2fmm" % max_y.max)
+
+        pcs = [50, 90, 95, 99, 99.9]
+        print("Maximum delta per touch, {} touches:".format(max_delta.count))
+        for pc, value in zip(pcs, max_delta.percentiles(pcs)):
+            print("... {:5.1f}%: {:.2f}mm".format(pc, value))
 
-def mean(data):
-    return 1.0 * sum(data)/len(data)
-
-def veclen(x, y):
-    return math.sqrt(x * x + y * y)
-
-def main(argv):
-    deltas = []
-    x, y = None, None
-    dx, dy = 0, 0
-    max_delta = [0, 0, 0]
-
-    d = evemu.Device(argv[1], create=False)
-    width = d.get_abs_maximum("ABS_MT_POSITION_X") - d.get_abs_minimum("ABS_MT_POSITION_X")
-    height = d.get_abs_maximum("ABS_MT_POSITION_Y") - d.get_abs_minimum("ABS_MT_POSITION_Y")
-    diag = veclen(width, height)
-    xres = d.get_abs_resolution("ABS_MT_POSITION_X") * 1.0
-    yres = d.get_abs_resolution("ABS_MT_POSITION_Y") * 1.0
-    print "Touchpad dimensions: %dx%dmm" % (width/xres, height/yres)
-    print "Touchpad diagonal: %.2f (0.25 == %.2f)" % (diag, 0.25 * diag)
-
-    diag = veclen(width/xres, height/yres)
-    print "Touchpad diagonal: %.2fmm (0.25 == %.2fmm)" % (diag, 0.25 * diag)
-
-    slot = 0
-
-    for e in d.events():
-        if e.matches("EV_ABS", "ABS_MT_SLOT"):
-            slot = e.value
-        elif slot != 0:
-            continue
-
-        if e.matches("EV_ABS", "ABS_MT_TRACKING_ID"):
-            if e.value == -1 and len(deltas) > 0:
-                vdeltas = [ veclen(x/xres, y/xres) for (x, y) in deltas]
-                print("%d.%d: %d deltas, average %.2f, max %.2f, total distance %.2f in mm" %
-                        (e.sec, e.usec, len(vdeltas), mean(vdeltas), max(vdeltas), sum(vdeltas)))
-
-                xdeltas = [abs(x/xres) for (x, y) in deltas]
-                ydeltas = [abs(y/yres) for (x, y) in deltas]
-                print("... x: average %.2fmm, max %.2fmm, total distance %.2fmm" %
-                        (mean(xdeltas), max(xdeltas), sum(xdeltas)))
-                print("... y: average %.2fmm, max %.2fmm, total distance %.2fmm" %
-                        (mean(ydeltas), max(ydeltas), sum(ydeltas)))
-                max_delta[0] = max(max_delta[0], max(vdeltas))
-                max_delta[1] = max(max_delta[1], max(xdeltas))
-                max_delta[2] = max(max_delta[2], max(ydeltas))
-            else:
-                deltas = []
-                x, y = None, None
-                dx, dy = 0, 0
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_X"):
-            if x != None:
-                dx = e.value - x
-            x = e.value
-        elif e.matches("EV_ABS", "ABS_MT_POSITION_Y"):
-            if y != None:
-                dy = e.value - y
-            y = e.value
-        elif e.matches("EV_SYN", "SYN_REPORT"):
-            if dx != 0 and dy != 0:
-                deltas.append((dx, dy))
-            dx, dy = 0, 0
-
-    print("Maximum recorded delta: %.2fmm" % (max_delta[0]))
-    print("... x: %.2fmm" % max_delta[1])
-    print("... y: %.2fmm" % max_delta[2])
-    return
+def main(sysargs):
+    SynapticsMovementDelta().run()
 
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        print "Usage: %s events.evemu" % os.path.basename(sys.argv[0])
-        sys.exit(1)
     main(sys.argv)
@@ -7,14 +7,19 @@
 # turn tells us how far a pointer acceleration curve needs to go to reall
 # be useful.h
 
-import math
+import numpy
 import sys
 
 sys.path.append("..")
 from shared import *
 from shared.gnuplot import *
+from shared.accumulators import LogHistogram
+from shared.speed import VelocityCalculator2point
 
 class TouchpadMotionSpeed(EventProcessor):
+    # the other arguments only change the output
+    cache_args = [ "relative_error" ]
+
     def add_args(self, parser):
         parser.description = (""
                 "Process all touch sequences and calculate the velocity "
@@ -24,8 +29,10 @@ class TouchpadMotionSpeed(EventProcessor):
                 default=10, help="Bucket size in mm/s")
         parser.add_argument("--require-minimum", action="store", type=int,
                 default=10, help="Minimum number of events at top end of bucket list")
+        parser.add_argument("--relative-error", action="store", type=float,
+                default=0.01, help="Relative error of the velocity sketch (default 0.01)")
 
-    def convert_to_buckets(self, bucketsize, vels):
+    def convert_to_buckets(self, bucketsize, sketch):
         """
         Return:
         ------
@@ -34,13 +41,8 @@ class TouchpadMotionSpeed(EventProcessor):
         vels within this bucket as value
 
         """
-        buckets = {}
-
-        for v in vels:
-            b = int(v/bucketsize)
-            buckets[b] = buckets.get(b, 0) + 1
-
-        return buckets
+        counts = sketch.linear_buckets(bucketsize)
+        return { b: int(c) for b, c in enumerate(counts) if c > 0 }
 
     def reduce_buckets(self, buckets, min):
         for key in sorted(buckets.keys(), reverse=True):
@@ -50,39 +52,35 @@ class TouchpadMotionSpeed(EventProcessor):
         return buckets
 
     def process_one_file(self, f, args):
-        self.gnuplot.comment("processing {}".format(f))
-        d = evemu.Device(f, create=False)
-
-        seqs = TouchSequence.create_from_recording(d)
+        """
+        Return:
+        ------
+        A LogHistogram with the velocities in mm/s
+        """
+        d, seqs = load_recording(f)
         singles = [s for s in seqs if s.is_single and s.points ]
 
-        vels = []
-
-        for s in singles:
-            for this, next in zip(s.points[:-1], s.points[1:]):
-                delta = next - this
-                vel = 1e6 * math.hypot(delta.x, delta.y)/delta.time
-                vels.append(vel)
+        vels = VelocityCalculator2point().calculate(singles)
 
-        return vels
+        sketch = LogHistogram(args.relative_error)
+        sketch.add(vels[~numpy.isnan(vels)])
+        return sketch
 
     def process(self, args):
         self.gnuplot = GnuPlot.from_object(self)
         with self.gnuplot as g:
             g.labels("speed(mm/s)", "count")
 
-            vels = []
+            sketch = LogHistogram(args.relative_error)
 
-            for f in self.sourcefiles:
-                try:
-                    vels += self.process_one_file(f, args)
-                except DeviceError as e:
-                    print("Skipping {} with error: {}".format(f, e))
+            for f, s in self.map_files(args):
+                g.comment("processing {}".format(f))
+                sketch.merge(s)
 
-            buckets = self.convert_to_buckets(args.bucketsize, vels)
+            buckets = self.convert_to_buckets(args.bucketsize, sketch)
             buckets = self.reduce_buckets(buckets, args.require_minimum)
             g.comment("# bucket-speed(mm/s) event-count")
-            for b, c in buckets.iteritems():
+            for b, c in sorted(buckets.items()):
                 g.data("{} {}".format(b, c))
 
             g.plot("using 1:2 notitle")
@@ -9,12 +9,19 @@
 
 from __future__ import print_function
 
-from tabulate import *
 import evemu
 import sys
 import os
 import math
 import argparse
+import functools
+import numpy
+
+sys.path.append("..")
+from shared import TouchSequence, DeviceError, InvalidDeviceError
+from shared.parallel import imap_files
+from shared.accumulators import LogHistogram
+from shared.speed import VelocityCalculator2point
 
 class SlotState:
     NONE = 0
@@ -33,16 +40,13 @@ class Slot:
     time = 0
     dt = 0
 
-def parse_recordings_file(path):
-    print("# processing {}".format(path))
+def slot_velocities(d):
+    """
+    Return the list of velocities in mm/s between the frames of each
+    slot. Used for the devices TouchSequence doesn't handle, e.g.
+    touchscreens without BTN_LEFT.
+    """
     vels = []
-
-    d = evemu.Device(path, create=False)
-
-    if not d.has_event("EV_ABS", "ABS_MT_SLOT"):
-        print("# single touch only, skipping")
-        return None
-
     nslots = d.get_abs_maximum("ABS_MT_SLOT") + 1
     slots = [Slot() for _ in range(0, nslots)]
     xres = 1.0 * d.get_abs_resolution("ABS_MT_POSITION_X")
@@ -86,28 +90,56 @@ def parse_recordings_file(path):
                     vel = 1000 * dist/dt # mm/ms == m/s
                     vel = 1000 * vel # mm/s
                     vels.append(vel)
-                    # print("{}".format(vel))
 
                 if sl.state == SlotState.BEGIN:
                     sl.state = SlotState.UPDATE
                 elif sl.state == SlotState.END:
                     sl.state = SlotState.NONE
                 sl.dirty = False
+    return vels
+
+def parse_recordings_file(path, relative_error = 0.01):
+    """
+    Return a LogHistogram with all velocities in the recording in mm/s, or
+    None if the recording is not a multitouch recording
+    """
+    d = evemu.Device(path, create=False)
+
+    if not d.has_event("EV_ABS", "ABS_MT_SLOT"):
+        return None
+
+    try:
+        seqs = TouchSequence.create_from_recording(d)
+    except InvalidDeviceError:
+        # no BTN_LEFT or BTN_TOUCH
+        v = numpy.array(slot_velocities(d), dtype=numpy.float64)
+    else:
+        v = VelocityCalculator2point().calculate(seqs)
+
+    vels = LogHistogram(relative_error)
+    vels.add(v[~numpy.isnan(v)])
+    return vels
+
+def sketch_to_datapoints(vels):
+    """
+    Convert the velocity sketch into the speed buckets, returning a dict
+    with the speed as the key and a dict with info for each speed.
+    """
+    nevents = vels.count
+    if nevents == 0:
+        print("# No data points")
+        return {}
 
-    nevents = len(vels)
-    maxvel = max(vels)
+    maxvel = vels.max
     print("# Number of data points: {}".format(nevents))
     print("# Highest velocity: {} mm/s".format(maxvel))
 
     # divide into buckets for each 10mm/s increment
     increment = 10
-    nbuckets = int(maxvel/increment) + 1
-    buckets = [0] * nbuckets
+    buckets = list(vels.linear_buckets(increment))
+    nbuckets = len(buckets)
     print("# Starting with {} buckets".format(nbuckets))
     min_events = 5
-    for v in vels:
-        bucket = int(v/increment)
-        buckets[bucket] += 1
 
     reduced_nevents = nevents
     for i in range(len(buckets) - 1, -1, -1):
@@ -129,6 +161,7 @@ def parse_recordings_file(path):
     datapoints = {}
 
     for b in buckets:
+        b = int(b)
         percent = 100.0 * b/nevents_new
         total_percent += percent
         datapoints[speed] = {
@@ -148,10 +181,10 @@ def print_one_dataset(data):
     data is a dict with speed as the key and a dict with info for each speed
     """
 
-    speeds = data.keys()
-    speeds.sort()
+    speeds = sorted(data.keys())
     datapoints = [ data[key] for key in speeds ]
 
+    from tabulate import tabulate
     print(tabulate(datapoints, headers='keys'))
 
 
@@ -170,15 +203,14 @@ def print_all_datasets(datasets):
 
     """
 
-    longest_speed_list = datasets[0].keys()
+    longest_speed_list = list(datasets[0].keys())
 
     for dataset in datasets[1:]:
-        speeds = dataset.keys()
-        if len(speeds) > longest_speed_list:
+        speeds = list(dataset.keys())
+        if len(speeds) > len(longest_speed_list):
             longest_speed_list = speeds
 
-    speeds = longest_speed_list
-    speeds.sort()
+    speeds = sorted(longest_speed_list)
 
     for speed in speeds:
         print('{} "mm/s" "nevents:" '.format(speed), end="")
@@ -212,13 +244,36 @@ def main(argv):
     parser = argparse.ArgumentParser(description="Measure delta between event frames for each slot")
     parser.add_argument("path", metavar="recording",
                         nargs="*", help="Path to evemu recording")
+    parser.add_argument("--merge", action="store_true",
+                        help="Merge all recordings into one dataset")
+    parser.add_argument("--relative-error", action="store", type=float,
+                        default=0.01, help="Relative error of the velocity sketch (default 0.01)")
+    parser.add_argument("--jobs", "-j", action="store", type=int, default=1,
+                        help="Number of recordings to process in parallel (default 1)")
     args = parser.parse_args()
 
-    data = []
-    for path in args.path:
-        processed = parse_recordings_file(path)
-        if processed is not None:
-            data.append(processed)
+    func = functools.partial(parse_recordings_file,
+                             relative_error=args.relative_error)
+
+    sketches = []
+    for path, vels, error in imap_files(func, args.path, jobs=args.jobs,
+                                        catch=(DeviceError,)):
+        print("# processing {}".format(path))
+        if error is not None:
+            print("# skipping with error: {}".format(error))
+            continue
+        if vels is None:
+            print("# single touch only, skipping")
+            continue
+        sketches.append(vels)
+
+    if args.merge and sketches:
+        merged = LogHistogram(args.relative_error)
+        for vels in sketches:
+            merged.merge(vels)
+        sketches = [merged]
+
+    data = [sketch_to_datapoints(vels) for vels in sketches]
 
     if len(data) == 1:
         print_one_dataset(data[0])
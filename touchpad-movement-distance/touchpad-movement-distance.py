@@ -6,6 +6,7 @@ import sys
 
 sys.path.append("..")
 from shared import *
+from shared import profiling
 from shared.gnuplot import *
 
 class TouchpadMovementDistance(EventProcessor):
@@ -17,11 +18,9 @@ class TouchpadMovementDistance(EventProcessor):
         "")
 
     def process_one_file(self, f, args):
-        self.gnuplot.comment("processing {}".format(f))
-        d = evemu.Device(f, create=False)
-
-        seqs = TouchSequence.create_from_recording(d)
-        singles = [s for s in seqs if s.is_single and s.points ]
+        d, seqs = load_recording(f)
+        with profiling.stage("filter"):
+            singles = [s for s in seqs if s.is_single and s.points ]
 
         sums = []
 
@@ -48,11 +47,9 @@ class TouchpadMovementDistance(EventProcessor):
 
             sums = []
 
-            for f in self.sourcefiles:
-                try:
-                    sums += self.process_one_file(f, args)
-                except DeviceError as e:
-                    print("Skipping {} with error: {}".format(f, e))
+            for f, s in self.map_files(args):
+                g.comment("processing {}".format(f))
+                sums += s
 
             for sum_mm, sum_x, sum_y in sorted(sums, key=lambda s : s[0]):
                 g.data("{} {} {}".format(sum_mm, sum_x, sum_y))
@@ -1,78 +1,244 @@
 #!/usr/bin/python
 #
-# Collects all x/y positions reported by the sensor. Looks at single-touch
-# emulation only (ABS_X, ABS_Y).
+# Collects all x/y positions reported by the sensor, either from the
+# single-touch emulation (ABS_X, ABS_Y) or from the multitouch slots
+# (ABS_MT_POSITION_X/Y). Multiple recordings are merged into one map.
 #
 # Output is a png file with black background. Any x/y location captured by
 # the recording draws a horizontal/vertical line through the whole range, so
 # the remaing black spots are those where the sensor never caught any
 # event. e.g. a black spot at 10/10 means that no event every had an x
 # coordinate of 10, and no event ever had a y coordinate of 10.
-# 
+#
+# With --density, the output is a density map instead: the number of frames
+# (or sequence starts) per sensor cell, saved as .npy file with the raw
+# counts and as log-scaled png.
+#
+
+from __future__ import print_function
 
 OUTPUT_FILE="heatmap.png"
 
+import argparse
 import evemu
 import sys
 import os
 import math
-from PIL import Image
-import array
+import numpy
 
-def main(argv):
-    d = evemu.Device(argv[1], create=False)
+sys.path.append("..")
+from shared.density import DensityGrid, SparseGrid
+from shared.parallel import imap_files
+
+def get_coordinates(path, use_mt, only_slot = None):
+    """
+    Return the tuple (xs, ys, xrange, yrange) with the numpy arrays of all
+    x and y coordinates in the recording and the (min, max) axis ranges
+    of the device.
 
-    locations = {}
-    x, y = 0, 0
+    If only_slot is not None, only the coordinates in that slot are used
+    (multitouch only).
+    """
+    d = evemu.Device(path, create=False)
 
+    if use_mt:
+        xaxis, yaxis = "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y"
+    else:
+        xaxis, yaxis = "ABS_X", "ABS_Y"
+
+    xs, ys = [], []
+    slot = 0
     for e in d.events():
-        if e.matches("EV_ABS", "ABS_X"):
-            x = e.value
-        elif e.matches("EV_ABS", "ABS_Y"):
-            y = e.value
+        if only_slot is not None and slot != only_slot and \
+           not e.matches("EV_ABS", "ABS_MT_SLOT"):
+            continue
+
+        if e.matches("EV_ABS", xaxis):
+            xs.append(e.value)
+        elif e.matches("EV_ABS", yaxis):
+            ys.append(e.value)
+        elif e.matches("EV_ABS", "ABS_MT_SLOT"):
+            slot = e.value
+
+    xrange = (d.get_abs_minimum(xaxis), d.get_abs_maximum(xaxis))
+    yrange = (d.get_abs_minimum(yaxis), d.get_abs_maximum(yaxis))
+
+    return (numpy.array(xs, dtype=numpy.int64), numpy.array(ys, dtype=numpy.int64),
+            xrange, yrange)
+
+def axis_range(values, ranges):
+    """
+    Return the (min, max) tuple covering all axis ranges and all values,
+    adjusting for out-of-range coordinates
+    """
+    vmin = min(r[0] for r in ranges)
+    vmax = max(r[1] for r in ranges)
+    if len(values) > 0:
+        vmin = min(vmin, int(values.min()))
+        vmax = max(vmax, int(values.max()))
+    return vmin, vmax
+
+def coverage_mask(values, vmin, vmax):
+    """
+    Return a boolean array for the range [vmin, vmax] where each element
+    is True if that value occurs in values
+    """
+    mask = numpy.zeros(vmax - vmin + 1, dtype=bool)
+    mask[values - vmin] = True
+    return mask
+
+def get_density_points(path, use_mt, starts_only = False):
+    """
+    Return the tuple (xs, ys) with the numpy arrays of the touch positions
+    in each frame of the recording, one position per touch and frame. If
+    starts_only is True, only the first position of each touch is used.
+    """
+    d = evemu.Device(path, create=False)
+
+    if use_mt:
+        xaxis, yaxis = "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y"
+    else:
+        xaxis, yaxis = "ABS_X", "ABS_Y"
+
+    # per slot: [ touching, new touch, x, y ], single-touch uses slot 0
+    slots = { 0: [False, False, None, None] }
+    slot = 0
+    xs, ys = [], []
+    for e in d.events():
+        s = slots.setdefault(slot, [False, False, None, None])
+        if e.matches("EV_ABS", xaxis):
+            s[2] = e.value
+        elif e.matches("EV_ABS", yaxis):
+            s[3] = e.value
+        elif use_mt and e.matches("EV_ABS", "ABS_MT_SLOT"):
+            slot = e.value
+        elif use_mt and e.matches("EV_ABS", "ABS_MT_TRACKING_ID") or \
+             not use_mt and e.matches("EV_KEY", "BTN_TOUCH"):
+            touching = e.value != -1 if use_mt else e.value != 0
+            s[1] = touching and not s[0]
+            s[0] = touching
         elif e.matches("EV_SYN", "SYN_REPORT"):
-            val = locations.get((x, y), 0)
-            locations[(x, y)] = val + 1
-
-    xmax = d.get_abs_maximum("ABS_X")
-    xmin = d.get_abs_minimum("ABS_X")
-    ymax = d.get_abs_maximum("ABS_Y") 
-    ymin = d.get_abs_minimum("ABS_Y")
-
-    # adjust for out-of-range coordinates
-    xmax = max([x for (x, y) in locations.keys()] + [xmax])
-    ymax = max([y for (x, y) in locations.keys()] + [ymax])
-    xmin = min([x for (x, y) in locations.keys()] + [xmin])
-    ymin = min([y for (x, y) in locations.keys()] + [ymin])
-
-    w = xmax - xmin
-    h = ymax - ymin
-    stride = w
-
-    xs = [x for (x, y) in locations.keys()]
-    ys = [y for (x, y) in locations.keys()]
-    xs.sort()
-    ys.sort()
-
-    xs = set(range(xmin, xmax)) - set(xs)
-    ys = set(range(ymin, ymax)) - set(ys)
-
-    # xs and ys contain all x/y coordinates that were never reached anywhere
-    imgdata = [255] * (stride * (h + 1))
-
-    for x in xs:
-        px = x - xmin
-        for py in range(0, h):
-            imgdata[py * stride + px] = 0
-
-    for y in ys:
-        py = y - ymin
-        for px in range(0, w):
-            imgdata[py * stride + px] = 0
-
-    im = Image.new('L', (w, h + 1))
-    im.putdata(imgdata)
-    im.save(OUTPUT_FILE)
+            for s in slots.values():
+                if not s[0] or s[2] is None or s[3] is None:
+                    continue
+                if starts_only and not s[1]:
+                    continue
+                xs.append(s[2])
+                ys.append(s[3])
+                s[1] = False
+
+    return numpy.array(xs, dtype=numpy.int64), numpy.array(ys, dtype=numpy.int64)
+
+class _DensityCollector(object):
+    """
+    Picklable per-file function for the worker processes, returns the
+    SparseGrid of one recording
+    """
+    def __init__(self, use_mt, starts_only, xrange, yrange, binsize):
+        self.use_mt = use_mt
+        self.starts_only = starts_only
+        self.xrange = xrange
+        self.yrange = yrange
+        self.binsize = binsize
+
+    def __call__(self, path):
+        xs, ys = get_density_points(path, self.use_mt, self.starts_only)
+        grid = SparseGrid(self.xrange, self.yrange, self.binsize)
+        grid.add(xs, ys)
+        return grid
+
+def density_map(args, use_mt):
+    """
+    Accumulate the density of all recordings into one DensityGrid and
+    write it to <prefix>.npy and <prefix>.png. The grid covers the axis
+    ranges of the first recording, positions outside are counted in the
+    border cells.
+    """
+    d = evemu.Device(args.path[0], create=False)
+    if use_mt:
+        xaxis, yaxis = "ABS_MT_POSITION_X", "ABS_MT_POSITION_Y"
+    else:
+        xaxis, yaxis = "ABS_X", "ABS_Y"
+    xrange = (d.get_abs_minimum(xaxis), d.get_abs_maximum(xaxis))
+    yrange = (d.get_abs_minimum(yaxis), d.get_abs_maximum(yaxis))
+
+    npy = "{}.npy".format(args.density_output)
+    png = "{}.png".format(args.density_output)
+    grid = DensityGrid(xrange, yrange, args.binsize,
+                       path=npy if args.memmap else None)
+
+    collect = _DensityCollector(use_mt, args.density == "starts",
+                                xrange, yrange, args.binsize)
+    for path, partial, error in imap_files(collect, args.path, args.jobs):
+        grid.merge(partial)
+
+    grid.save(npy)
+    h, w = grid.shape
+    from PIL import Image
+    im = Image.frombuffer('L', (w, h), grid.log_image(), 'raw', 'L', 0, 1)
+    im.save(png)
+
+    print("{} {} in {}x{} cells of {} units, max {} per cell".format(
+          grid.count, args.density, w, h, args.binsize, grid.max()))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Draw the sensor coverage of the recordings")
+    parser.add_argument("path", metavar="recording", nargs="+",
+                        help="Path to evemu recording, all recordings are merged")
+    parser.add_argument("--mt", action="store_true",
+                        help="Use ABS_MT_POSITION_X/Y instead of ABS_X/ABS_Y")
+    parser.add_argument("--slot", action="store", type=int, default=None,
+                        help="Only use the coordinates of this slot (implies --mt)")
+    parser.add_argument("--output", action="store", default=OUTPUT_FILE,
+                        help="Output file name (default {})".format(OUTPUT_FILE))
+    parser.add_argument("--density", choices=["frames", "starts"], default=None,
+                        help="Draw a density map of the touch positions in each frame, "
+                             "or of the first position of each touch, instead of the coverage")
+    parser.add_argument("--binsize", action="store", type=int, default=1,
+                        help="Density map cell size in device units (default 1)")
+    parser.add_argument("--density-output", action="store", default="density",
+                        help="Density map file prefix, writes <prefix>.npy and <prefix>.png "
+                             "(default density)")
+    parser.add_argument("--memmap", action="store_true",
+                        help="Accumulate the density map in the memory-mapped .npy file "
+                             "instead of in memory")
+    parser.add_argument("--jobs", "-j", action="store", type=int, default=1,
+                        help="Number of worker processes for --density (default 1)")
+    args = parser.parse_args(argv[1:])
+
+    use_mt = args.mt or args.slot is not None
+
+    if args.density is not None:
+        density_map(args, use_mt)
+        return
+
+    xs, ys, xranges, yranges = [], [], [], []
+    for path in args.path:
+        x, y, xrange, yrange = get_coordinates(path, use_mt, args.slot)
+        xs.append(x)
+        ys.append(y)
+        xranges.append(xrange)
+        yranges.append(yrange)
+
+    xs = numpy.concatenate(xs)
+    ys = numpy.concatenate(ys)
+    xmin, xmax = axis_range(xs, xranges)
+    ymin, ymax = axis_range(ys, yranges)
+
+    xseen = coverage_mask(xs, xmin, xmax)
+    yseen = coverage_mask(ys, ymin, ymax)
+
+    print("x: {} of {} values reached".format(xseen.sum(), len(xseen)))
+    print("y: {} of {} values reached".format(yseen.sum(), len(yseen)))
+
+    # a pixel is white if both its x and its y coordinate were reached
+    imgdata = (yseen[:, numpy.newaxis] & xseen[numpy.newaxis, :]).astype(numpy.uint8)
+    imgdata *= 255
+
+    h, w = imgdata.shape
+    from PIL import Image
+    im = Image.frombuffer('L', (w, h), imgdata, 'raw', 'L', 0, 1)
+    im.save(args.output)
 
 if __name__ == "__main__":
     if len(sys.argv) == 1:
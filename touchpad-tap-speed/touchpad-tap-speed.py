@@ -10,12 +10,18 @@ import numpy
 sys.path.append("..")
 from shared import *
 from shared.gnuplot import *
+from shared import stats
+from shared.accumulators import Histogram
+from shared.decimate import add_decimation_args, new_point_decimator, decimated_data
 
 class TapSequence(object):
     def __init__(self):
         pass
 
 class TouchpadTapSpeed(EventProcessor):
+    # the other arguments only change the output
+    cache_args = [ "max_time", "max_move" ]
+
     def add_args(self, parser):
         parser.description = (""
                 "Process all touch sequences and calculate the time between "
@@ -30,6 +36,9 @@ class TouchpadTapSpeed(EventProcessor):
         parser.add_argument("--sort-by-mm", action="store_true", help="Sort by mm rather than time")
         parser.add_argument("--use-location", action="store_true",
                             help="Only print the start location for each tap")
+        parser.add_argument("--binary", action="store_true",
+                            help="Write the data files in gnuplot's binary format")
+        add_decimation_args(parser)
 
     def process_one_file(self, f, args):
         """
@@ -39,20 +48,17 @@ class TouchpadTapSpeed(EventProcessor):
         Returns
         -------
          ( times, dist, locations )
-                where times[ms] is the count of events for sequences with a
-                duration of ms
-                where dist[d] is the count of events for sequences with a
-                movement distances of d (in 0.1 mm)
-                where locations[i] is the (x, y) tuple of finger down for
-                all detected sequences
+                where times is a Histogram of the sequence durations in ms
+                where dist is a Histogram of the sequence movement
+                distances (in 0.1 mm)
+                where locations[i] is the TapSequence with the finger
+                down location for all detected sequences
         """
-        d = evemu.Device(f, create=False)
-
-        seqs = TouchSequence.create_from_recording(d)
+        d, seqs = load_recording(f)
         singles = [s for s in seqs if s.is_single and s.points and s.buttons is None]
 
-        mm = [ 0 ] * (args.max_move + 1) * 10
-        times = [ 0 ] * (args.max_time + 1)
+        mm = []
+        times = []
         locations = []
 
         for s in singles:
@@ -88,8 +94,8 @@ class TouchpadTapSpeed(EventProcessor):
 
             dist = max_move
 
-            mm[int(dist * 10)] += 1
-            times[ms] += 1
+            mm.append(int(dist * 10))
+            times.append(ms)
 
             ts = TapSequence()
             ts.location = first.percent
@@ -97,92 +103,103 @@ class TouchpadTapSpeed(EventProcessor):
             ts.ms = ms
             locations.append(ts)
 
-        return times, mm, locations
+        htimes = Histogram()
+        htimes.add(times)
+        hmm = Histogram()
+        hmm.add(mm)
+
+        return htimes, hmm, locations
 
     def plot_distance(self, args, mms, g):
         g.comment("# maximum distance {}mm".format(args.max_move))
         g.comment("# maximum time {}ms".format(args.max_time))
         g.labels("movement distance (in 0.1mm)", "count")
-        for mm, count in enumerate(mms):
-            g.data("{} {}".format(mm, count))
+        g.data(numpy.column_stack((numpy.arange(len(mms)), mms)))
 
         g.plot("using 1:2 notitle")
 
+        if stats.total(mms) == 0:
+            return
+
         # mean of distances
-        flat = [ [idx] * count for idx, count in enumerate(mms) ]
-        flat = numpy.concatenate(flat)
-        mean = numpy.mean(flat)
+        mean = stats.mean(mms)
         g.plot("{}, t title 'mean ({:.1f})'".format(mean, mean))
 
         tmin, tmax = 0, max(mms)
         # 50, 90, 95 percentiles
-        percentiles = numpy.percentile(flat, [50, 90, 95])
+        percentiles = stats.percentiles(mms, [50, 90, 95])
         g.cmd("set parametric")
         g.cmd("set trange [{}:{}]".format(tmin, tmax))
         g.plot("{}, t title '50% ({:3.1f})'".format(percentiles[0], percentiles[0]))
         g.plot("{}, t title '90% ({:3.1f})'".format(percentiles[1], percentiles[1]))
         g.plot("{}, t title '95% ({:3.1f})'".format(percentiles[2], percentiles[2]))
 
-    def plot_locations(self, args, sequences, g):
+    def write_locations(self, sequences, g, decimator = None):
+        locations = numpy.array([ ts.location for ts in sequences ], dtype=numpy.float64)
+        locations = locations.reshape(-1, 2) * 100
+        if decimator is None:
+            g.data(locations)
+        else:
+            decimator.add(locations[:, 0], locations[:, 1])
+
+    def plot_locations(self, args, g, decimator = None):
         g.labels("x", "y")
         g.ranges("0:100", "0:100")
-        for ts in sequences:
-            x, y = ts.location
-            g.data("{} {}".format(x * 100, y * 100))
-        g.plot("using 1:2 notitle")
+        if decimator is None:
+            g.plot("using 1:2 notitle")
+        else:
+            data, comment, using = decimated_data(decimator)
+            g.comment(comment)
+            g.data(data)
+            g.plot(using)
 
     def plot_times(self, args, times, g):
         g.comment("# maximum distance {}mm".format(args.max_move))
         g.comment("# maximum time {}ms".format(args.max_time))
 
         g.labels("press-release time (ms)", "count")
-        for ms, count in enumerate(times):
-            g.data("{} {}".format(ms, count))
+        g.data(numpy.column_stack((numpy.arange(len(times)), times)))
 
         g.plot("using 1:2 notitle")
 
+        if stats.total(times) == 0:
+            return
+
         # mean of times distances
-        flat = [ [idx] * count for idx, count in enumerate(times) ]
-        flat = numpy.concatenate(flat)
-        mean = numpy.mean(flat)
+        mean = stats.mean(times)
         tmin, tmax = 0, max(times)
         g.cmd("set parametric")
         g.cmd("set trange [{}:{}]".format(tmin, tmax))
         g.plot("{}, t title 'mean ({:.1f})'".format(mean, mean))
 
         # 50, 90, 95 percentiles
-        percentiles = numpy.percentile(flat, [50, 90, 95])
+        percentiles = stats.percentiles(times, [50, 90, 95])
         g.plot("{}, t title '50% ({:3.1f})'".format(percentiles[0], percentiles[0]))
         g.plot("{}, t title '90% ({:3.1f})'".format(percentiles[1], percentiles[1]))
         g.plot("{}, t title '95% ({:3.1f})'".format(percentiles[2], percentiles[2]))
 
+    def write_dist_to_times(self, sequences, g):
+        distances = [s.mm * 10 for s in sequences]
+        times = [s.ms for s in sequences]
+        g.data(numpy.array([times, distances], dtype=numpy.float64).T)
+
     def plot_dist_to_times(self, args, sequences, g):
         g.labels("press-release time (ms)", "movement distance (in 0.1mm)")
 
-        distances = []
-        times = []
+        distances = numpy.array([s.mm * 10 for s in sequences])
+        times = numpy.array([s.ms for s in sequences])
 
-        g.comment("# time(ms) dist(0.1mm)")
-        for s in sequences:
-            d = s.mm * 10
-            t = s.ms
-            distances.append(d)
-            times.append(t)
-            g.data("{} {}".format(t, d))
+        if len(sequences) == 0:
+            g.plot("using 1:2 notitle")
+            return
 
         # 50, 90, 95 percentiles
-        pcs = zip(numpy.percentile(times, [50, 90, 95]),
-                 numpy.percentile(distances, [50, 90, 95]))
-
-        # The pedestrian approach. Count how many sequences fit into the
-        # (t, d) rectangle defined by the 50, 90, 95 percentiles
-        counts = [ 0 ] * len(pcs)
-        for s in sequences:
-            d = s.mm * 10
-            t = s.ms
-            for idx, pc in enumerate(pcs):
-                if t < pc[0] and d < pc[1]:
-                    counts[idx] += 1
+        pcs = list(zip(numpy.percentile(times, [50, 90, 95]),
+                       numpy.percentile(distances, [50, 90, 95])))
+
+        # Count how many sequences fit into the (t, d) rectangle defined
+        # by the 50, 90, 95 percentiles
+        counts = stats.count_in_rectangles(times, distances, pcs)
 
         objno = len(pcs)
         color =  [ 0x20, 0x80, 0x40 ]
@@ -197,34 +214,34 @@ class TouchpadTapSpeed(EventProcessor):
         g.plot("using 1:2 notitle")
 
     def process(self, args):
-
-        times = [ 0 ] * (args.max_time + 1)
-        mms = [ 0 ] * (args.max_move + 1) * 10
-        sequences = []
-
         gnuplot_times, gnuplot_dist, gnuplot_loc, gnuplot_t2d = \
-            GnuPlot.from_object(self, suffixes = ['times', 'distance', 'location', "time2dist"])
-
-        for f in self.sourcefiles:
-            try:
-                t, m, s = self.process_one_file(f, args)
-                times = map(lambda x, y : x + y, times, t)
-                mms = map(lambda x, y : x + y, mms, m)
+            GnuPlot.from_object(self, suffixes = ['times', 'distance', 'location', "time2dist"],
+                                binary = args.binary, background = True)
+
+        times, mms, sequences = Histogram(), Histogram(), []
+        decimator = None
+        if args.decimate != "none":
+            decimator = new_point_decimator(args, (0, 100), (0, 100))
+
+        # The per-tap data is written by the background writers while the
+        # next recording is parsed, the histograms need all recordings
+        with gnuplot_loc as gl, gnuplot_t2d as gt:
+            gt.comment("# time(ms) dist(0.1mm)")
+            for f, (t, m, s) in self.map_files(args):
+                times.merge(t)
+                mms.merge(m)
                 sequences += s
-            except DeviceError as e:
-                print("Skipping {} with error: {}".format(f, e))
+                self.write_locations(s, gl, decimator)
+                self.write_dist_to_times(s, gt)
 
-        with gnuplot_dist as g:
-            self.plot_distance(args, mms, g)
+            self.plot_locations(args, gl, decimator)
+            self.plot_dist_to_times(args, sequences, gt)
 
-        with gnuplot_loc as g:
-            self.plot_locations(args, sequences, g)
+        with gnuplot_dist as g:
+            self.plot_distance(args, mms.counts(0, (args.max_move + 1) * 10), g)
 
         with gnuplot_times as g:
-            self.plot_times(args, times, g)
-
-        with gnuplot_t2d as g:
-            self.plot_dist_to_times(args, sequences, g)
+            self.plot_times(args, times.counts(0, args.max_time + 1), g)
 
 def main(sysargs):
     TouchpadTapSpeed().run()